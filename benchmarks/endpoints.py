@@ -0,0 +1,267 @@
+"""
+Endpoint benchmarks
+usage: `python -m benchmarks.endpoints [--mode inprocess|uvicorn] [--requests 200] [--output results.json]
+[--baseline previous.json]`
+* Sends each scenario's requests (see `scenarios`) either in-process through `TestClient`, one at a time, or over HTTP
+to a uvicorn server launched for the run, from `--concurrency` connections
+* Reports p50, p95 and p99 latency, requests per second and peak RSS for each scenario, and saves them as JSON
+* With `--baseline`, compares the run with a saved one and exits with an error if any scenario has regressed by more
+than the limits in `--thresholds` (default: `benchmarks/thresholds.json`)
+"""
+# standard imports
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows: peak RSS is not reported for in-process runs
+    resource = None
+
+# local imports
+from benchmarks.scenarios import select_scenarios, summarise
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_THRESHOLDS = Path(__file__).resolve().parent / "thresholds.json"
+
+
+def own_peak_rss():
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def process_peak_rss(pid):
+    """
+    Peak RSS in bytes of a process and its children, read from /proc, or None where there is no /proc.
+    """
+    total = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as file:
+            pids += [int(child) for child in file.read().split()]
+    except OSError:
+        return None
+    for process in pids:
+        try:
+            with open(f"/proc/{process}/status") as file:
+                for line in file:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+def run_inprocess(scenarios, requests, warmup):
+    # imported here, so uvicorn runs do not load the app into the benchmark process
+    from fastapi.testclient import TestClient
+    from main import app
+
+    results = {}
+    with TestClient(app) as client:
+        for scenario in scenarios:
+            for index in range(warmup):
+                client.post(scenario.path, json=scenario.request_body(index))
+            latencies, errors = [], 0
+            started = time.perf_counter()
+            for index in range(requests):
+                body = scenario.request_body(index)
+                request_started = time.perf_counter()
+                response = client.post(scenario.path, json=body)
+                latency = time.perf_counter() - request_started
+                if response.status_code < 400:
+                    latencies.append(latency)
+                else:
+                    errors += 1
+            elapsed = time.perf_counter() - started
+            results[scenario.name] = summarise(latencies, errors, elapsed, own_peak_rss())
+            print_summary(scenario.name, results[scenario.name])
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class UvicornServer:
+    """
+    A uvicorn server running the app in a child process, for the length of a `with` block.
+    """
+
+    def __init__(self, workers=1):
+        self.port = free_port()
+        self.workers = workers
+        self.process = None
+
+    def __enter__(self):
+        environment = dict(os.environ, DGC_LOG_LEVEL="WARNING")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--workers", str(self.workers), "--no-access-log"],
+            cwd=PROJECT_ROOT, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("uvicorn exited before it was ready")
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=1)
+                connection.request("GET", "/health/ready")
+                if connection.getresponse().status == 200:
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError("uvicorn was not ready within 60 seconds")
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def post(connection, path, body):
+    payload = json.dumps(body)
+    connection.request("POST", path, body=payload, headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def run_uvicorn(scenarios, requests, warmup, concurrency, workers):
+    results = {}
+    with UvicornServer(workers) as server:
+        local = threading.local()
+
+        def send(scenario, index):
+            if getattr(local, "connection", None) is None:
+                local.connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=60)
+            started = time.perf_counter()
+            try:
+                status = post(local.connection, scenario.path, scenario.request_body(index))
+            except (OSError, http.client.HTTPException):
+                local.connection.close()
+                local.connection = None
+                return None
+            latency = time.perf_counter() - started
+            return latency if status < 400 else None
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for scenario in scenarios:
+                list(pool.map(lambda index: send(scenario, index), range(warmup)))
+                started = time.perf_counter()
+                outcomes = list(pool.map(lambda index: send(scenario, index), range(requests)))
+                elapsed = time.perf_counter() - started
+                latencies = [latency for latency in outcomes if latency is not None]
+                results[scenario.name] = summarise(
+                    latencies, len(outcomes) - len(latencies), elapsed, process_peak_rss(server.process.pid))
+                print_summary(scenario.name, results[scenario.name])
+    return results
+
+
+def print_summary(name, summary):
+    print(f'{name:<40}' + "".join(
+        f'{key}={value}  ' for key, value in summary.items() if value is not None))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, thresholds):
+    """
+    Returns a message for every scenario metric which has regressed beyond the thresholds, compared with the baseline.
+    """
+    regressions = []
+    for name, summary in results["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        for metric, limit in thresholds.get("max_increase", {}).items():
+            if previous.get(metric) and summary.get(metric) is not None:
+                change = summary[metric] / previous[metric] - 1
+                if change > limit:
+                    regressions.append(
+                        f'{name} {metric} rose {change:.0%} ({previous[metric]} to {summary[metric]}), over {limit:.0%}')
+        for metric, limit in thresholds.get("max_decrease", {}).items():
+            if previous.get(metric) and summary.get(metric) is not None:
+                change = 1 - summary[metric] / previous[metric]
+                if change > limit:
+                    regressions.append(
+                        f'{name} {metric} fell {change:.0%} ({previous[metric]} to {summary[metric]}), over {limit:.0%}')
+        if summary["errors"] > previous["errors"]:
+            regressions.append(f'{name} had {summary["errors"]} errors, where it had {previous["errors"]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API endpoints")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess",
+                        help="Send requests through TestClient in this process, or over HTTP to a uvicorn server")
+    parser.add_argument("--scenarios", nargs="*", help="Glob patterns of scenarios to run, eg 'uk-who-*' (default: all)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests timed per scenario (default: 200)")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed requests first per scenario (default: 10)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Connections in uvicorn mode (default: 4)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (default: 1)")
+    parser.add_argument("--output", help="File to save the results to, as JSON")
+    parser.add_argument("--baseline", help="Saved results to compare with")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS,
+                        help="JSON file of the regressions allowed (default: benchmarks/thresholds.json)")
+    arguments = parser.parse_args()
+
+    scenarios = select_scenarios(arguments.scenarios)
+    if arguments.mode == "inprocess":
+        scenario_results = run_inprocess(scenarios, arguments.requests, arguments.warmup)
+    else:
+        scenario_results = run_uvicorn(
+            scenarios, arguments.requests, arguments.warmup, arguments.concurrency, arguments.workers)
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "mode": arguments.mode,
+        "requests": arguments.requests,
+        "concurrency": 1 if arguments.mode == "inprocess" else arguments.concurrency,
+        "workers": arguments.workers if arguments.mode == "uvicorn" else None,
+        "scenarios": scenario_results,
+    }
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(results, indent=4))
+        print(f'Saved results to {arguments.output}.')
+
+    if arguments.baseline:
+        baseline = json.loads(Path(arguments.baseline).read_text())
+        thresholds = json.loads(Path(arguments.thresholds).read_text())
+        regressions = compare(baseline, results, thresholds)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions compared with {arguments.baseline}.')
+
+
+if __name__ == "__main__":
+    main()
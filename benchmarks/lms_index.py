@@ -0,0 +1,231 @@
+"""
+LMS lookup microbenchmark
+usage: `python -m benchmarks.lms_index [--lookups 2000] [--ages 100000] [--output results.json]`
+* Times finding the L, M and S at random ages from the precomputed `LMS_INDEX` against the lookups it replaced:
+    - single SDS: `rcpchgrowth.global_functions.sds_for_measurement` against the index-backed version rcpchgrowth calls
+    with `lms_index_enabled`
+    - whole `Measurement` calculations, with and without the index
+    - arrays of ages: `lms_for_group`, the vectorised lookup the index replaced, which chooses and searches the tables
+    on every call, against `LMSIndex.lms`. The tests check the index against it too
+* Reports the time per lookup or per array of each, and the speed up, and saves them as JSON
+"""
+# standard imports
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# third party imports
+import numpy as np
+
+# RCPCH imports
+from rcpchgrowth import global_functions, Measurement
+from rcpchgrowth.constants import TRISOMY_21, TURNERS, UK_WHO
+
+# local imports
+from services import calculation
+from services.lms_engine import (
+    LMS_INDEX, LMS_TABLES, trisomy_21_data_present, turner_data_present, UK_WHO_SEGMENTS, uk_who_segments)
+
+REFERENCE_MEASUREMENTS = [
+    ("uk-who", "height"), ("uk-who", "weight"), ("uk-who", "bmi"), ("uk-who", "ofc"),
+    ("trisomy-21", "height"), ("trisomy-21", "weight"), ("trisomy-21", "bmi"), ("trisomy-21", "ofc"),
+    ("turners-syndrome", "height"),
+]
+
+
+def cubic_interpolation(age, age_two_below, age_one_below, age_one_above, age_two_above,
+                        parameter_two_below, parameter_one_below, parameter_one_above, parameter_two_above):
+    """
+    Four point Lagrange interpolation, term for term as `rcpchgrowth.global_functions.cubic_interpolation`.
+    """
+    tt0 = age - age_two_below
+    tt1 = age - age_one_below
+    tt2 = age - age_one_above
+    tt3 = age - age_two_above
+
+    t01 = age_two_below - age_one_below
+    t02 = age_two_below - age_one_above
+    t03 = age_two_below - age_two_above
+
+    t12 = age_one_below - age_one_above
+    t13 = age_one_below - age_two_above
+    t23 = age_one_above - age_two_above
+
+    return parameter_two_below * tt1 * tt2 * tt3 / t01 / t02 / t03 - parameter_one_below * tt0 * tt2 * tt3 / t01 / \
+        t12 / t13 + parameter_one_above * tt0 * tt1 * tt3 / t02 / t12 / \
+        t23 - parameter_two_above * tt0 * tt1 * tt2 / t03 / t13 / t23
+
+
+def linear_interpolation(age, age_one_below, age_one_above, parameter_one_below, parameter_one_above):
+    """
+    Straight line interpolation, in the same order of operations as `scipy.interpolate.interp1d`.
+    """
+    slope = (parameter_one_above - parameter_one_below) / (age_one_above - age_one_below)
+    return slope * (age - age_one_below) + parameter_one_below
+
+
+def interpolate_lms(table, decimal_age):
+    """
+    Returns L, M and S arrays for each age from one reference table, interpolating between tabulated ages.
+    Ages outside the table return NaN.
+    """
+    decimal_age = np.asarray(decimal_age, dtype=float)
+    l = np.full(decimal_age.shape, np.nan)
+    m = np.full(decimal_age.shape, np.nan)
+    s = np.full(decimal_age.shape, np.nan)
+    ages = table.decimal_age
+    count = len(ages)
+    if count == 0:
+        return l, m, s
+
+    # the tabulated age at or below each age
+    below = np.searchsorted(ages, decimal_age, side="right") - 1
+    clipped = np.clip(below, 0, count - 1)
+    exact = (below >= 0) & (ages[clipped] == decimal_age)
+    l[exact] = table.l[clipped[exact]]
+    m[exact] = table.m[clipped[exact]]
+    s[exact] = table.s[clipped[exact]]
+
+    interpolated = ~exact & (below >= 0) & (below < count - 1)
+    cubic = interpolated & (below >= 1) & (below < count - 2)
+    linear = interpolated & ~cubic
+
+    index = below[cubic]
+    age = decimal_age[cubic]
+    for parameter, values in ((l, table.l), (m, table.m), (s, table.s)):
+        parameter[cubic] = cubic_interpolation(
+            age,
+            ages[index - 1], ages[index], ages[index + 1], ages[index + 2],
+            values[index - 1], values[index], values[index + 1], values[index + 2],
+        )
+
+    index = below[linear]
+    age = decimal_age[linear]
+    for parameter, values in ((l, table.l), (m, table.m), (s, table.s)):
+        parameter[linear] = linear_interpolation(
+            age, ages[index], ages[index + 1], values[index], values[index + 1])
+
+    return l, m, s
+
+
+def lms_for_group(reference, measurement_method, sex, decimal_age):
+    """
+    Returns L, M and S arrays for ages which share a reference, measurement method and sex.
+    """
+    l = np.full(decimal_age.shape, np.nan)
+    m = np.full(decimal_age.shape, np.nan)
+    s = np.full(decimal_age.shape, np.nan)
+    if reference == UK_WHO:
+        segment = uk_who_segments(decimal_age, measurement_method, sex)
+        groups = [
+            (segment == index, LMS_TABLES[(UK_WHO, name, measurement_method, sex)])
+            for index, (name, _) in enumerate(UK_WHO_SEGMENTS)
+        ]
+    elif reference == TURNERS:
+        groups = [(
+            turner_data_present(decimal_age, measurement_method, sex),
+            LMS_TABLES[(TURNERS, TURNERS, measurement_method, sex)]
+        )]
+    elif reference == TRISOMY_21:
+        groups = [(
+            trisomy_21_data_present(decimal_age, measurement_method, sex),
+            LMS_TABLES[(TRISOMY_21, TRISOMY_21, measurement_method, sex)]
+        )]
+    else:
+        raise ValueError("Incorrect reference supplied")
+    for mask, table in groups:
+        if mask.any():
+            l[mask], m[mask], s[mask] = interpolate_lms(table, decimal_age[mask])
+    return l, m, s
+
+
+def random_lookups(count, seed=0):
+    generator = random.Random(seed)
+    lookups = []
+    for _ in range(count):
+        reference, measurement_method = generator.choice(REFERENCE_MEASUREMENTS)
+        sex = "female" if reference == "turners-syndrome" else generator.choice(["male", "female"])
+        # ages every reference and measurement has data for
+        lookups.append((reference, measurement_method, sex, generator.uniform(1.05, 16.9)))
+    return lookups
+
+
+OBSERVATION_VALUES = {"height": 110, "weight": 20, "bmi": 16, "ofc": 50}
+
+
+def measurement(reference, measurement_method, sex, age):
+    birth_date = date(2000, 1, 1)
+    return {
+        "reference": reference, "measurement_method": measurement_method, "sex": sex, "birth_date": birth_date,
+        "observation_date": birth_date + timedelta(days=int(age * 365.25)), "gestation_weeks": 40,
+        "gestation_days": 0, "observation_value": OBSERVATION_VALUES[measurement_method],
+    }
+
+
+def seconds_per_call(function, calls):
+    started = time.perf_counter()
+    for arguments in calls:
+        function(*arguments)
+    return (time.perf_counter() - started) / len(calls)
+
+
+def time_sds(lookups):
+    calls = [(reference, age, measurement_method, 20.0, sex) for reference, measurement_method, sex, age in lookups]
+    return (
+        seconds_per_call(global_functions.sds_for_measurement, calls),
+        seconds_per_call(calculation.sds_for_measurement, calls))
+
+
+def time_measurements(lookups):
+    calls = [(measurement(*lookup),) for lookup in lookups]
+    timings = []
+    for enabled in (False, True):
+        calculation.use_lms_index(enabled)
+        timings.append(seconds_per_call(lambda arguments: Measurement(**arguments).measurement, calls))
+    calculation.use_lms_index(calculation.settings.lms_index_enabled)
+    return tuple(timings)
+
+
+def time_arrays(ages, repeats=5):
+    decimal_age = np.random.default_rng(0).uniform(-0.3, 20.5, ages)
+    calls = [(reference, measurement_method, sex) for reference, measurement_method in REFERENCE_MEASUREMENTS
+             for sex in ["male", "female"]] * repeats
+    return (
+        seconds_per_call(lambda *group: lms_for_group(*group, decimal_age), calls),
+        seconds_per_call(lambda *group: LMS_INDEX[group].lms(decimal_age), calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time L, M and S lookups with and without the LMS index")
+    parser.add_argument("--lookups", type=int, default=2000, help="Number of single lookups to time (default: 2000)")
+    parser.add_argument("--ages", type=int, default=100000, help="Number of ages in each array (default: 100000)")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    arguments = parser.parse_args()
+
+    lookups = random_lookups(arguments.lookups)
+    results = {}
+    for name, unit, (per_call, indexed) in [
+        ("sds_for_measurement", "us", time_sds(lookups)),
+        ("measurement", "us", time_measurements(lookups)),
+        (f"lms_for_age_{arguments.ages}_ages", "ms", time_arrays(arguments.ages)),
+    ]:
+        scale = 1e6 if unit == "us" else 1e3
+        results[name] = {
+            f"per_call_{unit}": per_call * scale, f"indexed_{unit}": indexed * scale, "speed_up": per_call / indexed}
+
+    print(f'{"lookup":<32}{"per call":>12}{"indexed":>12}{"speed up":>10}')
+    for name, result in results.items():
+        per_call, indexed, speed_up = result.values()
+        unit = next(iter(result))[len("per_call_"):]
+        print(f'{name:<32}{per_call:>10.2f}{unit}{indexed:>10.2f}{unit}{speed_up:>9.1f}x')
+
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(results, indent=4))
+        print(f'Saved results to {arguments.output}.')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Load test with a production-like mix of requests
+usage: `python -m benchmarks.load [--rates 20 50 100] [--duration 30] [--replay traffic.jsonl] [--output load.json]`
+* Sends a weighted mix of calculation, chart-coordinates and fictional-child-data requests across the UK-WHO, Turner
+and Trisomy 21 routes, so the many small calculations compete with the few large chart responses as they do in
+production. `--mix` sets the weights, eg `'*-calculation=90' '*-chart-coordinates=8' '*-fictional-child-data=2'`
+* `--replay` sends the requests of a JSONL file instead, one `{"path": ..., "body": {...}}` object per line, in order
+and repeating. `--record` writes the synthetic mix in that format, to be edited or replayed. The rows of a synthetic
+cohort written as NDJSON (`python cli.py generate-cohort`) can be replayed too, each sent to the `/calculation`
+endpoint of its reference
+* Open loop (`--rates`): requests arrive at random (Poisson) times at each rate in turn, whether or not earlier ones
+have been answered, and latency is measured from when each request was due, so a server falling behind shows up as
+queueing. Closed loop (`--concurrency`): each of that many connections sends its next request as soon as the last is
+answered
+* Reports latency percentiles, throughput, error rate and status codes per step and per route, and the first open loop
+rate at which the server saturated: it answered under 90% of the offered rate, more than 1% of requests failed, or the
+p99 latency went over `--slo-ms`
+* Runs against a uvicorn server started for the test, or an already running one given with `--url`
+"""
+# standard imports
+import argparse
+import fnmatch
+import http.client
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+# local imports
+from benchmarks.endpoints import UvicornServer, git_commit, process_peak_rss
+from benchmarks.scenarios import all_scenarios, percentile, REFERENCES
+
+DEFAULT_MIX = ["*-calculation=90", "*-chart-coordinates=8", "*-fictional-child-data=2"]
+
+# a step is saturated if the server answers less than this fraction of the offered rate
+MIN_THROUGHPUT_FRACTION = 0.9
+MAX_ERROR_RATE = 0.01
+
+# the calculation endpoint of each reference, by its name in cohort rows
+COHORT_PATHS = {name: f"{prefix}/calculation" for prefix, _, name in REFERENCES.values()}
+MEASUREMENT_FIELDS = [
+    "birth_date", "observation_date", "observation_value", "sex", "gestation_weeks", "gestation_days",
+    "measurement_method",
+]
+
+
+def parse_mix(mix):
+    """
+    Returns (scenario, weight) pairs from `pattern=weight` strings. A pattern's weight is split equally between the
+    scenarios it matches.
+    """
+    scenarios = all_scenarios()
+    weights = {}
+    for item in mix:
+        pattern, _, weight = item.rpartition("=")
+        if not pattern:
+            raise ValueError(f"{item} is not of the form pattern=weight")
+        matched = [scenario for scenario in scenarios if fnmatch.fnmatch(scenario.name, pattern)]
+        if not matched:
+            raise ValueError(f"{pattern} matches no scenarios")
+        for scenario in matched:
+            weights[scenario.name] = weights.get(scenario.name, 0) + float(weight) / len(matched)
+    return [(scenario, weights[scenario.name]) for scenario in scenarios if weights.get(scenario.name)]
+
+
+def synthetic_traffic(mix, seed=None):
+    """
+    Yields (path, body) endlessly, picking each request's scenario at random by weight.
+    """
+    weighted = parse_mix(mix)
+    scenarios = [scenario for scenario, _ in weighted]
+    weights = [weight for _, weight in weighted]
+    generator = random.Random(seed)
+    for index in itertools.count():
+        scenario = generator.choices(scenarios, weights)[0]
+        yield scenario.path, scenario.request_body(index)
+
+
+def replay_request(request):
+    """
+    The (path, body) of one line of a replayed file: a recorded request, or a cohort row.
+    """
+    if "path" in request:
+        return request["path"], request["body"]
+    body = {field: request[field] for field in MEASUREMENT_FIELDS if field in request}
+    return COHORT_PATHS[request["reference"]], body
+
+
+def replay_traffic(path):
+    """
+    Yields (path, body) endlessly from a JSONL file of recorded requests or cohort rows.
+    """
+    requests = []
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                requests.append(replay_request(json.loads(line)))
+    if not requests:
+        raise ValueError(f"{path} has no requests")
+    return itertools.cycle(requests)
+
+
+def record_traffic(traffic, path, count):
+    with open(path, "w") as file:
+        for request_path, body in itertools.islice(traffic, count):
+            file.write(json.dumps({"path": request_path, "body": body}) + "\n")
+
+
+class Client:
+    """
+    Sends requests to the server, keeping one connection open per thread.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._local = threading.local()
+
+    def send(self, path, body, due):
+        """
+        Posts a request and returns (path, status, latency), where status is None if the connection failed, and
+        latency is measured from `due`.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            status = None
+        return path, status, time.perf_counter() - due
+
+
+def run_open_loop(client, traffic, rate, duration, max_in_flight, seed=None):
+    """
+    Starts requests at random times averaging `rate` per second for `duration` seconds, without waiting for earlier
+    ones to be answered (up to `max_in_flight` at once; beyond that they queue here, and the wait counts as latency).
+    """
+    arrivals = random.Random(seed)
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        start = time.perf_counter()
+        due = start
+        while due - start < duration:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            path, body = next(traffic)
+            futures.append(pool.submit(client.send, path, body, due))
+            due += arrivals.expovariate(rate)
+        outcomes = [future.result() for future in futures]
+    return outcomes, time.perf_counter() - start
+
+
+def run_closed_loop(client, traffic, concurrency, duration):
+    """
+    Keeps `concurrency` requests in flight for `duration` seconds, each connection sending its next request as soon as
+    the last one is answered.
+    """
+    lock = threading.Lock()
+    outcomes = []
+    start = time.perf_counter()
+
+    def worker():
+        while time.perf_counter() - start < duration:
+            with lock:
+                path, body = next(traffic)
+            outcome = client.send(path, body, time.perf_counter())
+            with lock:
+                outcomes.append(outcome)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes, time.perf_counter() - start
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        f"{name}_ms": round(percentile(latencies, fraction) * 1000, 3) if latencies else None
+        for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+    }
+
+
+def summarise_step(outcomes, elapsed, offered_rate=None):
+    """
+    Latency, throughput, errors and status codes over all the requests of a step, and per route.
+    """
+    def summary(selected):
+        answered = [latency for _, status, latency in selected if status is not None and status < 400]
+        errors = len(selected) - len(answered)
+        return dict(
+            requests=len(selected),
+            errors=errors,
+            error_rate=round(errors / len(selected), 4) if selected else 0,
+            requests_per_second=round(len(answered) / elapsed, 2),
+            statuses=dict(Counter(str(status) if status is not None else "connection-error"
+                                  for _, status, _ in selected)),
+            **latency_summary(answered),
+        )
+
+    step = summary(outcomes)
+    step["offered_rate"] = offered_rate
+    step["routes"] = {
+        path: summary([outcome for outcome in outcomes if outcome[0] == path])
+        for path in sorted({outcome[0] for outcome in outcomes})
+    }
+    return step
+
+
+def saturated(step, slo_ms):
+    """
+    Whether the server could not keep up with the offered rate of an open loop step.
+    """
+    return (
+        step["requests_per_second"] < step["offered_rate"] * MIN_THROUGHPUT_FRACTION
+        or step["error_rate"] > MAX_ERROR_RATE
+        or (step["p99_ms"] is not None and step["p99_ms"] > slo_ms)
+    )
+
+
+def print_step(label, step):
+    print(f'{label}: {step["requests_per_second"]} requests/s, {step["error_rate"]:.1%} errors, '
+          f'p50 {step["p50_ms"]} ms, p90 {step["p90_ms"]} ms, p99 {step["p99_ms"]} ms, max {step["max_ms"]} ms')
+    for path, route in step["routes"].items():
+        print(f'    {path:<36} {route["requests"]:>6} requests  {route["errors"]:>4} errors  '
+              f'p50 {route["p50_ms"]} ms  p99 {route["p99_ms"]} ms')
+
+
+def run(arguments, host, port, server_pid=None):
+    traffic = replay_traffic(arguments.replay) if arguments.replay else synthetic_traffic(arguments.mix, arguments.seed)
+    client = Client(host, port)
+    steps = []
+    saturation_rate = None
+    if arguments.rates:
+        for rate in arguments.rates:
+            outcomes, elapsed = run_open_loop(
+                client, traffic, rate, arguments.duration, arguments.max_in_flight, arguments.seed)
+            step = summarise_step(outcomes, elapsed, rate)
+            step["saturated"] = saturated(step, arguments.slo_ms)
+            steps.append(step)
+            print_step(f'{rate} requests/s offered', step)
+            if step["saturated"]:
+                saturation_rate = rate
+                print(f'Saturated at {rate} requests/s.')
+                if not arguments.keep_going:
+                    break
+    else:
+        outcomes, elapsed = run_closed_loop(client, traffic, arguments.concurrency, arguments.duration)
+        step = summarise_step(outcomes, elapsed)
+        step["concurrency"] = arguments.concurrency
+        steps.append(step)
+        print_step(f'{arguments.concurrency} connections', step)
+    peak_rss = process_peak_rss(server_pid) if server_pid else None
+    return {
+        "git_commit": git_commit(),
+        "traffic": arguments.replay or arguments.mix,
+        "duration": arguments.duration,
+        "steps": steps,
+        "saturation_rate": saturation_rate,
+        "server_peak_rss_mb": round(peak_rss / 2 ** 20, 1) if peak_rss else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API with a production-like mix of requests")
+    parser.add_argument("--rates", type=float, nargs="*",
+                        help="Open loop: requests per second to offer, one step each, until the server saturates")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Closed loop, if no --rates: connections sending requests back to back (default: 8)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per step (default: 30)")
+    parser.add_argument("--mix", nargs="*", default=DEFAULT_MIX,
+                        help="Weights of the scenarios, as pattern=weight (default: %(default)s)")
+    parser.add_argument("--replay",
+                        help="JSONL file of requests, or an NDJSON cohort, to send instead of the synthetic mix")
+    parser.add_argument("--record", help="Write the synthetic mix to this JSONL file and exit")
+    parser.add_argument("--record-count", type=int, default=1000, help="Requests to --record (default: 1000)")
+    parser.add_argument("--seed", type=int, help="Seed for the request mix and arrival times, to repeat a run")
+    parser.add_argument("--max-in-flight", type=int, default=128,
+                        help="Open loop: most requests in flight at once (default: 128)")
+    parser.add_argument("--slo-ms", type=float, default=1000,
+                        help="p99 latency above which a step counts as saturated (default: 1000)")
+    parser.add_argument("--keep-going", action="store_true", help="Run every rate, even after saturation")
+    parser.add_argument("--url", help="An already running server, eg http://127.0.0.1:8000 (default: start one)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes to start (default: 1)")
+    parser.add_argument("--output", help="File to save the results to, as JSON")
+    arguments = parser.parse_args()
+
+    if arguments.record:
+        record_traffic(synthetic_traffic(arguments.mix, arguments.seed), arguments.record, arguments.record_count)
+        print(f'Recorded {arguments.record_count} requests to {arguments.record}.')
+        return
+
+    if arguments.url:
+        url = urlsplit(arguments.url)
+        results = run(arguments, url.hostname, url.port or 80)
+    else:
+        with UvicornServer(arguments.workers) as server:
+            results = run(arguments, "127.0.0.1", server.port, server.process.pid)
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(results, indent=4))
+        print(f'Saved results to {arguments.output}.')
+    if not arguments.rates and results["steps"][0]["error_rate"] > MAX_ERROR_RATE:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
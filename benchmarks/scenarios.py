@@ -0,0 +1,115 @@
+"""
+The requests the benchmarks send, and helpers for summarising their timings
+* Each scenario is one endpoint of one reference. Its body varies with the request number, so calculations are not
+all answered from the result cache
+"""
+# standard imports
+import fnmatch
+import math
+
+REFERENCES = {
+    # reference: (URL prefix, sex, reference name in fictional child requests)
+    "uk-who": ("/uk-who", "male", "uk-who"),
+    "turner": ("/turner", "female", "turners-syndrome"),
+    "trisomy-21": ("/trisomy-21", "female", "trisomy-21"),
+}
+
+
+class Scenario:
+    def __init__(self, name, path, body):
+        self.name = name
+        self.path = path
+        self.body = body
+
+    def request_body(self, index):
+        return self.body(index)
+
+
+def calculation_body(sex):
+    def body(index):
+        return {
+            "birth_date": "2020-04-12",
+            "observation_date": "2028-06-12",
+            # 100.0 to 139.9 cm
+            "observation_value": round(100 + (index % 400) / 10, 1),
+            "sex": sex,
+            "gestation_weeks": 40,
+            "gestation_days": 0,
+            "measurement_method": "height",
+        }
+    return body
+
+
+def chart_coordinates_body(sex):
+    def body(index):
+        return {"sex": sex, "measurement_method": "height"}
+    return body
+
+
+def fictional_child_body(sex, reference):
+    def body(index):
+        return {
+            "measurement_method": "height",
+            "sex": sex,
+            "start_chronological_age": 2,
+            "end_age": 20,
+            "gestation_weeks": 40,
+            "gestation_days": 0,
+            "measurement_interval_type": "months",
+            "measurement_interval_number": 3,
+            "start_sds": round(-2 + (index % 40) / 10, 1),
+            "drift": False,
+            "drift_range": -0.05,
+            "noise": False,
+            "noise_range": 0.005,
+            "reference": reference,
+        }
+    return body
+
+
+def all_scenarios():
+    scenarios = []
+    for reference, (prefix, sex, reference_name) in REFERENCES.items():
+        scenarios += [
+            Scenario(f"{reference}-calculation", f"{prefix}/calculation", calculation_body(sex)),
+            Scenario(f"{reference}-chart-coordinates", f"{prefix}/chart-coordinates", chart_coordinates_body(sex)),
+            Scenario(f"{reference}-fictional-child-data", f"{prefix}/fictional-child-data",
+                     fictional_child_body(sex, reference_name)),
+        ]
+    return scenarios
+
+
+def select_scenarios(patterns=None):
+    """
+    The scenarios whose names match any of the glob `patterns`, or every scenario.
+    """
+    scenarios = all_scenarios()
+    if not patterns:
+        return scenarios
+    return [scenario for scenario in scenarios if any(fnmatch.fnmatch(scenario.name, pattern) for pattern in patterns)]
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarise(latencies, errors, elapsed, peak_rss_bytes=None):
+    """
+    Latency percentiles in milliseconds, throughput and peak memory for one scenario.
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "peak_rss_mb": round(peak_rss_bytes / 2 ** 20, 1) if peak_rss_bytes else None,
+    }
@@ -0,0 +1,66 @@
+"""
+Startup time benchmark
+usage: `python benchmarks/startup.py [--runs 5] [--max-import-seconds 5]`
+* Each run starts a fresh Python process and times importing `main`, running the startup events and serving the first
+`/` (openAPI spec) and `/uk-who/calculation` requests
+* Reports the fastest and median time of each step, and exits with an error if the median import time is over
+`--max-import-seconds`, so slow startup shows up in CI
+"""
+# standard imports
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# runs in the fresh process, printing the time of each step as JSON
+RUN = """
+import json, time
+start = time.perf_counter()
+timings = {}
+import main
+timings["import"] = time.perf_counter() - start
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    timings["startup"] = time.perf_counter() - start
+    assert client.get("/").status_code == 200
+    timings["first_openapi_request"] = time.perf_counter() - start
+    assert client.post("/uk-who/calculation", json={
+        "birth_date": "2020-04-12", "observation_date": "2028-06-12", "observation_value": 115,
+        "sex": "female", "gestation_weeks": 40, "gestation_days": 0, "measurement_method": "height",
+    }).status_code == 200
+    timings["first_calculation_request"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def run_once():
+    completed = subprocess.run(
+        [sys.executable, "-c", RUN], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a cold start of the server")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh processes to time (default: 5)")
+    parser.add_argument("--max-import-seconds", type=float, default=None,
+                        help="Exit with an error if the median import time is longer than this")
+    arguments = parser.parse_args()
+
+    runs = [run_once() for _ in range(arguments.runs)]
+    print(f'{"step (seconds since process start)":<36}{"fastest":>10}{"median":>10}')
+    for step in runs[0]:
+        times = [run[step] for run in runs]
+        print(f'{step:<36}{min(times):>10.3f}{statistics.median(times):>10.3f}')
+
+    median_import = statistics.median(run["import"] for run in runs)
+    if arguments.max_import_seconds is not None and median_import > arguments.max_import_seconds:
+        print(f'Median import time {median_import:.3f}s is over the limit of {arguments.max_import_seconds}s.')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
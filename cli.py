@@ -0,0 +1,159 @@
+"""
+Command line tools for building and maintaining the server's data files
+usage: `python cli.py --help`
+"""
+# standard imports
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# third party imports
+import numpy as np
+from pydantic import ValidationError
+
+# local / rcpch imports
+from schemas import CohortRequest
+from services import settings
+from services.chart_data_binary import convert_directory
+from services.cohorts import write_cohort
+from services.chart_data_store import chart_data_keys, ChartDataStore
+from services.chart_generation import chart_data_name, generate_chart_data
+
+
+def convert_chart_data(arguments):
+    precision = arguments.precision
+    if arguments.dtype == 'f' and precision is None:
+        # rcpchgrowth rounds chart coordinates to 4 decimal places
+        precision = 4
+    converted = convert_directory(
+        arguments.source, arguments.destination, dtype=arguments.dtype, precision=precision)
+    for name, json_size, binary_size in converted:
+        print(f'{name}: {json_size} bytes as JSON, {binary_size} bytes as binary')
+    print(f'Converted {len(converted)} chart data files.')
+
+
+def generate_chart_data_files(arguments):
+    store = ChartDataStore(arguments.directory)
+    keys = [
+        key for key in chart_data_keys() if arguments.force or not store.json_path_for(*key).exists()
+    ]
+    failed = 0
+    for key, error in generate_chart_data(store, keys, arguments.workers):
+        if error is None:
+            print(f'chart data file created for {chart_data_name(key)}')
+        else:
+            failed += 1
+            print(f'Chart data not created for {chart_data_name(key)} due to: {error}')
+    print(f'Generated {len(keys) - failed} chart data files, {failed} failed.')
+    if failed:
+        sys.exit(1)
+
+
+def generate_cohort(arguments):
+    parameters = json.loads(arguments.parameters) if arguments.parameters else {}
+    output = Path(arguments.output)
+    parameters.update(
+        number_of_children=arguments.children,
+        seed=arguments.seed,
+        output_format=arguments.format or ("parquet" if output.suffix == ".parquet" else "ndjson"),
+        include_calculated=arguments.include_calculated,
+    )
+    try:
+        cohort_request = CohortRequest(**parameters)
+    except ValidationError as error:
+        print(f'Invalid cohort parameters: {error}')
+        sys.exit(1)
+    parameters = cohort_request.dict()
+    workers = arguments.workers or os.cpu_count() or 1
+    started = time.perf_counter()
+
+    def progress(children, rows):
+        print(f'{children}/{cohort_request.number_of_children} children, {rows} rows', end="\r", flush=True)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = write_cohort(
+                parameters, np.random.SeedSequence(cohort_request.seed).entropy, output, executor, workers, progress)
+    except (ImportError, ValueError) as error:
+        print(f'Cohort not generated due to: {error}')
+        sys.exit(1)
+    print(f'Generated {rows} rows for {cohort_request.number_of_children} children in '
+          f'{time.perf_counter() - started:.1f} seconds, to {output}.')
+
+
+def write_openapi(arguments):
+    # importing the app is slow, so only done for this command
+    from main import app
+    spec = json.dumps(app.openapi(), indent=4)
+    output = Path(arguments.output)
+    unchanged = output.exists() and output.read_text() == spec
+    if unchanged:
+        print(f'{arguments.output} is up to date.')
+    elif arguments.check:
+        print(f'{arguments.output} is out of date: run `python cli.py write-openapi`.')
+        sys.exit(1)
+    else:
+        output.write_text(spec)
+        print(f'Wrote {arguments.output}.')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="RCPCH Digital Growth Charts server tools")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    convert = subcommands.add_parser(
+        "convert-chart-data", help="Convert the JSON chart data files to the memory-mapped binary format")
+    convert.add_argument("--source", default=settings.chart_data_directory,
+                         help="Directory of JSON chart data files (default: the chart data directory)")
+    convert.add_argument("--destination", default=None,
+                         help="Directory to write the .cbin files to (default: alongside the JSON files)")
+    convert.add_argument("--dtype", choices=["d", "f"], default="d",
+                         help="Store coordinates as float64 (d) or float32 (f)")
+    convert.add_argument("--precision", type=int, default=None,
+                         help="Decimal places restored when reading float32 files (default: 4)")
+    convert.set_defaults(handler=convert_chart_data)
+
+    generate = subcommands.add_parser(
+        "generate-chart-data", help="Generate the missing JSON chart data files, in parallel")
+    generate.add_argument("--directory", default=settings.chart_data_directory,
+                          help="Directory of JSON chart data files (default: the chart data directory)")
+    generate.add_argument("--workers", type=int, default=None,
+                          help="Number of processes generating files (default: one per CPU core)")
+    generate.add_argument("--force", action="store_true",
+                          help="Regenerate every file, not only the missing ones")
+    generate.set_defaults(handler=generate_chart_data_files)
+
+    cohort = subcommands.add_parser(
+        "generate-cohort", help="Generate a synthetic cohort of fictional children for load and scale testing")
+    cohort.add_argument("--output", required=True,
+                        help="File to write the cohort to, as Parquet if it ends in .parquet, otherwise NDJSON")
+    cohort.add_argument("--children", type=int, default=1000, help="Number of children (default: 1000)")
+    cohort.add_argument("--seed", type=int, default=None, help="Seed, to generate the same cohort every time")
+    cohort.add_argument("--format", choices=["ndjson", "parquet"], default=None,
+                        help="Output format (default: from the --output file name)")
+    cohort.add_argument("--include-calculated", action="store_true",
+                        help="Include each measurement's ages, SDS and centiles")
+    cohort.add_argument("--parameters", default=None,
+                        help='Other cohort parameters as JSON, as sent to /jobs/cohorts, eg \'{"sex": "male"}\'')
+    cohort.add_argument("--workers", type=int, default=None,
+                        help="Number of processes generating children (default: one per CPU core)")
+    cohort.set_defaults(handler=generate_cohort)
+
+    openapi = subcommands.add_parser(
+        "write-openapi", help="Write the openAPI3 spec of the API to openapi.json")
+    openapi.add_argument("--output", default="openapi.json",
+                         help="File to write the spec to (default: openapi.json)")
+    openapi.add_argument("--check", action="store_true",
+                         help="Exit with an error if the file is out of date, rather than writing it")
+    openapi.set_defaults(handler=write_openapi)
+
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = build_parser().parse_args()
+    arguments.handler(arguments)
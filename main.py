@@ -1,24 +1,36 @@
 # standard imports
-import json
-from pathlib import Path
-import os
+import functools
+import logging
 
 # third party imports
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.openapi.docs import get_swagger_ui_html, get_swagger_ui_oauth2_redirect_html
+from fastapi.responses import JSONResponse
 from fastapi.openapi.utils import get_openapi
 from pydantic import BaseSettings
 
 # local / rcpch imports
-from rcpchgrowth import chart_functions, constants
-from routers import trisomy_21, turners, uk_who
+from routers import admin, health, jobs, metrics, trisomy_21, turners, uk_who
+from services import (
+    calculation_executor, chart_data_generator, chart_data_store, configure_logging, ExecutorSaturated, job_runner,
+    MetricsMiddleware, ProfilingMiddleware, RequestLogMiddleware, restore_rcpchgrowth, settings, TimedRoute,
+    use_lms_index)
+from services.encoded_payload import EncodedPayload
 
 
 version='3.3.1'  # this is set by bump version
 
+# Log structured records through a queue, so requests never wait on writes to stdout.
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # Declare the FastAPI app
+# The spec is served by root() and the Swagger UI by swagger_ui() below, rather than by FastAPI's own routes,
+# so the spec is only built and serialized once.
 app = FastAPI(
-        openapi_url="/",
+        openapi_url=None,
+        docs_url=None,
         redoc_url=None,
         license_info={
             "name": "GNU Affero General Public License",
@@ -36,11 +48,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profile requests which ask for it, and a sample of all requests. Not installed unless enabled, so it costs nothing.
+if settings.profiling_enabled:
+    app.add_middleware(ProfilingMiddleware)
+# Record the latency, sizes and status of every request, served at /metrics.
+# Added after the other middleware, so it is outside them and times them too.
+app.add_middleware(MetricsMiddleware)
+# Give every request an ID, and write sampled access log records. Outermost, so every other log record has the ID.
+app.add_middleware(RequestLogMiddleware)
+# Routes declared in this file also record the time spent in each phase of a request.
+app.router.route_class = TimedRoute
+
+
+# Shed load with a 503 when the calculation backlog is full, rather than queueing requests without limit.
+@app.exception_handler(ExecutorSaturated)
+def executor_saturated(request: Request, error: ExecutorSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The server is busy. Please retry shortly."},
+        headers={"Retry-After": "1"},
+    )
+
 
 # Include routers for each type of endpoint.
 app.include_router(uk_who)
 app.include_router(turners)
 app.include_router(trisomy_21)
+app.include_router(jobs)
+app.include_router(health)
+app.include_router(metrics)
+app.include_router(admin)
 
 
 # Customise API metadata
@@ -61,60 +98,85 @@ def custom_openapi():
 app.openapi = custom_openapi
 
 
-# Include the root endpoint (so it is _described_ in the APIspec).
+# The spec is built on the first request for it, not at import, and then served from the same bytes.
+@functools.lru_cache(maxsize=None)
+def openapi_payload():
+    return EncodedPayload.from_content(app.openapi())
+
+
+# The root endpoint serves the spec, and is _described_ in the APIspec.
 @app.get("/", tags=["openapi3"])
-def root():
+def root(request: Request):
     """
     # API spec endpoint
     * The root `/` API endpoint returns the openAPI3 specification in JSON format
     * This spec is also available in the root of the server code repository
     """
-    return
+    return openapi_payload().response(request, cache_control="no-cache")
 
 
-# Generate and store the chart plotting data for the centile background curves.
+@app.get("/docs", include_in_schema=False)
+def swagger_ui():
+    return get_swagger_ui_html(
+        openapi_url="/",
+        title="RCPCH Digital Growth API - Swagger UI",
+        oauth2_redirect_url="/docs/oauth2-redirect",
+    )
+
+
+@app.get("/docs/oauth2-redirect", include_in_schema=False)
+def swagger_ui_redirect():
+    return get_swagger_ui_oauth2_redirect_html()
+
+
+# Generate any missing chart plotting data for the centile background curves, without holding up startup.
 # This data is only generated once and then is stored and served from file.
-def generate_and_store_chart_data():
-    for centile_format in [constants.COLE_TWO_THIRDS_SDS_NINE_CENTILES, constants.THREE_PERCENT_CENTILES]:
-        for reference in constants.REFERENCES:
-            for sex in constants.SEXES:
-                for measurement_method in constants.MEASUREMENT_METHODS:
-                    # Don't generate files for Turner's for references we don't have (males or non-height measurements)
-                    if reference == "turners-syndrome" and (sex != "female" or measurement_method != "height"):
-                        continue
-                    chart_data_file = Path(
-                        f'chart-data/{centile_format}-{reference}-{sex}-{measurement_method}.json')
-                    if chart_data_file.exists():
-                        print(f'Chart data file exists for {centile_format}-{reference}-{sex}-{measurement_method}.')
-                    else:
-                        print(f'Chart data file does not exist for {centile_format}-{reference}-{sex}-{measurement_method}')
-                        try:
-                            chart_data = chart_functions.create_chart(
-                                reference,
-                                measurement_method=measurement_method,
-                                sex=sex,
-                                centile_selection=centile_format
-                            )
-                            script_dir = os.path.dirname(__file__)
-                            path = os.path.join(script_dir, f'chart-data/{centile_format}-{reference}-{sex}-{measurement_method}.json')
-                            with open(path, 'w') as file:
-                                file.write(json.dumps(chart_data, indent=4))
-                            print(f'chart data file created for {centile_format}-{reference}-{sex}-{measurement_method}')
-                        except Exception as error:
-                            print(f'Chart data not created due to: {error}')
-
-generate_and_store_chart_data()
-
-
-# Saves openAPI3 spec to file in the project root.
-def write_apispec_to_file():
-    # check if openapi.json is already the same as the autogenerated
-    file = open(r'openapi.json', 'r')
-    if file.read() == json.dumps(app.openapi(), indent=4):
-        print("Generated internal openAPI3 spec and openapi.json have equal file content")
-    else:
-        file = open(r'openapi.json', 'w')
-        file.write(json.dumps(app.openapi(), indent=4))
-    file.close()
-        
-write_apispec_to_file()
+# Every worker process starts a generator, but only the one holding the generation lock file generates the files.
+# Build images with `python cli.py generate-chart-data` so there is nothing left to generate.
+@app.on_event("startup")
+def generate_chart_data():
+    if settings.chart_data_generation == "background":
+        chart_data_generator.start()
+
+
+# Optionally read all the chart data into memory before serving the first request.
+@app.on_event("startup")
+def preload_chart_data():
+    if settings.preload_chart_data:
+        loaded = chart_data_store.preload()
+        logger.info("Preloaded %s chart data files into memory.", loaded)
+
+
+# Optionally have rcpchgrowth look up L, M and S in the precomputed index, before the first calculation.
+@app.on_event("startup")
+def start_lms_index():
+    if settings.lms_index_enabled and use_lms_index(True):
+        logger.info("Looking up L, M and S in the precomputed LMS index.")
+
+
+@app.on_event("shutdown")
+def stop_lms_index():
+    restore_rcpchgrowth()
+
+
+# Start the calculation worker processes, if they are in use, before serving the first request.
+@app.on_event("startup")
+def start_calculation_executor():
+    calculation_executor.start()
+
+
+@app.on_event("shutdown")
+def stop_calculation_executor():
+    calculation_executor.stop()
+
+
+# Bulk calculation jobs are worked through in the background while the server runs.
+# Every worker process runs a job runner: each job is claimed by one of them with a lock file, so runs only once.
+@app.on_event("startup")
+def start_job_runner():
+    job_runner.start()
+
+
+@app.on_event("shutdown")
+def stop_job_runner():
+    job_runner.stop()
@@ -1,3 +1,7 @@
 from .ukwho import uk_who
 from .turner import turners
-from .trisomy21 import trisomy_21
\ No newline at end of file
+from .trisomy21 import trisomy_21
+from .admin import admin
+from .jobs import jobs
+from .health import health
+from .metrics import metrics
@@ -0,0 +1,86 @@
+"""
+Admin router
+* Operational endpoints, not part of the public API spec
+* Disabled unless `DGC_ADMIN_API_KEY` is set. Requests must pass the key in the `X-Admin-Key` header.
+"""
+# Standard imports
+import secrets
+from typing import Optional
+
+# Third party imports
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+# local imports
+from services import chart_cache, chart_data_store, profile_store, result_cache, settings, TimedRoute
+
+
+def verify_admin_key(x_admin_key: Optional[str] = Header(None)):
+    if settings.admin_api_key is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_key is None or not secrets.compare_digest(x_admin_key, settings.admin_api_key):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+
+
+# set up the API router
+admin = APIRouter(
+    prefix="/admin",
+    route_class=TimedRoute,
+    include_in_schema=False,
+    dependencies=[Depends(verify_admin_key)],
+)
+
+
+@admin.get("/chart-data")
+def chart_data_status():
+    """
+    ## Chart data held in memory, with its approximate size in bytes
+    """
+    return chart_data_store.memory_footprint()
+
+
+@admin.post("/chart-data/reload")
+def reload_chart_data():
+    """
+    ## Reloads the chart data held in memory from the files in `chart-data/`
+    * Use after the chart data files have been regenerated
+    """
+    return chart_data_store.reload()
+
+
+@admin.get("/result-cache")
+def result_cache_status():
+    """
+    ## Calculation result and chart coordinate caches, with the hit rate, size and eviction counts of each tier
+    """
+    return {"calculation": result_cache.stats(), "chart": chart_cache.stats()}
+
+
+@admin.delete("/result-cache")
+def clear_result_cache():
+    """
+    ## Empties the calculation result and chart coordinate caches in every tier, including those shared with other workers
+    """
+    result_cache.clear()
+    chart_cache.clear()
+    return {"calculation": result_cache.stats(), "chart": chart_cache.stats()}
+
+
+@admin.get("/profiles")
+def list_profiles():
+    """
+    ## Request profiles kept, newest first, with the route, status and duration of each request
+    * Only taken when `DGC_PROFILING_ENABLED` is set
+    """
+    return profile_store.list()
+
+
+@admin.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str):
+    """
+    ## One request profile, as folded stacks for flame graph tools such as `flamegraph.pl` or speedscope
+    """
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
@@ -0,0 +1,37 @@
+"""
+Health router
+* Liveness and readiness probes for load balancers and container orchestrators, not part of the public API spec
+"""
+# Third party imports
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+# local imports
+from services import chart_data_generator, TimedRoute
+
+# set up the API router
+health = APIRouter(
+    prefix="/health",
+    route_class=TimedRoute,
+    include_in_schema=False,
+)
+
+
+@health.get("/live")
+def live():
+    """
+    ## The server is running
+    """
+    return {"status": "live"}
+
+
+@health.get("/ready")
+def ready():
+    """
+    ## The server is ready to serve every endpoint
+    * 503 while missing chart data files are still being generated in the background
+    """
+    status = {"status": "ready" if chart_data_generator.ready else "starting", "chart_data": chart_data_generator.status()}
+    if not chart_data_generator.ready:
+        return JSONResponse(status_code=503, content=status, headers={"Retry-After": "5"})
+    return status
@@ -0,0 +1,182 @@
+"""
+Bulk calculation jobs router
+* Upload a CSV (or Parquet) file of measurements, poll the job's progress and download the file with centiles and
+SDS appended
+* Generate a synthetic cohort of fictional children as a job, to load and scale test the bulk calculation paths
+"""
+# Standard imports
+from typing import Literal, Optional
+
+# Third party imports
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+# local imports
+from schemas import CohortRequest
+from services import (
+    available_job_formats, job_runner, job_store, JOB_FORMATS, measurement_count, RESULT_FORMATS, result_format,
+    settings, TimedRoute)
+from .admin import verify_admin_key
+
+# the file formats accepted, by content type
+JOB_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+}
+
+# set up the API router
+jobs = APIRouter(
+    prefix="/jobs",
+    route_class=TimedRoute,
+)
+
+
+def get_job_or_404(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+async def write_upload(request, path):
+    """
+    Copies the request body to `path`, writing each chunk off the event loop. Raises HTTPException 413 once the body
+    is longer than `settings.max_job_upload_bytes`.
+    """
+    file = await run_in_threadpool(open, path, "wb")
+    try:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > settings.max_job_upload_bytes:
+                raise HTTPException(
+                    status_code=413, detail=f"A job file can be at most {settings.max_job_upload_bytes} bytes.")
+            await run_in_threadpool(file.write, chunk)
+    finally:
+        await run_in_threadpool(file.close)
+
+
+@jobs.post(
+    "",
+    tags=["jobs"],
+    status_code=202,
+    dependencies=[Depends(verify_admin_key)],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "text/csv": {
+                    "schema": {"type": "string"},
+                    "example": "birth_date,observation_date,sex,gestation_weeks,gestation_days,measurement_method,observation_value\n2020-04-12,2028-06-12,female,40,0,height,115\n"
+                },
+                "application/vnd.apache.parquet": {"schema": {"type": "string", "format": "binary"}}
+            }
+        }
+    }
+)
+async def create_job(
+    request: Request,
+    reference: Optional[Literal['uk-who', 'trisomy-21', 'turners-syndrome']] = Query(
+        None, description="The growth reference to calculate against. Leave out to use each row's `reference` column, as in a synthetic cohort."),
+    measurement_method: Optional[Literal['height', 'weight', 'ofc', 'bmi']] = Query(
+        None, description="The measurement method for rows without a `measurement_method` column or value.")
+):
+    """
+    ## Bulk Centile and SDS Calculation Job
+    * Send a file of measurements as the request body, as `text/csv` (or `application/vnd.apache.parquet` if the server supports Parquet).
+    * Each row is one measurement. The columns have the same names as the fields of the `/calculation` endpoints: `birth_date`, `observation_date`, `sex`, `observation_value` and `measurement_method` are required, `gestation_weeks` and `gestation_days` are optional. Without a `reference` parameter, a `reference` column is required too. Other columns are passed through unchanged.
+    * Returns the job, with its `job_id`. Poll `/jobs/{job_id}` for its progress, and download the result from `/jobs/{job_id}/result` once its `status` is `complete`.
+    * The result is the same file with `chronological_decimal_age`, `corrected_decimal_age`, `chronological_sds`, `chronological_centile`, `corrected_sds`, `corrected_centile` and `errors` columns appended.
+    * Only available when the server's `DGC_ADMIN_API_KEY` setting is set, and the key is passed in the `X-Admin-Key` header.
+    * The size of the file is limited by the server's `DGC_MAX_JOB_UPLOAD_BYTES` setting. Larger files get a 413 response.
+    """
+    input_format = JOB_CONTENT_TYPES.get(request.headers.get("content-type", "").split(";")[0].strip())
+    if input_format is None or input_format not in available_job_formats():
+        accepted = ", ".join(JOB_FORMATS[file_format] for file_format in available_job_formats())
+        raise HTTPException(status_code=415, detail=f"The request body must be one of: {accepted}.")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > settings.max_job_upload_bytes:
+        raise HTTPException(
+            status_code=413, detail=f"A job file can be at most {settings.max_job_upload_bytes} bytes.")
+
+    job = job_store.create(reference, input_format, measurement_method)
+    try:
+        await write_upload(request, job_store.input_path(job))
+    except (ClientDisconnect, HTTPException):
+        await run_in_threadpool(job_store.delete, job["job_id"])
+        raise
+    job = job_store.update(job, status="queued")
+    job_runner.wake()
+    return job
+
+
+@jobs.post("/cohorts", tags=["jobs"], status_code=202, dependencies=[Depends(verify_admin_key)])
+def create_cohort_job(cohort_request: CohortRequest):
+    """
+    ## Synthetic Cohort Generation Job
+    * Generates `number_of_children` fictional children, with the parameters of the `/fictional-child-data/stream` endpoints, for load and scale testing.
+    * Leave out `reference`, `sex`, `measurement_method` or `gestation_weeks` for a mix, drawn at random for each child. By default 90% of the children are on the `uk-who` reference and 5% on each of the others, and 8% are born preterm.
+    * The children are generated in parallel by the job worker processes, into an NDJSON or Parquet file. Send a `seed` to generate the same cohort every time.
+    * Returns the job, with its `job_id`. Poll `/jobs/{job_id}` for its progress, and download the cohort from `/jobs/{job_id}/result` once its `status` is `complete`.
+    * Each row is one measurement, in the columns of a bulk calculation job, with the child's `reference`: a Parquet cohort can be sent to `/jobs` as it is.
+    * Only available when the server's `DGC_ADMIN_API_KEY` setting is set, and the key is passed in the `X-Admin-Key` header.
+    * The number of children, and of rows (children times measurements per child), in one cohort are limited by the server's `DGC_MAX_COHORT_CHILDREN` and `DGC_MAX_COHORT_ROWS` settings. Larger cohorts get a 413 response.
+    """
+    if cohort_request.number_of_children > settings.max_cohort_children:
+        raise HTTPException(
+            status_code=413, detail=f"At most {settings.max_cohort_children} children can be generated in one cohort.")
+    if cohort_request.output_format not in available_job_formats() + ["ndjson"]:
+        raise HTTPException(status_code=422, detail=f"This server cannot write {cohort_request.output_format} files.")
+    try:
+        count = measurement_count(
+            cohort_request.start_chronological_age, cohort_request.end_age,
+            cohort_request.measurement_interval_type, cohort_request.measurement_interval_number)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    if cohort_request.number_of_children * count > settings.max_cohort_rows:
+        raise HTTPException(
+            status_code=413, detail=f"At most {settings.max_cohort_rows} rows can be generated in one cohort.")
+    job = job_store.create_cohort(cohort_request.dict())
+    job_runner.wake()
+    return job
+
+
+@jobs.get("/{job_id}", tags=["jobs"])
+def job_status(job_id: str):
+    """
+    ## Bulk Calculation Job Status
+    * `status` is `queued`, `running`, `complete` or `failed`. A failed job has an `error`.
+    * `rows_processed` counts up to `rows_total` while the job is running. A cohort job counts `children_processed` up to `children_total`, and its `rows_total` is set once it is complete.
+    """
+    return get_job_or_404(job_id)
+
+
+@jobs.get("/{job_id}/result", tags=["jobs"], response_class=FileResponse)
+def job_result(job_id: str):
+    """
+    ## Bulk Calculation Job Result
+    * Downloads the uploaded file with the calculated columns appended, or the generated cohort, once the job is `complete`.
+    """
+    job = get_job_or_404(job_id)
+    if job["status"] != "complete":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job['status']}")
+    return FileResponse(
+        job_store.result_path(job),
+        media_type=RESULT_FORMATS[result_format(job)],
+        filename=f"{job_id}-result.{result_format(job)}")
+
+
+@jobs.delete("/{job_id}", tags=["jobs"], status_code=204)
+def delete_job(job_id: str):
+    """
+    ## Delete a Bulk Calculation Job
+    * Deletes the job's uploaded file and result. A running job cannot be deleted.
+    """
+    job = get_job_or_404(job_id)
+    if job["status"] == "running":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is running")
+    job_store.delete(job_id)
+    return Response(status_code=204)
@@ -0,0 +1,27 @@
+"""
+Metrics router
+* Request latency and size histograms, cache hit rates and queue depths in the Prometheus text format, for scraping.
+Not part of the public API spec
+"""
+# Third party imports
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+# local imports
+from services import metrics_registry, TimedRoute
+from services.metrics import CONTENT_TYPE
+
+# set up the API router
+metrics = APIRouter(
+    prefix="/metrics",
+    route_class=TimedRoute,
+    include_in_schema=False,
+)
+
+
+@metrics.get("")
+def prometheus_metrics():
+    """
+    ## Metrics of this worker process in the Prometheus text format
+    """
+    return Response(content=metrics_registry.render(), media_type=CONTENT_TYPE)
@@ -2,23 +2,31 @@
 Turner router
 """
 # Standard imports
-import json
-from pathlib import Path
+import logging
+from typing import List
 
 # Third party imports
-from fastapi import APIRouter, Body, HTTPException
+from fastapi import APIRouter, Body, HTTPException, Request
 
 # RCPCH imports
-from rcpchgrowth import Measurement, constants, chart_functions, generate_fictional_child_data
-from schemas import MeasurementRequest, ChartCoordinateRequest, FictionalChildRequest
+from rcpchgrowth import constants, chart_functions, generate_fictional_child_data
+from schemas import (
+    MeasurementRequest, ChartCoordinateRequest, FictionalChildRequest, FictionalChildrenRequest, MeasurementValuesRequest)
+from services import (
+    calculate_measurement_batch, calculate_measurement_cached, calculate_measurement_stream, calculation_executor,
+    chart_curves, chart_data_store, check_fictional_children_request, custom_chart_request, fictional_children_stream,
+    FictionalChildrenResponse, measurement_values_response, NDJSONStreamingResponse, settings, TimedRoute)
+
+logger = logging.getLogger(__name__)
 
 # set up the API router
 turners = APIRouter(
     prefix="/turner",
+    route_class=TimedRoute,
 )
 
 @turners.post("/calculation", tags=["turners-syndrome"])
-def turner_calculation(measurementRequest: MeasurementRequest = Body(
+async def turner_calculation(measurementRequest: MeasurementRequest = Body(
         ...,
         example={
             "birth_date": "2020-04-12",
@@ -45,34 +53,89 @@ def turner_calculation(measurementRequest: MeasurementRequest = Body(
     * Optional events can be passed in as a list of strings - each list is associated with a measurement
     """
     try:
-        calculation = Measurement(
-            reference=constants.TURNERS,
-            birth_date=measurementRequest.birth_date,
-            gestation_days=measurementRequest.gestation_days,
-            gestation_weeks=measurementRequest.gestation_weeks,
-            measurement_method=measurementRequest.measurement_method,
-            observation_date=measurementRequest.observation_date,
-            observation_value=measurementRequest.observation_value,
-            sex=measurementRequest.sex,
-            bone_age=measurementRequest.bone_age,
-            bone_age_centile=measurementRequest.bone_age_centile,
-            bone_age_sds=measurementRequest.bone_age_sds,
-            bone_age_text=measurementRequest.bone_age_text,
-            bone_age_type=measurementRequest.bone_age_type,
-            events_text=measurementRequest.events_text
-        ).measurement
+        calculation = await calculate_measurement_cached(constants.TURNERS, measurementRequest)
     except ValueError as err:
-        print(err.args)
+        logger.info("Calculation request rejected", extra={"errors": err.args})
         return err.args, 422
     return calculation
     
 
+@turners.post("/calculations", tags=["turners-syndrome"])
+async def turner_calculations(measurements: List[dict] = Body(
+        ...,
+        example=[
+            {
+                "birth_date": "2020-04-12",
+                "observation_date": "2024-06-12",
+                "observation_value": 78,
+                "measurement_method": "height",
+                "sex": "female",
+                "gestation_weeks": 39,
+                "gestation_days": 2,
+            },
+            {
+                "birth_date": "2020-04-12",
+                "observation_date": "2025-06-12",
+                "observation_value": 86,
+                "measurement_method": "height",
+                "sex": "female",
+                "gestation_weeks": 39,
+                "gestation_days": 2,
+            }
+        ]
+)):
+    """
+    ## Turner's Syndrome Batch Centile and SDS Calculations.
+
+    * Accepts a list of measurements, each in the same format as the single `/turner/calculation` endpoint. They can be for different children.
+    * Returns one result per measurement, in the order supplied: `{index, calculation, errors}`.
+    * A measurement which is invalid or cannot be calculated gets a list of `errors` in place of its `calculation`, and does not affect the rest of the batch.
+    * The number of measurements which can be sent in one request is limited by the server's `DGC_MAX_BATCH_SIZE` setting. Larger batches get a 413 response.
+    """
+    if len(measurements) > settings.max_batch_size:
+        raise HTTPException(status_code=413, detail=f"A batch can contain at most {settings.max_batch_size} measurements.")
+    return await calculation_executor.run(calculate_measurement_batch, constants.TURNERS, measurements)
+
+
+@turners.post(
+    "/calculations/stream",
+    tags=["turners-syndrome"],
+    response_class=NDJSONStreamingResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/x-ndjson": {
+                    "schema": {"type": "string"},
+                    "example": '{"birth_date": "2020-04-12", "observation_date": "2028-06-12", "observation_value": 115, "sex": "female", "gestation_weeks": 40, "gestation_days": 0, "measurement_method": "height"}\n'
+                }
+            }
+        }
+    }
+)
+async def turner_calculations_stream(request: Request):
+    """
+    ## Turner's Syndrome Streaming Centile and SDS Calculations.
+
+    * For very large extracts. Send the measurements as `application/x-ndjson`: one measurement per line, each in the same format as the single `/turner/calculation` endpoint.
+    * The request body is calculated as it arrives and the results are streamed back as NDJSON, one `{index, calculation, errors}` object per line, in the order supplied.
+    * A line which is invalid or cannot be calculated gets a list of `errors` in place of its `calculation`, and does not affect the rest of the stream.
+    * There is no limit on the number of lines.
+    """
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/x-ndjson":
+        raise HTTPException(status_code=415, detail="The request body must be application/x-ndjson.")
+    calculation_executor.check_capacity()
+    return NDJSONStreamingResponse(
+        calculate_measurement_stream(constants.TURNERS, request.stream(), settings.stream_chunk_size))
+
+
 @turners.post("/chart-coordinates", tags=["turners-syndrome"])
-def turner_chart_coordinates(chartParams: ChartCoordinateRequest):
+def turner_chart_coordinates(chartParams: ChartCoordinateRequest, request: Request):
     """
     ## Turner's Syndrome Chart Coordinates data.
     
     * Returns coordinates for constructing the lines of a traditional growth chart, in JSON format
+    * Responses carry an `ETag`: send it back in `If-None-Match` to get a `304 Not Modified` when the data has not changed
     * Note height in girls conly be only returned. It is a post request to maintain consistency with other routes.
     \f
     Return object structure (this needs to be moved into the schema)
@@ -98,30 +161,52 @@ def turner_chart_coordinates(chartParams: ChartCoordinateRequest):
     if chartParams.sex == "male" or chartParams.measurement_method != "height":
         return "Turner data only exists for height in girls."
 
-    chart_data=None
-    chart_data_file = Path(
-                f'chart-data/{chartParams.centile_format}-{constants.TURNERS}-{chartParams.sex}-{chartParams.measurement_method}.json')
-    if chart_data_file.exists():
-        print(f'Chart data file exists for {chartParams.centile_format}-{constants.TURNERS}-{chartParams.sex}-{chartParams.measurement_method}.')
-        with open(f'chart-data/{chartParams.centile_format}-{constants.TURNERS}-{chartParams.sex}-{chartParams.measurement_method}.json', 'r') as file:
-            chart_data = json.load(file)
-    else:
+    if custom_chart_request(chartParams):
+        try:
+            return chart_curves.payload(constants.TURNERS, chartParams).response(request)
+        except LookupError as error:
+            raise HTTPException(status_code=422, detail=str(error))
+
+    try:
+        chart_data = chart_data_store.sliced_payload(
+            chartParams.centile_format, constants.TURNERS, chartParams.sex, chartParams.measurement_method,
+            response_format=chartParams.format,
+            min_age=chartParams.min_age,
+            max_age=chartParams.max_age,
+            max_points_per_line=chartParams.max_points_per_line)
+    except FileNotFoundError:
         return HTTPException(status_code=422, detail=f"Item not found: chart-data/{chartParams.centile_format}-{constants.TURNERS}-{chartParams.sex}-{chartParams.measurement_method}.json")
-        
-    return {
-        "centile_data": chart_data
-    }
+
+    return chart_data.response(request)
+
+
+@turners.post("/measurement-values", tags=["turners-syndrome"])
+async def turner_measurement_values(values_request: MeasurementValuesRequest = Body(
+        ...,
+        example={"sex": "female", "measurement_method": "height", "decimal_ages": [8.0], "centiles": [2, 50, 98]}
+)):
+    """
+    ## Turner's Syndrome Measurement Values for SDS or Centiles
+
+    * The inverse of `/turner/calculation`: returns the measurement at each of the `decimal_ages` which has the given SDS or centile, eg for target height bands, or the expected measurement at the next visit.
+    * This endpoint MUST ONLY be used for **female** children with Turner's Syndrome, and `height` is the only `measurement_method`: anything else has no measurement values.
+    * Send `sds` or `centiles`, paired in order with `decimal_ages`. A list of one value is paired with every value of the other list, so `{"decimal_ages": [8], "centiles": [2, 50, 98]}` returns three measurements at 8 years.
+    * Returns lists of the `decimal_ages`, `sds`, `centiles` and `measurement_values`. Ages with no reference data have a `null` measurement value.
+    * The number of values which can be returned by one request is limited by the server's `DGC_MAX_MEASUREMENT_VALUES` setting. Larger requests get a 413 response.
+    """
+    return await measurement_values_response(constants.TURNERS, values_request)
 
 
 @turners.post('/fictional-child-data', tags=["turners-syndrome"])
-def fictional_child_data(fictional_child_request: FictionalChildRequest):
+async def fictional_child_data(fictional_child_request: FictionalChildRequest):
     """
     ## Turner's Fictional Child Data Endpoint
     
     * Generates synthetic data for demonstration or testing purposes
     """
     try:
-        life_course_fictional_child_data = generate_fictional_child_data(
+        life_course_fictional_child_data = await calculation_executor.run(
+            generate_fictional_child_data,
             measurement_method=fictional_child_request.measurement_method,
             sex=fictional_child_request.sex,
             start_chronological_age=fictional_child_request.start_chronological_age,
@@ -140,3 +225,23 @@ def fictional_child_data(fictional_child_request: FictionalChildRequest):
         return life_course_fictional_child_data
     except ValueError:
         return 422
+
+
+@turners.post(
+    "/fictional-child-data/stream",
+    tags=["turners-syndrome"],
+    response_class=FictionalChildrenResponse,
+)
+async def fictional_children_data_stream(fictional_children_request: FictionalChildrenRequest):
+    """
+    ## Turner's Fictional Children Data, Streamed
+
+    * Generates `number_of_children` fictional children, each with the parameters of the `/turner/fictional-child-data` endpoint, for test fixtures, demonstrations and load testing.
+    * Each child's whole trajectory is generated at once, so daily measurements over 20 years are quick to generate.
+    * Send a `seed` to generate the same children every time. `start_sds_spread` varies the children's starting SDS.
+    * Streamed as NDJSON, one measurement per line: the `child` number, the measurement (in the columns the bulk calculation jobs read) and its ages, SDS and centiles.
+    * The number of children, and of measurements (children times measurements per child), in one request are limited by the server's `DGC_MAX_FICTIONAL_CHILDREN` and `DGC_MAX_FICTIONAL_CHILD_ROWS` settings. Larger requests get a 413 response.
+    """
+    check_fictional_children_request(constants.TURNERS, fictional_children_request)
+    calculation_executor.check_capacity()
+    return FictionalChildrenResponse(fictional_children_stream(constants.TURNERS, fictional_children_request))
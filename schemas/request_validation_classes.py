@@ -1,9 +1,9 @@
 # standard imports
 from datetime import date, datetime
-from typing import Optional, Literal
+from typing import Dict, List, Optional, Literal
 
 # third party imports
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, confloat, Field, root_validator, validator
 from rcpchgrowth import constants
 
 # local / rcpch imports
@@ -56,6 +56,25 @@ class ChartCoordinateRequest(BaseModel):
     measurement_method: Literal['height', 'weight', 'ofc', 'bmi'] = Field(
         ..., description="The type of measurement performed on the infant or child as a string which can be `height`, `weight`, `bmi` or `ofc`. The value of this measurement is supplied as the `observation_value` parameter. The measurements represent height **in centimetres**, weight *in kilograms**, body mass index **in kilograms/metre²** and occipitofrontal circumference (head circumference, OFC) **in centimetres**.")
     centile_format: Optional[Literal["cole-nine-centiles", "three-percent-centiles"]]=Field('cole-nine-centiles', description="Optional selection of centile format using 9 centile standard ['nine-centiles'], or older three-percent centile format ['three-percent-centiles']. Defaults to cole-nine-centiles")
+    format: Optional[Literal["points", "columnar"]] = Field('points', description="Optional shape of each centile line in the response. `points` (the default) returns a list of `{l, x, y}` objects per line. `columnar` returns `{centile, sds, x: [...], y: [...]}` per line, which is much smaller and faster to parse.")
+    min_age: Optional[float] = Field(None, description="Optional decimal age in years. Only the parts of each centile line from this age onwards are returned, plus the point immediately before it.")
+    max_age: Optional[float] = Field(None, description="Optional decimal age in years. Only the parts of each centile line up to this age are returned, plus the point immediately after it.")
+    max_points_per_line: Optional[int] = Field(None, ge=3, description="Optional maximum number of points returned for each centile line in each reference. Lines with more points are downsampled in a way which keeps their shape (Largest-Triangle-Three-Buckets).")
+    centiles: Optional[List[confloat(gt=0, lt=100)]] = Field(None, min_items=1, max_items=20, description="Optional centiles, as percentages, to draw lines for instead of those of `centile_format`. The lines are calculated from the reference tables. Send either `centiles` or `sds`.")
+    sds: Optional[List[confloat(ge=-8, le=8)]] = Field(None, min_items=1, max_items=20, description="Optional SDS, from -8 to 8, to draw lines for instead of the centiles of `centile_format`. The lines are calculated from the reference tables. Send either `centiles` or `sds`.")
+    points_per_year: Optional[int] = Field(None, ge=1, le=365, description="Optional number of evenly spaced points a year in each line, calculated from the reference tables. By default lines have a point a week up to 2 years of age and a point a month after.")
+
+    @validator("max_age")
+    def max_age_after_min_age(cls, value, values):
+        if value is not None and values.get("min_age") is not None and value < values["min_age"]:
+            raise ValueError("max_age must not be less than min_age")
+        return value
+
+    @root_validator(skip_on_failure=True)
+    def centiles_or_sds(cls, values):
+        if values.get("centiles") is not None and values.get("sds") is not None:
+            raise ValueError("send either centiles or sds, not both")
+        return values
 
 class FictionalChildRequest(BaseModel):
     measurement_method: Literal['height', 'weight', 'ofc', 'bmi'] = Field(
@@ -76,3 +95,76 @@ class FictionalChildRequest(BaseModel):
     noise: bool = Field(False, description="Noise as boolean. Default is false. Simulates measurement error.")
     noise_range: Optional[float] = Field(0.005, description="Noise range as float. Prescribes the amount of measurement error generated randomly. Default is 0.5%")
     reference: Optional[Literal["uk-who", "trisomy-21", "turners-syndrome"]] = Field('uk-who', description="Selected reference as string. Case sensitive and accepts only once of ['uk-who', 'trisomy-21', 'turners-syndrome']")
+
+
+class FictionalChildrenRequest(FictionalChildRequest):
+    number_of_children: int = Field(1, ge=1, description="The number of fictional children to generate, each with the same parameters. They differ if `noise` or `start_sds_spread` is set.")
+    start_sds_spread: float = Field(0.0, ge=0, description="Standard deviation of each child's starting SDS around `start_sds`. Default is 0: every child starts at `start_sds`.")
+    seed: Optional[int] = Field(None, ge=0, description="Seed for the random noise and starting SDS, so the same request always generates the same children. Without a seed every request is different.")
+
+    @root_validator(skip_on_failure=True)
+    def defaults_for_nulls(cls, values):
+        # the optional parameters of a fictional child fall back to their defaults if sent as null
+        for name, field in cls.__fields__.items():
+            if values.get(name) is None and field.default is not None:
+                values[name] = field.default
+        return values
+
+
+class CohortRequest(FictionalChildrenRequest):
+    measurement_method: Optional[Literal['height', 'weight', 'ofc', 'bmi']] = Field(
+        None, description="The measurement method of every child. Leave out for a mix of `height`, `weight`, `bmi` and `ofc`, in equal proportions.")
+    sex: Optional[Literal['male', 'female']] = Field(
+        None, description="The sex of every child. Leave out for equal numbers of boys and girls.")
+    gestation_weeks: Optional[int] = Field(
+        None, ge=limits.MINIMUM_GESTATION_WEEKS, le=limits.MAXIMUM_GESTATION_WEEKS, description="The gestation of every child. Leave out for a mix: `preterm_fraction` of the children born at 24 to 36 weeks, the rest at 37 to 41 weeks, each with 0 to 6 days.")
+    reference: Optional[Literal["uk-who", "trisomy-21", "turners-syndrome"]] = Field(
+        None, description="The reference of every child. Leave out for a mix, in the proportions of `reference_weights`. Children on the `turners-syndrome` reference are always girls, measured by height, so it cannot be chosen with a `sex` of `male` or a `measurement_method` other than `height`. With either, a mix has no children on it.")
+    reference_weights: Dict[Literal["uk-who", "trisomy-21", "turners-syndrome"], float] = Field(
+        {"uk-who": 0.9, "trisomy-21": 0.05, "turners-syndrome": 0.05}, description="The proportion of children on each reference, if no `reference` is given.")
+    preterm_fraction: float = Field(0.08, ge=0, le=1, description="The fraction of children born preterm, if no `gestation_weeks` is given.")
+    start_sds_spread: float = Field(1.0, ge=0, description="Standard deviation of each child's starting SDS around `start_sds`. Default is 1, so the cohort's SDS are spread as in a population.")
+    output_format: Literal["ndjson", "parquet"] = Field("ndjson", description="Write the cohort as NDJSON, one measurement per line, or as a Parquet file.")
+    include_calculated: bool = Field(False, description="Include the ages, SDS and centiles of each measurement. Leave out to upload the cohort as a bulk calculation job, which appends its own.")
+
+    @validator("reference_weights")
+    def weights_add_up(cls, reference_weights):
+        if any(weight < 0 for weight in reference_weights.values()) or sum(reference_weights.values()) <= 0:
+            raise ValueError("reference_weights must not be negative, and at least one must be positive")
+        return reference_weights
+
+    @root_validator(skip_on_failure=True)
+    def turner_children_are_girls_measured_by_height(cls, values):
+        if values["sex"] != "male" and values["measurement_method"] in (None, "height"):
+            return values
+        if values["reference"] == "turners-syndrome":
+            raise ValueError("the turners-syndrome reference only has data for girls measured by height")
+        if values["reference"] is None and not any(
+                weight > 0 for reference, weight in values["reference_weights"].items()
+                if reference != "turners-syndrome"):
+            raise ValueError(
+                "reference_weights must give a reference other than turners-syndrome a positive weight, as it only "
+                "has data for girls measured by height")
+        return values
+
+
+class MeasurementValuesRequest(BaseModel):
+    sex: Literal['male', 'female'] = Field(
+        ..., description="The sex of the patient, as a string value which can either be `male` or `female`. Abbreviations or alternatives are not accepted.")
+    measurement_method: Literal['height', 'weight', 'ofc', 'bmi'] = Field(
+        ..., description="The type of measurement, as a string which can be `height`, `weight`, `bmi` or `ofc`. Heights and head circumferences are returned in centimetres, weights in kilograms and body mass index in kilograms/metre².")
+    decimal_ages: List[float] = Field(
+        ..., min_items=1, description="Decimal ages in years, at which to find the measurements. Use the corrected age where gestational age correction applies.")
+    sds: Optional[List[float]] = Field(
+        None, min_items=1, description="The SDS of each measurement, paired in order with `decimal_ages`. Send either `sds` or `centiles`.")
+    centiles: Optional[List[confloat(gt=0, lt=100)]] = Field(
+        None, min_items=1, description="The centile of each measurement, as a percentage, paired in order with `decimal_ages`. Send either `sds` or `centiles`.")
+
+    @root_validator(skip_on_failure=True)
+    def sds_or_centiles(cls, values):
+        if (values.get("sds") is None) == (values.get("centiles") is None):
+            raise ValueError("send either sds or centiles")
+        targets = values["sds"] if values.get("sds") is not None else values["centiles"]
+        if 1 not in (len(values["decimal_ages"]), len(targets)) and len(values["decimal_ages"]) != len(targets):
+            raise ValueError("decimal_ages must be the same length as sds or centiles, or either must have one value")
+        return values
@@ -0,0 +1,18 @@
+from .settings import settings
+from .executor import calculation_executor, ExecutorSaturated
+from .chart_data_store import chart_data_generator, chart_data_store, chart_data_keys
+from .chart_curves import chart_curves, custom_chart_request
+from .result_cache import chart_cache, result_cache
+from .calculation import (
+    calculate_measurement, calculate_measurement_batch, calculate_measurement_cached, calculate_measurement_stream,
+    NDJSONStreamingResponse, restore_rcpchgrowth, use_lms_index)
+from .fictional_children import (
+    check_fictional_children_request, fictional_child_rows, fictional_children_stream, FictionalChildrenResponse,
+    measurement_count)
+from .lms_engine import lms_for_age, measurements_for_sds, sds_and_centiles, sds_for_centiles
+from .measurement_values import measurement_values, measurement_values_response
+from .jobs import available_job_formats, job_runner, job_store, JOB_FORMATS, RESULT_FORMATS, result_format
+from .json_response import encode_json, FastJSONResponse
+from .metrics import MetricsMiddleware, metrics_registry, TimedRoute
+from .structured_logging import configure_logging, logging_subsystem, request_id, RequestLogMiddleware
+from .profiling import profile_store, ProfilingMiddleware
@@ -0,0 +1,298 @@
+"""
+Storage tiers for cached results
+* Every backend stores bytes against string keys, each with an optional expiry time as a Unix timestamp
+* `MemoryCacheBackend`: least recently used entries in this process, bounded by bytes
+* `SQLiteCacheBackend`: a SQLite file on local disk, shared by every worker process on the host and kept across restarts
+* `RedisCacheBackend`: any server speaking the Redis protocol (RESP), shared by every host
+* A failing backend is counted, treated as a miss and skipped for a few seconds, so an unavailable cache never fails
+a request
+"""
+# standard imports
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackendError(Exception):
+    """
+    Raised for an error reply from a Redis protocol server.
+    """
+
+
+class CacheBackend:
+    """
+    Base class for cache storage tiers. Subclasses implement `_get`, `_put`, `_clear` and optionally `describe`.
+    """
+    name = None
+    # whether the backend is outside this process, so may be slow to reach
+    shared = False
+    # errors which mean the backend is unavailable, rather than a bug
+    unavailable_errors = ()
+    retry_interval = 5.0
+
+    def __init__(self):
+        self.counters = dict.fromkeys(["writes", "evictions", "expirations", "errors"], 0)
+        self._counter_lock = threading.Lock()
+        self._unavailable_until = 0.0
+
+    def count(self, counter, increment=1):
+        with self._counter_lock:
+            self.counters[counter] += increment
+
+    def _call(self, method, *args):
+        if time.monotonic() < self._unavailable_until:
+            return None
+        try:
+            return method(*args)
+        except self.unavailable_errors as error:
+            self.count("errors")
+            self._unavailable_until = time.monotonic() + self.retry_interval
+            logger.warning("%s cache unavailable: %s", self.name, error)
+            return None
+
+    def get(self, key):
+        """
+        Returns the bytes stored for `key`, or None if there are none or they have expired.
+        """
+        return self._call(self._get, key)
+
+    def put(self, key, value, expires=None):
+        self._call(self._put, key, value, expires)
+
+    def clear(self, prefix=""):
+        """
+        Removes every entry whose key starts with `prefix`.
+        """
+        self._call(self._clear, prefix)
+
+    def describe(self):
+        return {}
+
+    def stats(self):
+        with self._counter_lock:
+            return dict(self.counters, **self.describe())
+
+
+class MemoryCacheBackend(CacheBackend):
+    name = "memory"
+
+    def __init__(self, max_bytes):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                self._remove(key)
+                self.count("expirations")
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _put(self, key, value, expires):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires)
+            self._bytes += size
+            self.count("writes")
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.count("evictions")
+
+    def _remove(self, key):
+        # called with the lock held
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+    def _clear(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    def describe(self):
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class SQLiteCacheBackend(CacheBackend):
+    name = "sqlite"
+    shared = True
+    unavailable_errors = (sqlite3.Error, OSError)
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        """
+        Returns this thread's connection, opening it on first use. Worker processes forked from a parent which had
+        already connected open their own.
+        """
+        if getattr(self._local, "pid", None) != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)")
+            connection.execute("DELETE FROM results WHERE expires < ?", (time.time(),))
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def _get(self, key):
+        row = self.connection().execute(
+            "SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            self.connection().execute("DELETE FROM results WHERE key = ?", (key,))
+            self.count("expirations")
+            return None
+        return value
+
+    def _put(self, key, value, expires):
+        self.connection().execute(
+            "INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)", (key, value, expires))
+        self.count("writes")
+
+    def _clear(self, prefix):
+        self.connection().execute("DELETE FROM results WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def describe(self):
+        return {"path": str(self.path)}
+
+
+class RESPConnection:
+    """
+    A connection to a Redis protocol server, sending commands and reading RESP2 replies.
+    """
+
+    def __init__(self, host, port, timeout):
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.socket.makefile("rb")
+
+    def command(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self.socket.sendall(b"".join(parts))
+        return self.read_reply()
+
+    def read_reply(self):
+        line = self.file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the cache server")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest
+        if prefix == b"-":
+            raise CacheBackendError(rest.decode("utf-8", "replace"))
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return self.file.read(length + 2)[:-2]
+        if prefix == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise CacheBackendError(f"Unexpected reply from the cache server: {line!r}")
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Caches in a Redis protocol server given by a URL `redis://[:password@]host[:port][/db]`. Keys are prefixed with
+    `key_prefix`, so the server can be shared with other applications.
+    """
+    name = "redis"
+    shared = True
+    unavailable_errors = (OSError, CacheBackendError)
+
+    def __init__(self, url, key_prefix="dgc:", timeout=1.0):
+        super().__init__()
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported cache URL {url}: only redis:// URLs are supported")
+        self.url = url
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.database = int(parsed.path.lstrip("/") or 0)
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def command(self, *args):
+        """
+        Sends one command on this thread's connection, connecting first if need be.
+        A connection which fails is closed, so the next command reconnects.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = RESPConnection(self.host, self.port, self.timeout)
+            if self.password is not None:
+                connection.command("AUTH", self.password)
+            if self.database:
+                connection.command("SELECT", self.database)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        try:
+            return connection.command(*args)
+        except OSError:
+            self._local.connection = None
+            connection.close()
+            raise
+
+    def _get(self, key):
+        return self.command("GET", self.key_prefix + key)
+
+    def _put(self, key, value, expires):
+        if expires is None:
+            self.command("SET", self.key_prefix + key, value)
+        else:
+            milliseconds = int((expires - time.time()) * 1000)
+            if milliseconds <= 0:
+                return
+            self.command("SET", self.key_prefix + key, value, "PX", milliseconds)
+        self.count("writes")
+
+    def _clear(self, prefix):
+        cursor = b"0"
+        while True:
+            cursor, keys = self.command("SCAN", cursor, "MATCH", self.key_prefix + prefix + "*", "COUNT", 1000)
+            if keys:
+                self.command("DEL", *keys)
+            if cursor == b"0":
+                break
+
+    def describe(self):
+        return {"host": self.host, "port": self.port, "database": self.database}
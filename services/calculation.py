@@ -0,0 +1,269 @@
+"""
+Centile and SDS calculations shared by the reference routers
+* With `lms_index_enabled` set, the server makes rcpchgrowth find the L, M and S for `Measurement` and the fictional
+child generator in the precomputed `LMS_INDEX` (see `lms_engine`) as it starts, rather than choosing a table and
+searching it on every call. Where the index has no data rcpchgrowth's own functions are called, so errors are raised
+just as before. This replaces functions inside rcpchgrowth, so is only done with the version of rcpchgrowth the index
+has been checked against (`LMS_INDEX_RCPCHGROWTH_VERSION`). With any other, rcpchgrowth's own functions are used
+"""
+# standard imports
+import json
+import logging
+from importlib import metadata
+
+# third party imports
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+
+# RCPCH imports
+import rcpchgrowth.fictional_child
+import rcpchgrowth.measurement
+from rcpchgrowth import global_functions, Measurement
+from schemas import MeasurementRequest
+
+# local imports
+from .executor import calculation_executor
+from .json_response import encode_json
+from .lms_engine import lms_at
+from .result_cache import cache_key, result_cache
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def sds_for_measurement(reference, age, measurement_method, observation_value, sex):
+    lms = lms_at(reference, measurement_method, sex, age)
+    if lms is None:
+        return global_functions.sds_for_measurement(reference, age, measurement_method, observation_value, sex)
+    l, m, s = lms
+    return global_functions.z_score(l=l, m=m, s=s, observation=observation_value)
+
+
+def percentage_median_bmi(reference, age, actual_bmi, sex):
+    lms = lms_at(reference, "bmi", sex, age)
+    if lms is None:
+        return global_functions.percentage_median_bmi(reference, age, actual_bmi, sex)
+    return (actual_bmi / lms[1]) * 100.0
+
+
+def measurement_from_sds(reference, requested_sds, measurement_method, sex, age, default_youngest_reference=False):
+    # the index holds the older UK-WHO segment at the boundary ages
+    lms = None if default_youngest_reference else lms_at(reference, measurement_method, sex, age)
+    if lms is None:
+        return global_functions.measurement_from_sds(
+            reference, requested_sds, measurement_method, sex, age, default_youngest_reference)
+    l, m, s = lms
+    return global_functions.measurement_for_z(z=requested_sds, l=l, m=m, s=s)
+
+
+# the version of rcpchgrowth whose tables, interpolation and results the index has been checked against
+LMS_INDEX_RCPCHGROWTH_VERSION = "3.2.1"
+
+# the rcpchgrowth functions replaced, by the module they are looked up in, with rcpchgrowth's own function
+LMS_INDEX_FUNCTIONS = [
+    (module, name, function, getattr(module, name, None)) for module, name, function in [
+        (rcpchgrowth.measurement, "sds_for_measurement", sds_for_measurement),
+        (rcpchgrowth.measurement, "percentage_median_bmi", percentage_median_bmi),
+        (rcpchgrowth.fictional_child, "measurement_from_sds", measurement_from_sds),
+    ]
+]
+
+
+def lms_index_unsupported():
+    """
+    Returns why the installed rcpchgrowth cannot use the index, or None if it can.
+    """
+    installed = metadata.version("rcpchgrowth")
+    if installed != LMS_INDEX_RCPCHGROWTH_VERSION:
+        return f"rcpchgrowth {installed} is installed, but the index is checked against {LMS_INDEX_RCPCHGROWTH_VERSION}"
+    for module, name, function, original in LMS_INDEX_FUNCTIONS:
+        if original is not getattr(global_functions, name, None) or getattr(module, name, None) not in (
+                function, original):
+            return f"{module.__name__} no longer looks up {name} from rcpchgrowth.global_functions"
+    return None
+
+
+def restore_rcpchgrowth():
+    """
+    Puts back rcpchgrowth's own functions wherever `use_lms_index` replaced them, so nothing else in the process, such
+    as the next test, looks L, M and S up in the index.
+    """
+    for module, name, function, original in LMS_INDEX_FUNCTIONS:
+        if getattr(module, name, None) is function:
+            setattr(module, name, original)
+
+
+def use_lms_index(enabled):
+    """
+    Makes rcpchgrowth look up L, M and S in the `LMS_INDEX`, or with its own functions again. Returns whether the
+    index is in use: it is not if the installed rcpchgrowth is not the version it has been checked against.
+    """
+    if enabled:
+        unsupported = lms_index_unsupported()
+        if unsupported is not None:
+            logger.warning("Not using the LMS index: %s.", unsupported)
+            enabled = False
+    if not enabled:
+        restore_rcpchgrowth()
+        return False
+    for module, name, function, _ in LMS_INDEX_FUNCTIONS:
+        setattr(module, name, function)
+    return True
+
+
+def calculate_measurement(reference, measurement_request):
+    """
+    Returns the rcpchgrowth calculation for one validated `MeasurementRequest` against a reference.
+    """
+    return Measurement(
+        reference=reference,
+        birth_date=measurement_request.birth_date,
+        gestation_days=measurement_request.gestation_days,
+        gestation_weeks=measurement_request.gestation_weeks,
+        measurement_method=measurement_request.measurement_method,
+        observation_date=measurement_request.observation_date,
+        observation_value=measurement_request.observation_value,
+        sex=measurement_request.sex,
+        bone_age=measurement_request.bone_age,
+        bone_age_centile=measurement_request.bone_age_centile,
+        bone_age_sds=measurement_request.bone_age_sds,
+        bone_age_text=measurement_request.bone_age_text,
+        bone_age_type=measurement_request.bone_age_type,
+        events_text=measurement_request.events_text
+    ).measurement
+
+
+async def calculate_measurement_cached(reference, measurement_request):
+    """
+    Returns the calculation for one `MeasurementRequest`, from the result cache if the same request has been
+    calculated before. Otherwise it is calculated on the calculation executor, and cached if it succeeds. Only the
+    in-memory cache is used on the event loop: the shared tiers are used in the threadpool.
+    """
+    if not result_cache.enabled:
+        return await calculation_executor.run(calculate_measurement, reference, measurement_request)
+    key = cache_key(reference, measurement_request)
+    calculation = await result_cache.get_async(key)
+    if calculation is None:
+        calculation = await calculation_executor.run(calculate_measurement, reference, measurement_request)
+        await result_cache.put_async(key, calculation)
+    return calculation
+
+
+def calculate_measurement_batch(reference, measurements):
+    """
+    Validates and calculates a list of raw measurement objects in one pass.
+    Returns one result per measurement, in the order supplied. A measurement which fails validation or calculation
+    gets `errors` in place of a `calculation`, without affecting the rest of the batch.
+    """
+    results = []
+    for index, measurement in enumerate(measurements):
+        try:
+            measurement_request = MeasurementRequest.parse_obj(measurement)
+        except ValidationError as error:
+            results.append({"index": index, "calculation": None, "errors": error.errors()})
+            continue
+        try:
+            calculation = calculate_measurement(reference, measurement_request)
+        except Exception as error:
+            results.append({
+                "index": index,
+                "calculation": None,
+                "errors": [{"loc": [], "msg": str(error), "type": type(error).__name__}]
+            })
+            continue
+        results.append({"index": index, "calculation": calculation, "errors": None})
+    return results
+
+
+def parse_ndjson_line(line):
+    """
+    Returns the measurement object on one line of NDJSON, or an error list if the line is not a JSON object. A line
+    which was too long to keep is None.
+    """
+    if line is None:
+        return None, [{
+            "loc": [], "msg": "The line is longer than the server accepts (DGC_MAX_NDJSON_LINE_BYTES)",
+            "type": "value_error.line_too_long"}]
+    try:
+        measurement = json.loads(line)
+    except ValueError as error:
+        return None, [{"loc": [], "msg": f"Invalid JSON: {error}", "type": "value_error.jsondecode"}]
+    if not isinstance(measurement, dict):
+        return None, [{"loc": [], "msg": "Each line must be a JSON object", "type": "type_error.dict"}]
+    return measurement, None
+
+
+def calculate_ndjson_lines(reference, lines, first_index):
+    """
+    Calculates a chunk of NDJSON lines, returning the NDJSON encoded results.
+    """
+    parsed = [parse_ndjson_line(line) for line in lines]
+    results = calculate_measurement_batch(
+        reference, [measurement for measurement, errors in parsed if errors is None])
+    # put the lines which were not valid JSON back in their place
+    calculated = iter(results)
+    output = []
+    for index, (measurement, errors) in enumerate(parsed, start=first_index):
+        if errors is None:
+            result = next(calculated)
+            result["index"] = index
+        else:
+            result = {"index": index, "calculation": None, "errors": errors}
+        output.append(encode_json(result))
+    return b"\n".join(output) + b"\n"
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streams NDJSON generated from the request body while it is still being received.
+    Starlette's StreamingResponse listens for the client disconnecting while it streams, which would take the request
+    body messages meant for the generator. Here only the generator reads them, and it sees a disconnect itself.
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def ndjson_lines(body, max_line_bytes):
+    """
+    Splits a streamed body into lines as it arrives, yielding the list of lines each part of the body completes.
+    A line longer than `max_line_bytes` is not kept: it is yielded as None once it ends.
+    """
+    parts, length, too_long = [], 0, False  # the line still being received
+    async for data in body:
+        *completed, rest = data.split(b"\n")
+        lines = []
+        for line in completed:
+            length += len(line)
+            lines.append(None if too_long or length > max_line_bytes else b"".join(parts + [line]))
+            parts, length, too_long = [], 0, False
+        length += len(rest)
+        if too_long or length > max_line_bytes:
+            parts, too_long = [], True
+        elif rest:
+            parts.append(rest)
+        if lines:
+            yield lines
+    if too_long:
+        yield [None]
+    elif parts:
+        yield [b"".join(parts)]
+
+
+async def calculate_measurement_stream(reference, body, chunk_size, max_line_bytes=None):
+    """
+    Calculates a streamed NDJSON body (one measurement object per line) as it arrives, yielding NDJSON results.
+    Complete lines are calculated as soon as they are received, at most `chunk_size` at a time, so only one chunk
+    of the input and output is held in memory. Blank lines are skipped and not numbered. A line longer than
+    `max_line_bytes` (by default the `max_ndjson_line_bytes` setting) gets an error result, and is not kept in memory.
+    """
+    index = 0
+    async for received in ndjson_lines(body, max_line_bytes or settings.max_ndjson_line_bytes):
+        lines = [line for line in received if line is None or line.strip()]
+        for start in range(0, len(lines), chunk_size):
+            chunk = lines[start:start + chunk_size]
+            yield await calculation_executor.run_accepted(calculate_ndjson_lines, reference, chunk, index)
+            index += len(chunk)
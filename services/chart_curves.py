@@ -0,0 +1,171 @@
+"""
+Chart coordinates generated from the LMS index on request
+* Centile lines are calculated straight from the reference tables in `LMS_INDEX` (see `lms_engine`), for any list of
+centiles or SDS and any number of points a year, rather than read from the files in `chart-data/`, which only hold the
+two standard centile formats at a fixed spacing
+* Every line of a reference table is calculated at once with NumPy. Each table's lines run from its first age to its
+last, with rcpchgrowth's spacing by default (weekly to 2 years, then monthly), so lines of the standard formats have
+the same ages as `rcpchgrowth.chart_functions.create_chart`. Ages with no reference data have no measurement
+* Responses have the shape of the chart data files, and are sliced and downsampled as the stored ones are (see
+`chart_slicing`). They are kept in a bounded LRU cache, one entry per distinct request
+"""
+# standard imports
+import json
+import threading
+from collections import OrderedDict
+
+# third party imports
+import numpy as np
+
+# RCPCH imports
+from rcpchgrowth.constants import (
+    COLE_TWO_THIRDS_SDS_NINE_CENTILE_COLLECTION, COLE_TWO_THIRDS_SDS_NINE_CENTILES, THREE_PERCENT_CENTILE_COLLECTION,
+    THREE_PERCENT_CENTILES, UK_WHO)
+
+# local imports
+from .chart_slicing import slice_chart_data
+from .encoded_payload import EncodedPayload
+from .lms_engine import centiles as centiles_for_sds
+from .lms_engine import LMS_INDEX, measurements_for_sds, sds_for_centiles, table_numbers, UK_WHO_SEGMENTS
+from .settings import settings
+
+
+def custom_chart_request(chart_request):
+    """
+    Whether a `ChartCoordinateRequest` asks for lines the chart data files do not hold.
+    """
+    return chart_request.centiles is not None or chart_request.sds is not None or \
+        chart_request.points_per_year is not None
+
+
+def line_sds(centile_format, centiles=None, sds=None):
+    """
+    Returns the (SDS, centile) of each line: the given SDS or centiles, or else those of the centile format. As in
+    rcpchgrowth, the SDS of the nine Cole centiles are rounded to the nearest 2/3, and the centiles of given SDS are
+    rounded to 4 decimal places.
+    """
+    if sds is not None:
+        sds = np.asarray(sds, dtype=float)
+        return sds, np.round(centiles_for_sds(sds), 4)
+    if centiles is None:
+        if centile_format != THREE_PERCENT_CENTILES:
+            centiles = np.asarray(COLE_TWO_THIRDS_SDS_NINE_CENTILE_COLLECTION, dtype=float)
+            return np.round(sds_for_centiles(centiles) / (2 / 3)) * (2 / 3), centiles
+        centiles = THREE_PERCENT_CENTILE_COLLECTION
+    centiles = np.asarray(centiles, dtype=float)
+    return sds_for_centiles(centiles), centiles
+
+
+def line_ages(first_age, last_age, points_per_year=None):
+    """
+    Returns the ages of the points of a line from `first_age` to `last_age`: with `points_per_year` evenly spaced, or
+    otherwise adding a week at a time up to 2 years and then a month, as `rcpchgrowth.global_functions.generate_centile`
+    does. The last age is always included.
+    """
+    if points_per_year is None:
+        ages = []
+        age = first_age
+        while age < last_age:
+            ages.append(age)
+            age += 7 / 365.25 if age <= 2 else 1 / 12
+        return np.array(ages + [last_age])
+    ages = first_age + np.arange(int(np.ceil((last_age - first_age) * points_per_year))) / points_per_year
+    return np.append(ages[ages < last_age], last_age)
+
+
+def rounded(values):
+    return [None if value != value else round(value, 4) for value in values.tolist()]
+
+
+def has_data(table):
+    # some tables list ages with no L, M or S, such as UK90 preterm BMI
+    return bool(np.isfinite(table.parameters[1]).any())
+
+
+def reference_lines(reference, sex, measurement_method, sds, centiles, points_per_year=None):
+    """
+    Returns the lines of each of a reference's tables as `{table name: [{centile, sds, x, y}, ...]}`, in order. A table
+    with no data for the sex and measurement method has no lines. Raises LookupError if the reference has no data for
+    them at all.
+    """
+    index = LMS_INDEX.get((reference, measurement_method, sex))
+    names = [name for name, _ in UK_WHO_SEGMENTS] if reference == UK_WHO else [reference]
+    if index is None or not any(has_data(table) for table in index.tables):
+        raise LookupError(f"There is no {reference} {measurement_method} data for {sex}s.")
+    tables = {}
+    for number, (name, table) in enumerate(zip(names, index.tables)):
+        if not has_data(table):
+            tables[name] = []
+            continue
+        ages = line_ages(float(table.ages[0]), float(table.ages[-1]), points_per_year)
+        # a table is used for the ages rcpchgrowth chooses it for, and at its last age, where the next table starts
+        found_in = table_numbers(reference, measurement_method, sex, ages)
+        present = found_in == number
+        present[-1] = found_in[-1] >= 0
+        l, m, s = (np.where(present, values, np.nan) for values in table.lms(ages))
+        measurements = measurements_for_sds(l, m, s, sds[:, None])
+        x = [round(age, 4) for age in ages.tolist()]
+        tables[name] = [
+            {"centile": centile, "sds": round(z * 100) / 100, "x": x, "y": rounded(values)}
+            for z, centile, values in zip(sds.tolist(), centiles.tolist(), measurements)
+        ]
+    return tables
+
+
+def chart_lines(reference, sex, measurement_method, centile_format=COLE_TWO_THIRDS_SDS_NINE_CENTILES, centiles=None,
+                sds=None, points_per_year=None):
+    """
+    Returns chart coordinates in the columnar shape of the chart data files: a list of `{table name: {sex:
+    {measurement_method: [lines]}}}` for UK-WHO, and `{reference: {sex: {measurement_method: [lines]}}}` otherwise.
+    Raises LookupError if the reference has no data for the sex and measurement method.
+    """
+    sds, centiles = line_sds(centile_format, centiles, sds)
+    tables = reference_lines(reference, sex, measurement_method, sds, centiles, points_per_year)
+    content = [{name: {sex: {measurement_method: lines}}} for name, lines in tables.items()]
+    return content if reference == UK_WHO else content[0]
+
+
+class ChartCurves:
+    """
+    Responses of chart coordinates generated from the LMS index, the most recently requested `cache_size` kept.
+    """
+
+    def __init__(self, cache_size=256):
+        self.cache_size = cache_size
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def payload(self, reference, chart_request):
+        """
+        Returns the `{"centile_data": ...}` response body for a `ChartCoordinateRequest` as an `EncodedPayload`.
+        Raises LookupError if the reference has no data for the sex and measurement method.
+        """
+        # the centile format has no bearing on lines of given centiles or SDS, so is left out of their key
+        custom_lines = chart_request.centiles is not None or chart_request.sds is not None
+        key = json.dumps(
+            [reference, chart_request.dict(exclude={"centile_format"} if custom_lines else None)], sort_keys=True)
+        with self._lock:
+            if key in self._payloads:
+                self._payloads.move_to_end(key)
+                return self._payloads[key]
+        content = chart_lines(
+            reference, chart_request.sex, chart_request.measurement_method, chart_request.centile_format,
+            chart_request.centiles, chart_request.sds, chart_request.points_per_year)
+        payload = EncodedPayload.from_content({
+            "centile_data": slice_chart_data(
+                content, chart_request.format, chart_request.min_age, chart_request.max_age,
+                chart_request.max_points_per_line)
+        })
+        with self._lock:
+            self._payloads[key] = payload
+            self._payloads.move_to_end(key)
+            while len(self._payloads) > self.cache_size:
+                self._payloads.popitem(last=False)
+        return payload
+
+    def memory_footprint(self):
+        payloads = list(self._payloads.values())
+        return {"responses": len(payloads), "bytes": sum(payload.nbytes for payload in payloads)}
+
+
+chart_curves = ChartCurves(settings.chart_curve_cache_size)
@@ -0,0 +1,243 @@
+"""
+Compact binary format for chart coordinate data
+* Each centile line is stored as packed little-endian x and y arrays (float64, or float32 with a fixed number of decimal places)
+* A small JSON header holds everything else: the nesting of references, sexes and measurement methods, and each line's centile and SDS
+* Files are memory-mapped, so every worker process on a host shares the same page-cache pages
+* Files are written under a temporary name and renamed over the old one, so a mapped file is never part written
+* The JSON shape served by the chart-coordinates endpoints is rebuilt from the arrays only when it is asked for
+
+File layout:
+    8 bytes     magic, b'DGCCHART'
+    uint16      format version
+    2 bytes     padding
+    uint32      length of the JSON header in bytes
+    header      UTF-8 JSON, padded with spaces to a multiple of 8 bytes
+    arrays      for each line: x values then y values, each array starting on an 8 byte boundary
+"""
+# standard imports
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+from pathlib import Path
+
+MAGIC = b'DGCCHART'
+VERSION = 1
+PREAMBLE = struct.Struct('<8sHxxI')
+BINARY_SUFFIX = '.cbin'
+DTYPES = {'d': 8, 'f': 4}
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _is_line(item):
+    return isinstance(item, dict) and isinstance(item.get('data'), list) and 'centile' in item
+
+
+def _pack_values(values, dtype):
+    """
+    Packs a list of numbers (or None) into little-endian bytes. Also returns the positions of values which were
+    integers in the JSON, so that they are written back out as integers.
+    """
+    integers = [index for index, value in enumerate(values) if isinstance(value, int) and not isinstance(value, bool)]
+    floats = [math.nan if value is None else float(value) for value in values]
+    return struct.pack(f'<{len(floats)}{dtype}', *floats), integers
+
+
+def encode_chart_data(chart_data, dtype='d', precision=None):
+    """
+    Encodes chart data in the shape held in `chart-data/*.json` into the binary format, returned as bytes.
+    `precision` is the number of decimal places to restore on reading, which is needed for float32 storage.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {list(DTYPES)}")
+    if dtype == 'f' and precision is None:
+        raise ValueError("float32 storage needs a precision so values can be restored exactly")
+    columns = []
+    arrays = []
+    offset = 0
+
+    def skeleton(item):
+        # replaces the points of each centile line with a reference to its columns
+        nonlocal offset
+        if _is_line(item):
+            points = item['data']
+            for point in points:
+                if point.get('l') != item['centile'] or set(point) != {'l', 'x', 'y'}:
+                    raise ValueError("Every point must be {l, x, y} with l equal to the centile of its line")
+            x_bytes, x_integers = _pack_values([point['x'] for point in points], dtype)
+            y_bytes, y_integers = _pack_values([point['y'] for point in points], dtype)
+            columns.append({
+                "offset": offset,
+                "count": len(points),
+                "x_integers": x_integers,
+                "y_integers": y_integers,
+            })
+            for array in (x_bytes, y_bytes):
+                arrays.append((offset, array))
+                offset = _align(offset + len(array))
+            return {key: ({"$columns": len(columns) - 1} if key == 'data' else value) for key, value in item.items()}
+        if isinstance(item, dict):
+            return {key: skeleton(value) for key, value in item.items()}
+        if isinstance(item, list):
+            return [skeleton(value) for value in item]
+        return item
+
+    header = {
+        "dtype": dtype,
+        "precision": precision,
+        "skeleton": skeleton(chart_data),
+        "columns": columns,
+    }
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header_bytes += b' ' * (_align(PREAMBLE.size + len(header_bytes)) - PREAMBLE.size - len(header_bytes))
+    data = bytearray(offset)
+    for array_offset, array in arrays:
+        data[array_offset:array_offset + len(array)] = array
+    return PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)) + header_bytes + bytes(data)
+
+
+class BinaryChartData:
+    """
+    Read-only, memory-mapped view of a binary chart data file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as file:
+            # the mapping stays valid after the file is closed
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"{self.path} is not a version {VERSION} binary chart data file")
+        header = json.loads(self._mmap[PREAMBLE.size:PREAMBLE.size + header_length].decode('utf-8'))
+        self.dtype = header["dtype"]
+        self.precision = header["precision"]
+        self.skeleton = header["skeleton"]
+        self._columns = header["columns"]
+        self._data_start = PREAMBLE.size + header_length
+        self._view = memoryview(self._mmap)
+
+    @property
+    def nbytes(self):
+        return len(self._mmap)
+
+    def _array(self, offset, count):
+        start = self._data_start + offset
+        array = self._view[start:start + count * DTYPES[self.dtype]].cast(self.dtype)
+        if sys.byteorder != 'little':
+            # the file is little-endian, so big-endian hosts need a byte-swapped copy
+            return struct.unpack(f'<{count}{self.dtype}', array.tobytes())
+        return array
+
+    def columns(self, index):
+        """
+        Returns the x and y arrays of a centile line without copying them out of the mapped file.
+        """
+        column = self._columns[index]
+        count = column["count"]
+        x_start = column["offset"]
+        y_start = _align(x_start + count * DTYPES[self.dtype])
+        return self._array(x_start, count), self._array(y_start, count)
+
+    def _values(self, array, integers):
+        precision = self.precision
+        values = [
+            None if math.isnan(value) else (value if precision is None else round(value, precision))
+            for value in array
+        ]
+        for index in integers:
+            values[index] = int(values[index])
+        return values
+
+    def line_values(self, index):
+        """
+        Returns the x and y values of a centile line as Python lists, exactly as they appear in the JSON.
+        """
+        column = self._columns[index]
+        x, y = self.columns(index)
+        return self._values(x, column["x_integers"]), self._values(y, column["y_integers"])
+
+    def to_json_content(self):
+        """
+        Rebuilds the chart data in the shape held in `chart-data/*.json`.
+        """
+        def rebuild(item):
+            if isinstance(item, dict):
+                if isinstance(item.get('data'), dict) and set(item['data']) == {"$columns"}:
+                    centile = item['centile']
+                    x_values, y_values = self.line_values(item['data']["$columns"])
+                    points = [{"l": centile, "x": x, "y": y} for x, y in zip(x_values, y_values)]
+                    return {key: (points if key == 'data' else value) for key, value in item.items()}
+                return {key: rebuild(value) for key, value in item.items()}
+            if isinstance(item, list):
+                return [rebuild(value) for value in item]
+            return item
+
+        return rebuild(self.skeleton)
+
+    def to_columnar_content(self):
+        """
+        Rebuilds the chart data with each centile line as `{centile, sds, x: [...], y: [...]}` rather than a list of points.
+        """
+        def rebuild(item):
+            if isinstance(item, dict):
+                if isinstance(item.get('data'), dict) and set(item['data']) == {"$columns"}:
+                    x_values, y_values = self.line_values(item['data']["$columns"])
+                    return {"centile": item['centile'], "sds": item.get('sds'), "x": x_values, "y": y_values}
+                return {key: rebuild(value) for key, value in item.items()}
+            if isinstance(item, list):
+                return [rebuild(value) for value in item]
+            return item
+
+        return rebuild(self.skeleton)
+
+    def close(self):
+        try:
+            self._view.release()
+            self._mmap.close()
+        except BufferError:
+            # arrays returned by columns() are still in use: the mapping is released when they are garbage collected
+            pass
+
+
+def convert_json_file(json_path, binary_path, dtype='d', precision=None):
+    """
+    Converts one `chart-data/*.json` file into the binary format. The file is written under a temporary name and then
+    renamed, so a worker process never maps a partly written file.
+    """
+    with open(json_path, 'r') as file:
+        chart_data = json.load(file)
+    encoded = encode_chart_data(chart_data, dtype=dtype, precision=precision)
+    binary_path = Path(binary_path)
+    temporary_path = binary_path.with_name(f'.{binary_path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(temporary_path, 'wb') as file:
+            file.write(encoded)
+        os.replace(temporary_path, binary_path)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+    return len(encoded)
+
+
+def convert_directory(source_directory, destination_directory=None, dtype='d', precision=None):
+    """
+    Converts every JSON chart data file in a directory, writing `.cbin` files alongside them unless a
+    destination is given. Returns a list of (file name, JSON bytes, binary bytes).
+    """
+    source_directory = Path(source_directory)
+    destination_directory = Path(destination_directory or source_directory)
+    destination_directory.mkdir(parents=True, exist_ok=True)
+    converted = []
+    for json_path in sorted(source_directory.glob('*.json')):
+        binary_path = destination_directory / (json_path.stem + BINARY_SUFFIX)
+        binary_size = convert_json_file(json_path, binary_path, dtype=dtype, precision=precision)
+        converted.append((json_path.name, json_path.stat().st_size, binary_size))
+    return converted
@@ -0,0 +1,310 @@
+"""
+In-memory store for the chart coordinate data in `chart-data/`
+* Each file is read and parsed at most once per process and then served from memory
+* Each combination's response body is also serialized once and kept with its compressed variants, see `EncodedPayload`
+* Responses can be in the stored shape (`points`) or with each centile line as x and y arrays (`columnar`)
+* Responses sliced to an age window and/or downsampled are kept in a bounded LRU cache, one entry per distinct request,
+  and in the caches shared between worker processes, if any are configured (see `result_cache`)
+* With `DGC_CHART_DATA_FORMAT=binary` the `.cbin` files written by `python cli.py convert-chart-data` are memory-mapped
+  instead, and the JSON is only rebuilt from them when a response is first requested, or as the server starts with
+  `DGC_PRELOAD_CHART_DATA`
+* `reload()` discards everything held and reads the files from disk again
+* Unless `DGC_CHART_DATA_GENERATION=off`, a file which does not exist yet is generated on its first request, while
+  requests for other files carry on being served (see `chart_generation`)
+"""
+# standard imports
+import json
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# third party imports
+from rcpchgrowth import constants
+
+# local imports
+from .chart_data_binary import BINARY_SUFFIX, BinaryChartData, convert_json_file
+from .chart_generation import ChartDataGenerator, generate_chart_data_file
+from .chart_slicing import slice_chart_data
+from .encoded_payload import EncodedPayload
+from .result_cache import chart_cache
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def chart_data_keys():
+    """
+    Yields every (centile_format, reference, sex, measurement_method) combination the server provides chart data for.
+    """
+    for centile_format in [constants.COLE_TWO_THIRDS_SDS_NINE_CENTILES, constants.THREE_PERCENT_CENTILES]:
+        for reference in constants.REFERENCES:
+            for sex in constants.SEXES:
+                for measurement_method in constants.MEASUREMENT_METHODS:
+                    # There are no Turner's references for males or for non-height measurements
+                    if reference == constants.TURNERS and (sex != "female" or measurement_method != "height"):
+                        continue
+                    yield (centile_format, reference, sex, measurement_method)
+
+
+def columnar_chart_data(chart_data):
+    """
+    Reshapes chart data so each centile line is `{centile, sds, x: [...], y: [...]}` rather than a list of `{l, x, y}` points.
+    """
+    if isinstance(chart_data, dict):
+        if isinstance(chart_data.get('data'), list) and 'centile' in chart_data:
+            return {
+                "centile": chart_data['centile'],
+                "sds": chart_data.get('sds'),
+                "x": [point['x'] for point in chart_data['data']],
+                "y": [point['y'] for point in chart_data['data']],
+            }
+        return {key: columnar_chart_data(value) for key, value in chart_data.items()}
+    if isinstance(chart_data, list):
+        return [columnar_chart_data(item) for item in chart_data]
+    return chart_data
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Approximate memory footprint in bytes of a parsed JSON object, including everything it contains.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+class ChartDataStore:
+    """
+    Process-wide store of chart coordinate data, keyed by (centile_format, reference, sex, measurement_method).
+    Holds either the parsed JSON files or memory-mapped binary files, depending on `storage_format`.
+    """
+
+    def __init__(self, directory, storage_format="json", sliced_cache_size=256, shared_cache=None,
+                 generate_missing=False):
+        if storage_format not in ("json", "binary"):
+            raise ValueError("storage_format must be 'json' or 'binary'")
+        self.directory = Path(directory)
+        self.storage_format = storage_format
+        self._sources = {}
+        self._payloads = {}
+        self._sliced_payloads = OrderedDict()
+        self.sliced_cache_size = sliced_cache_size
+        self.shared_cache = shared_cache
+        self.generate_missing = generate_missing
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def json_path_for(self, centile_format, reference, sex, measurement_method):
+        return self.directory / f'{centile_format}-{reference}-{sex}-{measurement_method}.json'
+
+    def path_for(self, centile_format, reference, sex, measurement_method):
+        """
+        Path of the file this store reads for the combination, in its storage format.
+        """
+        json_path = self.json_path_for(centile_format, reference, sex, measurement_method)
+        if self.storage_format == "binary":
+            return json_path.with_suffix(BINARY_SUFFIX)
+        return json_path
+
+    def source(self, centile_format, reference, sex, measurement_method):
+        """
+        Returns the parsed JSON, or the memory-mapped `BinaryChartData`, for this combination, reading it from disk if
+        this is the first request for it. If the file does not exist and `generate_missing` is set it is generated.
+        Raises FileNotFoundError if there is no chart data file for the combination.
+        """
+        key = (centile_format, reference, sex, measurement_method)
+        try:
+            return self._sources[key]
+        except KeyError:
+            pass
+        # one lock per key, so a slow first read of one file does not hold up requests for the others
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._sources:
+                path = self.path_for(*key)
+                if self.generate_missing and not path.exists():
+                    self.generate(key)
+                if self.storage_format == "binary":
+                    self._sources[key] = BinaryChartData(path)
+                else:
+                    with open(path, 'r') as file:
+                        self._sources[key] = json.load(file)
+                logger.info("Chart data loaded into memory for %s.", "-".join(key))
+        return self._sources[key]
+
+    def generate(self, key):
+        """
+        Writes the chart data file for a combination, in the store's storage format.
+        """
+        json_path = self.json_path_for(*key)
+        if not json_path.exists():
+            logger.info("Chart data file does not exist for %s: generating it.", "-".join(key))
+            generate_chart_data_file(json_path, key)
+        if self.storage_format == "binary":
+            convert_json_file(json_path, self.path_for(*key))
+
+    def get(self, centile_format, reference, sex, measurement_method):
+        """
+        Returns the chart data for this combination in the shape held in `chart-data/*.json`.
+        Raises FileNotFoundError if there is no chart data file for the combination.
+        """
+        source = self.source(centile_format, reference, sex, measurement_method)
+        if isinstance(source, BinaryChartData):
+            return source.to_json_content()
+        return source
+
+    def payload(self, centile_format, reference, sex, measurement_method, response_format="points"):
+        """
+        Returns the serialized `{"centile_data": ...}` response body for this combination as an `EncodedPayload`.
+        `response_format` is `points` for the stored shape or `columnar` for x and y arrays per centile line.
+        Raises FileNotFoundError if there is no chart data file for the combination.
+        """
+        key = (centile_format, reference, sex, measurement_method)
+        try:
+            return self._payloads[key, response_format]
+        except KeyError:
+            pass
+        source = self.source(*key)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if (key, response_format) not in self._payloads:
+                if response_format == "columnar":
+                    if isinstance(source, BinaryChartData):
+                        content = source.to_columnar_content()
+                    else:
+                        content = columnar_chart_data(source)
+                elif isinstance(source, BinaryChartData):
+                    content = source.to_json_content()
+                else:
+                    content = source
+                self._payloads[key, response_format] = EncodedPayload.from_content({"centile_data": content})
+        return self._payloads[key, response_format]
+
+    def sliced_payload(self, centile_format, reference, sex, measurement_method, response_format="points",
+                       min_age=None, max_age=None, max_points_per_line=None):
+        """
+        Returns the response body for this combination with every line cut to the ages min_age to max_age and
+        downsampled to at most max_points_per_line points. Results are cached per distinct set of arguments.
+        Raises FileNotFoundError if there is no chart data file for the combination.
+        """
+        if min_age is None and max_age is None and max_points_per_line is None:
+            return self.payload(centile_format, reference, sex, measurement_method, response_format)
+        cache_key = (centile_format, reference, sex, measurement_method, response_format,
+                     min_age, max_age, max_points_per_line)
+        with self._lock:
+            if cache_key in self._sliced_payloads:
+                self._sliced_payloads.move_to_end(cache_key)
+                return self._sliced_payloads[cache_key]
+        payload = None
+        shared_key = self.shared_key(cache_key)
+        if shared_key is not None:
+            body = self.shared_cache.get(shared_key)
+            if body is not None:
+                payload = EncodedPayload(body)
+        if payload is None:
+            source = self.source(centile_format, reference, sex, measurement_method)
+            if isinstance(source, BinaryChartData):
+                columnar_content = source.to_columnar_content()
+            else:
+                columnar_content = columnar_chart_data(source)
+            payload = EncodedPayload.from_content({
+                "centile_data": slice_chart_data(
+                    columnar_content, response_format, min_age, max_age, max_points_per_line)
+            })
+            # the file may only just have been generated
+            shared_key = self.shared_key(cache_key)
+            if shared_key is not None:
+                self.shared_cache.put(shared_key, payload.body)
+        with self._lock:
+            self._sliced_payloads[cache_key] = payload
+            self._sliced_payloads.move_to_end(cache_key)
+            while len(self._sliced_payloads) > self.sliced_cache_size:
+                self._sliced_payloads.popitem(last=False)
+        return payload
+
+    def shared_key(self, cache_key):
+        """
+        Key for a sliced response in the shared cache, or None if there is no shared cache or the file does not exist.
+        The file's modification time keeps responses built from older chart data from being shared.
+        """
+        if self.shared_cache is None or not self.shared_cache.enabled:
+            return None
+        try:
+            modified = self.path_for(*cache_key[:4]).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        return json.dumps(cache_key + (self.storage_format, modified))
+
+    def preload(self):
+        """
+        Loads every chart data file which exists and builds its response body, with all the compressed variants and
+        their ETags, so no request pays for compressing it. Returns the number of files held in memory afterwards.
+        """
+        for key in chart_data_keys():
+            if self.path_for(*key).exists():
+                self.payload(*key).precompress()
+        return len(self._sources)
+
+    def reload(self):
+        """
+        Drops everything held in memory and reads again from disk every file which had been loaded. Memory-mapped
+        binary files are unmapped.
+        """
+        with self._lock:
+            sources = self._sources
+            self._sources = {}
+            self._payloads = {}
+            self._sliced_payloads = OrderedDict()
+            self._key_locks = {}
+        for source in sources.values():
+            if isinstance(source, BinaryChartData):
+                source.close()
+        keys = list(sources)
+        for key in keys:
+            if self.path_for(*key).exists():
+                self.payload(*key)
+        return self.memory_footprint()
+
+    def memory_footprint(self):
+        """
+        Reports the files held in memory and their approximate size in bytes, including serialized response bodies.
+        Memory-mapped binary files are reported separately, as their pages are shared between worker processes.
+        """
+        payloads = dict(self._payloads)
+        files = {}
+        mapped_bytes = 0
+        for key, source in list(self._sources.items()):
+            if isinstance(source, BinaryChartData):
+                mapped_bytes += source.nbytes
+                size = 0
+            else:
+                size = deep_sizeof(source)
+            size += sum(payload.nbytes for (payload_key, _), payload in payloads.items() if payload_key == key)
+            files['-'.join(key)] = size
+        return {
+            "storage_format": self.storage_format,
+            "loaded_files": len(files),
+            "total_bytes": sum(files.values()),
+            "mapped_bytes": mapped_bytes,
+            "sliced_responses": len(self._sliced_payloads),
+            "sliced_bytes": sum(payload.nbytes for payload in list(self._sliced_payloads.values())),
+            "files": files
+        }
+
+
+chart_data_store = ChartDataStore(
+    settings.chart_data_directory, settings.chart_data_format, settings.chart_slice_cache_size, chart_cache,
+    generate_missing=settings.chart_data_generation != "off")
+chart_data_generator = ChartDataGenerator(chart_data_store, chart_data_keys, settings.chart_data_generation_workers)
@@ -0,0 +1,170 @@
+"""
+Generation of the chart coordinate files in `chart-data/`
+* `python cli.py generate-chart-data` writes every missing file at build time, in parallel across CPU cores
+* With `DGC_CHART_DATA_GENERATION=background` the server generates missing files in the background once it has started,
+  and reports itself not ready at `/health/ready` until they have all been written
+* Only one worker process generates them: the one which locks `.generation.lock` in the chart data directory (see
+  `file_locks`). The others wait for the lock, by which time nothing is left to generate
+* With `background` or `on-demand`, a request for a file which is still missing generates it, see `ChartDataStore.source`
+* Files are written under a temporary name and then renamed, so a partly written file is never read
+"""
+# standard imports
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# third party imports
+from rcpchgrowth import chart_functions
+
+# local imports
+from .file_locks import try_lock
+
+logger = logging.getLogger(__name__)
+
+GENERATION_LOCK_NAME = ".generation.lock"
+
+
+def chart_data_name(key):
+    return '-'.join(key)
+
+
+def generate_chart_data_file(path, key):
+    """
+    Creates the chart coordinates for one (centile_format, reference, sex, measurement_method) combination and
+    writes them to `path`.
+    """
+    centile_format, reference, sex, measurement_method = key
+    chart_data = chart_functions.create_chart(
+        reference,
+        measurement_method=measurement_method,
+        sex=sex,
+        centile_format=centile_format
+    )
+    temporary_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(temporary_path, 'w') as file:
+            file.write(json.dumps(chart_data, indent=4))
+        os.replace(temporary_path, path)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+    return path
+
+
+def generate_chart_data(store, keys, workers=None):
+    """
+    Generates the chart data files for `keys`, in parallel in `workers` processes (default: one per CPU core).
+    Yields (key, error) as each one finishes, where error is None if the file was written.
+    """
+    keys = list(keys)
+    workers = min(workers or os.cpu_count() or 1, len(keys))
+    if workers <= 1:
+        for key in keys:
+            try:
+                generate_chart_data_file(store.json_path_for(*key), key)
+                yield key, None
+            except Exception as error:
+                yield key, error
+        return
+    # the server process already runs threads, which forked processes could deadlock on, so they are spawned
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(generate_chart_data_file, store.json_path_for(*key), key): key for key in keys}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
+
+
+class ChartDataGenerator:
+    """
+    Generates the missing chart data files of a `ChartDataStore` in a background thread, reporting its progress.
+    While another process holds the generation lock its state is `waiting`.
+    """
+
+    # seconds between attempts to take the generation lock
+    lock_poll_interval = 1.0
+
+    def __init__(self, store, keys, workers=None):
+        self.store = store
+        self.keys = keys
+        self.workers = workers
+        self.lock_path = Path(store.directory) / GENERATION_LOCK_NAME
+        self.state = "idle"
+        self.total = 0
+        self.generated = 0
+        self.failed = {}
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state in ("idle", "ready")
+
+    def missing(self):
+        return [key for key in self.keys() if not self.store.json_path_for(*key).exists()]
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.state = "generating"
+        self._thread = threading.Thread(target=self.run, name="chart-data-generator", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """
+        Generates every missing file, once no other process is generating them. Files which cannot be generated are
+        reported, rather than stopping the server becoming ready: requests for them fail as if the file had never
+        existed. If generation stops part way, eg because a worker process died, the files not yet generated are
+        reported as failed.
+        """
+        lock = None
+        missing = []
+        try:
+            if self.missing():
+                lock = self.wait_for_lock()
+            self.state = "generating"
+            missing = self.missing()
+            self.total, self.generated, self.failed = len(missing), 0, {}
+            for key, error in generate_chart_data(self.store, missing, self.workers):
+                if error is None:
+                    self.generated += 1
+                    logger.info("Chart data file created for %s.", chart_data_name(key))
+                else:
+                    self.failed[chart_data_name(key)] = str(error)
+                    logger.error("Chart data not created for %s due to: %s", chart_data_name(key), error)
+        except Exception as error:
+            logger.error("Chart data generation stopped due to: %s", error)
+            for key in missing:
+                if not self.store.json_path_for(*key).exists():
+                    self.failed.setdefault(chart_data_name(key), str(error))
+        finally:
+            if lock is not None:
+                lock.close()
+            self.state = "ready"
+
+    def wait_for_lock(self):
+        """
+        Returns the generation lock once this process holds it, waiting while another process generates the files.
+        """
+        lock = try_lock(self.lock_path)
+        if lock is None:
+            self.state = "waiting"
+            logger.info("Waiting for another process to generate the missing chart data files.")
+        while lock is None:
+            time.sleep(self.lock_poll_interval)
+            lock = try_lock(self.lock_path)
+        return lock
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self):
+        return {
+            "state": self.state,
+            "missing_files": self.total,
+            "generated_files": self.generated,
+            "failed_files": dict(self.failed),
+        }
@@ -0,0 +1,104 @@
+"""
+Server-side slicing and downsampling of chart coordinate lines
+* Each line's x values (decimal ages) are sorted, so an age window is found by binary search
+* Lines are thinned with Largest-Triangle-Three-Buckets, which keeps the visual shape of a curve with few points
+"""
+# standard imports
+from bisect import bisect_left, bisect_right
+
+
+def age_window(x, min_age=None, max_age=None):
+    """
+    Returns the (start, stop) slice of the sorted ages `x` covering min_age to max_age.
+    The nearest point either side of the window is included, so a plotted line reaches the edges of the window.
+    A line which does not overlap the window at all has no points in it.
+    """
+    if x and ((min_age is not None and min_age > x[-1]) or (max_age is not None and max_age < x[0])):
+        return 0, 0
+    start = 0 if min_age is None else max(bisect_left(x, min_age) - 1, 0)
+    stop = len(x) if max_age is None else min(bisect_right(x, max_age) + 1, len(x))
+    return start, max(start, stop)
+
+
+def largest_triangle_three_buckets(x, y, threshold):
+    """
+    Returns the indices of at most `threshold` points which best preserve the shape of the line through (x, y).
+    The first and last points are always kept.
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return list(range(length))
+    selected = [0]
+    bucket_size = (length - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        stop = int((bucket + 1) * bucket_size) + 1
+        # the average of the next bucket is the third corner of each triangle
+        next_start = stop
+        next_stop = min(int((bucket + 2) * bucket_size) + 1, length)
+        next_count = next_stop - next_start
+        average_x = sum(x[next_start:next_stop]) / next_count
+        average_y = sum(y[next_start:next_stop]) / next_count
+        previous_x = x[previous]
+        previous_y = y[previous]
+        largest_area = -1.0
+        previous_candidate = start
+        for index in range(start, stop):
+            area = abs(
+                (previous_x - average_x) * (y[index] - previous_y)
+                - (previous_x - x[index]) * (average_y - previous_y)
+            )
+            if area > largest_area:
+                largest_area = area
+                previous_candidate = index
+        selected.append(previous_candidate)
+        previous = previous_candidate
+    selected.append(length - 1)
+    return selected
+
+
+def select_points(x, y, min_age=None, max_age=None, max_points=None):
+    """
+    Returns the indices of the points of one line to send, after slicing to the age window and downsampling.
+    Points with no y value cannot be plotted, so they are dropped before downsampling.
+    """
+    start, stop = age_window(x, min_age, max_age)
+    indices = list(range(start, stop))
+    if max_points is None or len(indices) <= max_points:
+        return indices
+    indices = [index for index in indices if y[index] is not None]
+    kept = largest_triangle_three_buckets(
+        [x[index] for index in indices], [y[index] for index in indices], max_points)
+    return [indices[index] for index in kept]
+
+
+def slice_chart_data(columnar_content, response_format="points", min_age=None, max_age=None, max_points=None):
+    """
+    Slices and downsamples every centile line of chart data in the columnar shape, returning it in `response_format`.
+    """
+    if isinstance(columnar_content, dict):
+        if 'x' in columnar_content and 'y' in columnar_content and 'centile' in columnar_content:
+            x = columnar_content['x']
+            y = columnar_content['y']
+            indices = select_points(x, y, min_age, max_age, max_points)
+            centile = columnar_content['centile']
+            if response_format == "columnar":
+                return {
+                    "centile": centile,
+                    "sds": columnar_content['sds'],
+                    "x": [x[index] for index in indices],
+                    "y": [y[index] for index in indices],
+                }
+            return {
+                "sds": columnar_content['sds'],
+                "centile": centile,
+                "data": [{"l": centile, "x": x[index], "y": y[index]} for index in indices],
+            }
+        return {
+            key: slice_chart_data(value, response_format, min_age, max_age, max_points)
+            for key, value in columnar_content.items()
+        }
+    if isinstance(columnar_content, list):
+        return [slice_chart_data(item, response_format, min_age, max_age, max_points) for item in columnar_content]
+    return columnar_content
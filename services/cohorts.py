@@ -0,0 +1,191 @@
+"""
+Synthetic cohorts for load and scale testing
+* A cohort is `number_of_children` fictional children (see `fictional_children`) with a mix of references, sexes,
+measurement methods and gestations: each of these left out of a `CohortRequest` is drawn at random for each child, in
+the proportions the request gives. Children on the Turner reference are always girls measured by height, the only
+data it has, so a cohort of boys or of another measurement method has none on it
+* Children are generated in chunks by a pool of worker processes and written in order as they finish, as NDJSON or
+Parquet, so millions of rows are generated without being held in memory. A seeded cohort is the same however many
+processes generate it
+* Each row has the columns a bulk calculation job reads, with the child's `reference`, so a Parquet cohort can be
+uploaded to `/jobs` as it is, and an NDJSON one replayed by `benchmarks.load`
+"""
+# standard imports
+import os
+from collections import deque
+
+# third party imports
+import numpy as np
+
+# local imports
+from .fictional_children import (
+    child_random_generator, fictional_children_columns, measurement_count, rows_from_columns, ROW_COLUMNS)
+from .json_response import encode_json
+from .parquet_support import import_pyarrow
+
+COHORT_FORMATS = {"ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+# the measurement columns, without the calculated ages, SDS and centiles
+MEASUREMENT_COLUMNS = ROW_COLUMNS[:ROW_COLUMNS.index("observation_value") + 1]
+
+MEASUREMENT_METHODS = ["height", "weight", "ofc", "bmi"]
+SEXES = ["male", "female"]
+TURNERS_SYNDROME = "turners-syndrome"
+
+PRETERM_WEEKS = (24, 36)
+TERM_WEEKS = (37, 41)
+
+# rows generated by a worker process at a time
+COHORT_CHUNK_ROWS = 20000
+
+
+def turner_child_possible(parameters):
+    return parameters["sex"] != "male" and parameters["measurement_method"] in (None, "height")
+
+
+def cohort_child_parameters(parameters, rng):
+    """
+    The fictional child parameters of one child of a cohort, drawing whatever the cohort leaves out.
+    """
+    child = dict(parameters)
+    if child["reference"] is None:
+        references = [
+            reference for reference in parameters["reference_weights"]
+            if reference != TURNERS_SYNDROME or turner_child_possible(parameters)]
+        weights = np.array([parameters["reference_weights"][reference] for reference in references], dtype=float)
+        child["reference"] = references[rng.choice(len(references), p=weights / weights.sum())]
+    if child["reference"] == TURNERS_SYNDROME:
+        child["sex"], child["measurement_method"] = "female", "height"
+    if child["sex"] is None:
+        child["sex"] = SEXES[rng.integers(len(SEXES))]
+    if child["measurement_method"] is None:
+        child["measurement_method"] = MEASUREMENT_METHODS[rng.integers(len(MEASUREMENT_METHODS))]
+    if child["gestation_weeks"] is None:
+        first, last = PRETERM_WEEKS if rng.random() < parameters["preterm_fraction"] else TERM_WEEKS
+        child["gestation_weeks"] = int(rng.integers(first, last + 1))
+        child["gestation_days"] = int(rng.integers(0, 7))
+    return child
+
+
+def cohort_columns(parameters, entropy, first_child, end_child):
+    """
+    Generates children `first_child` up to `end_child` of a cohort, as one array per column.
+    """
+    children = []
+    for child in range(first_child, end_child):
+        rng = child_random_generator(entropy, child)
+        children.append((child, cohort_child_parameters(parameters, rng), rng))
+    columns = fictional_children_columns(parameters, children)
+    if not parameters["include_calculated"]:
+        columns = {column: columns[column] for column in MEASUREMENT_COLUMNS}
+    return columns
+
+
+def generate_cohort_chunk(parameters, entropy, first_child, end_child):
+    """
+    Generates a chunk of a cohort in a worker process, returning the row count and the rows ready to write: NDJSON
+    bytes, or arrays for Parquet.
+    """
+    columns = cohort_columns(parameters, entropy, first_child, end_child)
+    rows = len(columns["child"])
+    if parameters["output_format"] == "ndjson":
+        return rows, b"".join(encode_json(row) + b"\n" for row in rows_from_columns(columns))
+    return rows, columns
+
+
+class NDJSONCohortWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetCohortWriter:
+    def __init__(self, path, include_calculated):
+        pyarrow = self.pyarrow = import_pyarrow()
+        fields = [
+            ("child", pyarrow.int64()),
+            ("reference", pyarrow.string()),
+            ("birth_date", pyarrow.date32()),
+            ("observation_date", pyarrow.date32()),
+            ("gestation_weeks", pyarrow.int64()),
+            ("gestation_days", pyarrow.int64()),
+            ("sex", pyarrow.string()),
+            ("measurement_method", pyarrow.string()),
+        ]
+        fields += [
+            (column, pyarrow.float64())
+            for column in (ROW_COLUMNS if include_calculated else MEASUREMENT_COLUMNS)[len(fields):]
+        ]
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, chunk):
+        # NaN is written as null
+        arrays = [
+            self.pyarrow.array(chunk[field.name], type=field.type, from_pandas=True) for field in self.schema
+        ]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def cohort_writer(path, output_format, include_calculated):
+    if output_format == "parquet":
+        return ParquetCohortWriter(path, include_calculated)
+    return NDJSONCohortWriter(path)
+
+
+def children_per_chunk(parameters, chunk_rows=COHORT_CHUNK_ROWS):
+    rows_per_child = measurement_count(
+        parameters["start_chronological_age"], parameters["end_age"], parameters["measurement_interval_type"],
+        parameters["measurement_interval_number"])
+    return max(1, chunk_rows // max(rows_per_child, 1))
+
+
+def write_cohort(parameters, entropy, path, executor, workers, progress=None, stopping=None,
+                 chunk_rows=COHORT_CHUNK_ROWS):
+    """
+    Generates the cohort of a `CohortRequest`'s parameters with `executor`'s worker processes, writing it to `path`.
+    `progress(children, rows)` is called as each chunk is written. Returns the number of rows, or None if `stopping`
+    was set before the cohort was finished. Raises ValueError if the measurement interval is invalid, and ImportError
+    for a Parquet cohort if pyarrow is not installed.
+    """
+    number_of_children = parameters["number_of_children"]
+    step = children_per_chunk(parameters, chunk_rows)
+    partial_path = path.with_name(path.name + ".part")
+    writer = cohort_writer(partial_path, parameters["output_format"], parameters["include_calculated"])
+    children = rows = 0
+    try:
+        pending = deque()
+
+        def write_next():
+            nonlocal children, rows
+            chunk_children, future = pending.popleft()
+            chunk_rows_written, chunk = future.result()
+            writer.write(chunk)
+            children += chunk_children
+            rows += chunk_rows_written
+            if progress is not None:
+                progress(children, rows)
+
+        for first_child in range(0, number_of_children, step):
+            end_child = min(first_child + step, number_of_children)
+            pending.append((end_child - first_child, executor.submit(
+                generate_cohort_chunk, parameters, entropy, first_child, end_child)))
+            # keep every worker busy without holding the whole cohort in memory
+            while len(pending) > workers * 2:
+                write_next()
+            if stopping is not None and stopping.is_set():
+                return None
+        while pending:
+            write_next()
+    finally:
+        writer.close()
+    os.replace(partial_path, path)
+    return rows
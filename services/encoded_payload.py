@@ -0,0 +1,155 @@
+"""
+Pre-serialized JSON response bodies
+* The body is serialized once and compressed at most once per encoding
+* Every encoding has its own strong ETag, taken from a hash of the bytes sent, so clients and CDNs can revalidate with `If-None-Match`
+* The chart data bodies, their compressed variants and ETags are built as the server starts with `DGC_PRELOAD_CHART_DATA`
+  (see `ChartDataStore.preload`). Without it each is built on the first request for it, which pays for compressing it,
+  so the server starts quickly and only holds the charts which are asked for
+"""
+# standard imports
+import gzip
+import hashlib
+import json
+import threading
+
+# third party imports
+from fastapi import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional: without it only gzip and uncompressed bodies are served
+    brotli = None
+
+# local imports
+from .settings import settings
+
+
+def serialize_json(content):
+    """
+    Serializes `content` to exactly the bytes FastAPI's default JSONResponse would send.
+    """
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def available_encodings():
+    """
+    Content codings this server can produce, in order of preference.
+    """
+    if brotli is not None:
+        return ["br", "gzip", "identity"]
+    return ["gzip", "identity"]
+
+
+def select_encoding(accept_encoding):
+    """
+    Picks the preferred content coding from an `Accept-Encoding` header value.
+    """
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, parameters = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        parameter_name, _, value = parameters.strip().partition("=")
+        if parameter_name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+    for coding in available_encodings():
+        if coding == "identity":
+            break
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return "identity"
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.brotli_quality)
+    if encoding == "gzip":
+        # mtime=0 keeps the compressed bytes, and so the ETag, identical in every worker process
+        return gzip.compress(body, compresslevel=settings.gzip_level, mtime=0)
+    return body
+
+
+def strong_etag(body):
+    return f'"{hashlib.sha256(body).hexdigest()[:40]}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Weak comparison, as RFC 7232 requires for `If-None-Match`.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().replace("W/", "", 1) == etag for candidate in if_none_match.split(",")
+    )
+
+
+class EncodedPayload:
+    """
+    A JSON response body serialized once, with its compressed variants and their ETags.
+    """
+
+    def __init__(self, body, media_type="application/json"):
+        self.body = body
+        self.media_type = media_type
+        self._variants = {"identity": (body, strong_etag(body))}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_content(cls, content):
+        return cls(serialize_json(content))
+
+    def variant(self, encoding):
+        """
+        Returns the (body, etag) pair for a content coding, compressing on first use.
+        """
+        try:
+            return self._variants[encoding]
+        except KeyError:
+            pass
+        with self._lock:
+            if encoding not in self._variants:
+                encoded = compress(self.body, encoding)
+                self._variants[encoding] = (encoded, strong_etag(encoded))
+        return self._variants[encoding]
+
+    def precompress(self):
+        for encoding in available_encodings():
+            self.variant(encoding)
+        return self
+
+    @property
+    def nbytes(self):
+        return sum(len(body) for body, _ in list(self._variants.values()))
+
+    def response(self, request, cache_control=None):
+        """
+        Builds the response for a request, honouring `Accept-Encoding` and `If-None-Match`.
+        `cache_control` defaults to the chart data `Cache-Control` setting.
+        """
+        encoding = select_encoding(request.headers.get("accept-encoding"))
+        body, etag = self.variant(encoding)
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": cache_control or settings.chart_data_cache_control,
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=self.media_type, headers=headers)
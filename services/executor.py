@@ -0,0 +1,126 @@
+"""
+Where the CPU-bound calculations run
+* `threadpool`: in Starlette's threadpool, as FastAPI runs plain `def` endpoints. Calculations share one core,
+because of the GIL
+* `process`: in a pool of warm worker processes which have already loaded rcpchgrowth and its reference data, so
+calculations use every core
+* `inline`: on the event loop itself, one at a time; useful for debugging and profiling
+* Calculations waiting or running are counted. Past `DGC_EXECUTOR_MAX_PENDING` new calculations are refused with a
+503, rather than queueing without limit
+"""
+# standard imports
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# third party imports
+from starlette.concurrency import run_in_threadpool
+
+# local imports
+from .profiling import in_profiled_thread
+from .settings import settings
+
+
+class ExecutorSaturated(Exception):
+    """
+    Raised when too many calculations are already waiting, so the server should shed load.
+    """
+
+
+def warm_worker():
+    """
+    Runs once in each worker process as it starts, loading rcpchgrowth and its reference data, and running one
+    calculation so the first real request is not slowed down by lazy initialisation. With `lms_index_enabled`, the
+    worker looks up L, M and S in the LMS index, as the server does.
+    """
+    from datetime import date
+    from rcpchgrowth import Measurement, generate_fictional_child_data  # noqa: F401
+    from .calculation import use_lms_index
+    use_lms_index(settings.lms_index_enabled)
+    Measurement(
+        reference="uk-who",
+        birth_date=date(2020, 4, 12),
+        observation_date=date(2028, 6, 12),
+        measurement_method="height",
+        observation_value=115,
+        sex="female",
+    )
+
+
+def worker_ready():
+    return os.getpid()
+
+
+class CalculationExecutor:
+    def __init__(self, backend="threadpool", workers=None, max_pending=256):
+        self.backend = backend
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts and warms the worker processes, if the process backend is in use.
+        """
+        if self.backend != "process":
+            return
+        with self._lock:
+            if self._pool is not None:
+                return
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_worker,
+            )
+        # every worker starts, and runs warm_worker, before the first request is served
+        futures = [self._pool.submit(worker_ready) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def check_capacity(self):
+        """
+        Raises ExecutorSaturated if no more calculations can be accepted.
+        """
+        if self.backend != "inline" and self.pending >= self.max_pending:
+            raise ExecutorSaturated(f"{self.pending} calculations are already waiting.")
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Runs `function(*args, **kwargs)` on the configured backend and returns its result.
+        With the process backend, the function, its arguments and its result must be picklable.
+        """
+        self.check_capacity()
+        return await self.run_accepted(function, *args, **kwargs)
+
+    async def run_accepted(self, function, *args, **kwargs):
+        """
+        As `run`, but always waits its turn. For work which has already been accepted, such as the later chunks of a
+        streamed request.
+        """
+        call = functools.partial(function, *args, **kwargs)
+        if self.backend == "inline":
+            return call()
+        self.pending += 1
+        try:
+            if self.backend == "process":
+                if self._pool is None:
+                    await run_in_threadpool(self.start)
+                return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+            return await run_in_threadpool(in_profiled_thread(call))
+        finally:
+            self.pending -= 1
+
+
+calculation_executor = CalculationExecutor(
+    settings.executor_backend, settings.executor_workers, settings.executor_max_pending)
@@ -0,0 +1,213 @@
+"""
+Vectorised fictional child generation
+* Generates a child's whole measurement trajectory at once with NumPy: the ages and dates of every measurement, the
+SDS drifting from `start_sds` towards `start_sds + drift_range`, the measurement at each SDS from the reference's LMS
+values, then noise, and the SDS and centiles of the noisy measurement. `rcpchgrowth.generate_fictional_child_data`
+builds a full `Measurement` for each point in turn instead
+* Follows rcpchgrowth's generator: the same birth date, intervals and dates, the measurement taken at the SDS for the
+chronological age, noise as a uniform error of up to `noise_range` of the measurement, rounded to 1 decimal place.
+Drift is applied in equal steps, rounded to 3 decimal places once rather than after every step
+* Noise and each child's starting SDS are drawn from a random generator seeded from the request's `seed` and the
+child's number, so a seeded request always generates the same children, however they are split between workers
+* Children sharing a measurement schedule are generated together in one pass over all their rows, each with its own
+reference, measurement method, sex and gestation, as in a synthetic cohort (see `cohorts`)
+* Each measurement is one row: the columns a bulk calculation job reads, and the ages, SDS and centiles calculated
+* Streamed responses stop generating children as soon as the client disconnects
+"""
+# standard imports
+import math
+from datetime import date
+
+# third party imports
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# local imports
+from .executor import calculation_executor
+from .json_response import column_values, encode_json
+from .lms_engine import centiles, lms_for_age, measurements_for_sds, reference_has_data, z_scores
+from .settings import settings
+
+# François Guéneau de Montbeillard, whose growth chart was the first published, as in rcpchgrowth
+BIRTH_DATE = np.datetime64(date(1759, 4, 11), "D")
+TERM_PREGNANCY_LENGTH_DAYS = 40 * 7
+
+INTERVAL_YEARS = {
+    **dict.fromkeys(["d", "day", "days"], 1 / 365.25),
+    **dict.fromkeys(["w", "week", "weeks"], 1 / 52),
+    **dict.fromkeys(["m", "month", "months"], 1 / 12),
+    **dict.fromkeys(["y", "year", "years"], 1),
+}
+
+# a daily measurement for 50 years
+MAX_MEASUREMENTS_PER_CHILD = 20000
+
+# the measurement request columns, then the calculated columns
+ROW_COLUMNS = [
+    "child", "reference", "birth_date", "observation_date", "gestation_weeks", "gestation_days", "sex",
+    "measurement_method", "observation_value", "chronological_decimal_age", "corrected_decimal_age",
+    "chronological_sds", "chronological_centile", "corrected_sds", "corrected_centile",
+]
+
+
+def measurement_count(start_chronological_age, end_age, measurement_interval_type, measurement_interval_number):
+    """
+    Returns the number of measurements in each child's trajectory, or raises ValueError if the interval is invalid
+    or there would be too many.
+    """
+    if measurement_interval_type not in INTERVAL_YEARS:
+        raise ValueError(f"{measurement_interval_type} is not a measurement interval type.")
+    if measurement_interval_number <= 0:
+        raise ValueError("The measurement interval must be greater than 0.")
+    interval = measurement_interval_number * INTERVAL_YEARS[measurement_interval_type]
+    count = max(0, math.ceil((end_age - start_chronological_age) / interval))
+    if count > MAX_MEASUREMENTS_PER_CHILD:
+        raise ValueError(
+            f"A child can have at most {MAX_MEASUREMENTS_PER_CHILD} measurements: lengthen the interval or shorten "
+            f"the age range.")
+    return count
+
+
+def check_fictional_children_request(reference, fictional_children_request):
+    """
+    Raises HTTPException if the children of a `FictionalChildrenRequest` cannot be generated on a reference: 413 if
+    there are too many children or measurements in all, and 422 if the measurement interval is invalid, there would be
+    no measurements, or the reference has no data for the sex and measurement method.
+    """
+    request = fictional_children_request
+    if request.number_of_children > settings.max_fictional_children:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.max_fictional_children} children can be generated in one request.")
+    try:
+        count = measurement_count(
+            request.start_chronological_age, request.end_age, request.measurement_interval_type,
+            request.measurement_interval_number)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    if count == 0:
+        raise HTTPException(status_code=422, detail="end_age must be greater than start_chronological_age.")
+    if request.number_of_children * count > settings.max_fictional_child_rows:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.max_fictional_child_rows} measurements can be generated in one request.")
+    if not reference_has_data(reference, request.measurement_method, request.sex):
+        raise HTTPException(
+            status_code=422, detail=f"There is no {reference} {request.measurement_method} data for {request.sex}s.")
+
+
+def child_random_generator(entropy, child):
+    """
+    The random generator of one child of a request. `entropy` is the request's seed, or a random one.
+    """
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(child,)))
+
+
+def fictional_children_columns(parameters, children):
+    """
+    Generates children sharing the measurement schedule, starting SDS, drift and noise of the parameters of a
+    `FictionalChildrenRequest`, returning each of the `ROW_COLUMNS` as one array, child after child. `children` holds a
+    (child number, child parameters, random generator) for each child, its parameters giving its reference,
+    measurement method, sex and gestation. Points for which a child's reference has no data are left out.
+    """
+    start_age, end_age = parameters["start_chronological_age"], parameters["end_age"]
+    count = measurement_count(
+        start_age, end_age, parameters["measurement_interval_type"], parameters["measurement_interval_number"])
+    interval = parameters["measurement_interval_number"] * INTERVAL_YEARS[parameters["measurement_interval_type"]]
+    steps = np.arange(count)
+
+    def each_row(name):
+        # a child's value repeated for each of its measurements
+        return np.repeat([child_parameters[name] for _, child_parameters, _ in children], count)
+
+    reference, measurement_method, sex = each_row("reference"), each_row("measurement_method"), each_row("sex")
+    gestation_weeks, gestation_days = each_row("gestation_weeks"), each_row("gestation_days")
+
+    # each date is the last plus the interval, in whole days
+    days = np.tile(int(start_age * 365.25) + steps * int(interval * 365.25), len(children))
+    gestation_length = np.where(gestation_weeks == 0, TERM_PREGNANCY_LENGTH_DAYS, gestation_weeks * 7 + gestation_days)
+    chronological_ages = days / 365.25
+    corrected_ages = (days - (TERM_PREGNANCY_LENGTH_DAYS - gestation_length)) / 365.25
+
+    start_sds = [float(parameters["start_sds"])] * len(children)
+    if parameters.get("start_sds_spread"):
+        start_sds = [rng.normal(parameters["start_sds"], parameters["start_sds_spread"]) for _, _, rng in children]
+    sds = np.repeat(start_sds, count)
+    if parameters["drift"]:
+        drift_amount = parameters["drift_range"] / max(math.floor((end_age - start_age) / interval), 1)
+        sds = np.round(sds + np.tile(steps, len(children)) * drift_amount, 3)
+
+    ages = np.tile(start_age + steps * interval, len(children))
+    values = measurements_for_sds(*lms_for_age(reference, measurement_method, sex, ages), sds)
+    if parameters["noise"]:
+        noise = np.concatenate([rng.uniform(-1, 1, count) for _, _, rng in children] or [np.empty(0)])
+        values = values + noise * values * parameters["noise_range"]
+    values = np.round(values, 1)
+    present = ~np.isnan(values)
+
+    values = values[present]
+    lms = [reference[present], measurement_method[present], sex[present]]
+    chronological_sds = z_scores(*lms_for_age(*lms, chronological_ages[present]), values)
+    corrected_sds = z_scores(*lms_for_age(*lms, corrected_ages[present]), values)
+    return {
+        "child": np.repeat([child for child, _, _ in children], count)[present],
+        "reference": reference[present],
+        "birth_date": np.full(len(values), BIRTH_DATE),
+        "observation_date": BIRTH_DATE + days[present],
+        "gestation_weeks": gestation_weeks[present],
+        "gestation_days": gestation_days[present],
+        "sex": sex[present],
+        "measurement_method": measurement_method[present],
+        "observation_value": values,
+        "chronological_decimal_age": chronological_ages[present],
+        "corrected_decimal_age": corrected_ages[present],
+        "chronological_sds": chronological_sds,
+        "chronological_centile": np.round(centiles(chronological_sds), 1),
+        "corrected_sds": corrected_sds,
+        "corrected_centile": np.round(centiles(corrected_sds), 1),
+    }
+
+
+def fictional_child_columns(reference, parameters, child, rng):
+    """
+    Generates one child, returning each of the `ROW_COLUMNS` as an array.
+    """
+    return fictional_children_columns(parameters, [(child, dict(parameters, reference=reference), rng)])
+
+
+def rows_from_columns(columns):
+    values = [column_values(columns[column]) for column in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def fictional_child_rows(reference, parameters, child, entropy):
+    """
+    Generates one child and returns its measurements as rows, one dictionary per measurement.
+    """
+    return rows_from_columns(
+        fictional_child_columns(reference, parameters, child, child_random_generator(entropy, child)))
+
+
+def fictional_child_ndjson(reference, parameters, child, entropy):
+    rows = fictional_child_rows(reference, parameters, child, entropy)
+    return b"".join(encode_json(row) + b"\n" for row in rows)
+
+
+class FictionalChildrenResponse(StreamingResponse):
+    """
+    Streams the NDJSON of `fictional_children_stream`. Unlike `NDJSONStreamingResponse`, which leaves the request body
+    to its generator, Starlette's StreamingResponse listens for the client disconnecting, and stops the generator.
+    """
+    media_type = "application/x-ndjson"
+
+
+async def fictional_children_stream(reference, fictional_children_request):
+    """
+    Generates the children of a request one at a time on the calculation executor, yielding each as NDJSON rows, so
+    only one child is held in memory.
+    """
+    parameters = fictional_children_request.dict()
+    entropy = np.random.SeedSequence(fictional_children_request.seed).entropy
+    for child in range(fictional_children_request.number_of_children):
+        yield await calculation_executor.run_accepted(fictional_child_ndjson, reference, parameters, child, entropy)
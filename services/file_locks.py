@@ -0,0 +1,37 @@
+"""
+Locks on files, shared by every process on the host
+* Each uvicorn worker is a separate process, so work which must only be done once, such as running a bulk calculation
+job, is claimed by locking a file on disk
+* The operating system releases a lock when the process holding it exits, however it exits, so a lock is never left
+behind by a worker which has died
+"""
+# standard imports
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def try_lock(path):
+    """
+    Locks a file, creating it if needed, without waiting. Returns the open file, which holds the lock until it is
+    closed, or None if another process or open file holds the lock. The id of the process holding it is written to the
+    file.
+    """
+    file = open(path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        file.close()
+        return None
+    file.truncate(0)
+    file.write(str(os.getpid()))
+    file.flush()
+    return file
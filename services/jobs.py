@@ -0,0 +1,534 @@
+"""
+Bulk calculation jobs for CSV and Parquet files
+* Each job is a directory under the jobs directory, holding the uploaded file, a `job.json` status file and the result
+file once it is complete, so jobs queue on local disk and survive a restart
+* One job runs at a time, its rows split into chunks which are calculated in parallel by a pool of worker processes,
+using the same validation and calculation as the `/calculation` endpoints
+* Every server worker process runs its own job runner. A runner claims a job by locking the `claim` file in its
+directory (see `file_locks`), and holds the lock until the job finishes, so each job runs once. Jobs left running by a
+process which has exited, and so no longer holds the lock, are queued again
+* The result is the uploaded file with the calculated columns appended, in the same format as the upload. Without a
+job `reference`, each row is calculated against the reference in its `reference` column
+* Synthetic cohort jobs (see `cohorts`) queue and run in the same way, their result the generated cohort
+"""
+# standard imports
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timezone
+
+# third party imports
+import numpy as np
+from rcpchgrowth.constants.reference_constants import TRISOMY_21, TURNERS, UK_WHO
+
+# local imports
+from .calculation import calculate_measurement_batch
+from .cohorts import COHORT_FORMATS, write_cohort
+from .file_locks import try_lock
+from .parquet_support import import_pyarrow, PYARROW_INSTALLED
+from .settings import settings
+
+JOB_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+# the content types of job results: uploaded files, and generated cohorts
+RESULT_FORMATS = {**JOB_FORMATS, **COHORT_FORMATS}
+
+REFERENCES = [UK_WHO, TRISOMY_21, TURNERS]
+
+REQUIRED_COLUMNS = ["birth_date", "observation_date", "observation_value", "sex", "measurement_method"]
+
+RESULT_COLUMNS = [
+    "chronological_decimal_age",
+    "corrected_decimal_age",
+    "chronological_sds",
+    "chronological_centile",
+    "corrected_sds",
+    "corrected_centile",
+    "errors",
+]
+
+
+def available_job_formats():
+    """
+    File formats which can be uploaded as jobs.
+    """
+    if not PYARROW_INSTALLED:
+        return ["csv"]
+    return list(JOB_FORMATS)
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def measurement_from_row(row, measurement_method=None):
+    """
+    Returns the measurement object for one row of a file. Blank cells are left out, so the defaults apply.
+    """
+    measurement = {}
+    for column, value in row.items():
+        if value is None or value == "":
+            continue
+        if isinstance(value, (date, datetime)):
+            value = value.strftime("%Y-%m-%d")
+        measurement[column] = value
+    if measurement_method is not None:
+        measurement.setdefault("measurement_method", measurement_method)
+    return measurement
+
+
+def result_columns(result):
+    """
+    Flattens the result of one calculation into the columns appended to the file.
+    """
+    if result["errors"] is not None:
+        columns = dict.fromkeys(RESULT_COLUMNS)
+        columns["errors"] = "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" if error["loc"] else error["msg"]
+            for error in result["errors"])
+        return columns
+    calculation = result["calculation"]
+    dates = calculation["measurement_dates"]
+    values = calculation["measurement_calculated_values"]
+    errors = []
+    for error in [
+        calculation["child_observation_value"]["observation_value_error"],
+        values["chronological_measurement_error"],
+        values["corrected_measurement_error"],
+    ]:
+        if error and error not in errors:
+            errors.append(error)
+    return {
+        "chronological_decimal_age": dates["chronological_decimal_age"],
+        "corrected_decimal_age": dates["corrected_decimal_age"],
+        "chronological_sds": values["chronological_sds"],
+        "chronological_centile": values["chronological_centile"],
+        "corrected_sds": values["corrected_sds"],
+        "corrected_centile": values["corrected_centile"],
+        "errors": "; ".join(errors) or None,
+    }
+
+
+def calculate_rows(reference, rows, measurement_method=None):
+    """
+    Calculates a chunk of rows in a worker process, returning the appended columns for each row.
+    If `reference` is None, each row is calculated against the reference in its `reference` column.
+    """
+    measurements = [measurement_from_row(row, measurement_method) for row in rows]
+    if reference is not None:
+        return [result_columns(result) for result in calculate_measurement_batch(reference, measurements)]
+
+    row_references = [measurement.pop("reference", None) for measurement in measurements]
+    calculated = [None] * len(rows)
+    for row_reference in dict.fromkeys(row_references):
+        indices = [index for index, value in enumerate(row_references) if value == row_reference]
+        if row_reference in REFERENCES:
+            results = calculate_measurement_batch(row_reference, [measurements[index] for index in indices])
+        else:
+            permitted = ", ".join(f"'{name}'" for name in REFERENCES)
+            results = [{"errors": [{"loc": ["reference"], "msg": f"unexpected value; permitted: {permitted}"}]}] * len(
+                indices)
+        for index, result in zip(indices, results):
+            calculated[index] = result_columns(result)
+    return calculated
+
+
+class CSVJobFile:
+    """
+    Reads the rows of an uploaded CSV file in chunks, and writes them back with the calculated columns appended.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def columns(self):
+        with open(self.path, newline="", encoding="utf-8-sig") as file:
+            return next(csv.reader(file), [])
+
+    def count_rows(self):
+        with open(self.path, newline="", encoding="utf-8-sig") as file:
+            return sum(1 for _ in csv.DictReader(file))
+
+    def chunks(self, chunk_size):
+        with open(self.path, newline="", encoding="utf-8-sig") as file:
+            chunk = []
+            for row in csv.DictReader(file):
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    def writer(self, path):
+        return CSVResultWriter(path, self.columns())
+
+
+class CSVResultWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        fieldnames = columns + [column for column in RESULT_COLUMNS if column not in columns]
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetJobFile:
+    """
+    Reads the rows of an uploaded Parquet file in chunks, and writes them back with the calculated columns appended.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet_file = import_pyarrow().parquet.ParquetFile(path)
+
+    def columns(self):
+        return self.parquet_file.schema_arrow.names
+
+    def count_rows(self):
+        return self.parquet_file.metadata.num_rows
+
+    def chunks(self, chunk_size):
+        for batch in self.parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+
+    def writer(self, path):
+        pyarrow = import_pyarrow()
+        schema = self.parquet_file.schema_arrow
+        for column in RESULT_COLUMNS:
+            if column in schema.names:
+                continue
+            schema = schema.append(pyarrow.field(column, pyarrow.string() if column == "errors" else pyarrow.float64()))
+        return ParquetResultWriter(path, schema)
+
+
+class ParquetResultWriter:
+    def __init__(self, path, schema):
+        self.schema = schema
+        self.writer = import_pyarrow().parquet.ParquetWriter(path, schema)
+
+    def write(self, rows):
+        self.writer.write_table(import_pyarrow().Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def result_format(job):
+    """
+    The format of a job's result: the format of its upload, or of the cohort it generates.
+    """
+    return job.get("output_format") or job["input_format"]
+
+
+def job_file(path, input_format):
+    if input_format == "parquet":
+        return ParquetJobFile(path)
+    return CSVJobFile(path)
+
+
+class JobStore:
+    """
+    The on-disk record of every job. Status files are replaced atomically, so they can be read at any time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # the locked claim files of the jobs this process is running, by job id
+        self._claims = {}
+
+    def job_directory(self, job_id):
+        return self.directory / job_id
+
+    def input_path(self, job):
+        return self.job_directory(job["job_id"]) / f"input.{job['input_format']}"
+
+    def result_path(self, job):
+        return self.job_directory(job["job_id"]) / f"result.{result_format(job)}"
+
+    def create(self, reference, input_format, measurement_method=None):
+        """
+        Creates a job waiting for its file to be uploaded. It is not queued until `enqueue` is called.
+        """
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": "calculation",
+            "status": "uploading",
+            "reference": reference,
+            "measurement_method": measurement_method,
+            "input_format": input_format,
+            "rows_total": None,
+            "rows_processed": 0,
+            "created": now(),
+            "started": None,
+            "finished": None,
+            "owner_pid": None,
+            "error": None,
+        }
+        self.job_directory(job["job_id"]).mkdir(parents=True)
+        self.save(job)
+        return job
+
+    def create_cohort(self, parameters):
+        """
+        Creates and queues a job generating the synthetic cohort of a `CohortRequest`'s parameters.
+        """
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": "cohort",
+            "status": "queued",
+            "reference": parameters["reference"],
+            "measurement_method": parameters["measurement_method"],
+            "input_format": None,
+            "output_format": parameters["output_format"],
+            "parameters": parameters,
+            # the seed, or a random one, so the children are the same if the job is interrupted and run again
+            "entropy": np.random.SeedSequence(parameters["seed"]).entropy,
+            "children_total": parameters["number_of_children"],
+            "children_processed": 0,
+            "rows_total": None,
+            "rows_processed": 0,
+            "created": now(),
+            "started": None,
+            "finished": None,
+            "owner_pid": None,
+            "error": None,
+        }
+        self.job_directory(job["job_id"]).mkdir(parents=True)
+        self.save(job)
+        return job
+
+    def save(self, job):
+        status_path = self.job_directory(job["job_id"]) / "job.json"
+        temporary_path = status_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(job, file)
+        os.replace(temporary_path, status_path)
+
+    def update(self, job, **changes):
+        job.update(changes)
+        self.save(job)
+        return job
+
+    def get(self, job_id):
+        """
+        Returns the job with this id, or None if there is no such job.
+        """
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self.job_directory(job_id) / "job.json") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def jobs(self):
+        if not self.directory.exists():
+            return []
+        jobs = [self.get(path.name) for path in self.directory.iterdir() if path.is_dir()]
+        return sorted((job for job in jobs if job is not None), key=lambda job: job["created"])
+
+    def claim(self, job_id):
+        """
+        Locks a job's claim file, returning the job as it is now on disk, or None if another runner holds the claim.
+        """
+        claim = try_lock(self.job_directory(job_id) / "claim")
+        if claim is None:
+            return None
+        job = self.get(job_id)
+        if job is None:
+            claim.close()
+            return None
+        self._claims[job_id] = claim
+        return job
+
+    def release(self, job_id):
+        claim = self._claims.pop(job_id, None)
+        if claim is not None:
+            claim.close()
+
+    def next_queued(self):
+        """
+        Claims the oldest queued job, marking it as running. The claim is held until `release` is called.
+        """
+        with self._lock:
+            for listed in self.jobs():
+                if listed["status"] != "queued":
+                    continue
+                # read again once claimed, as another runner may have run the job since it was listed
+                job = self.claim(listed["job_id"])
+                if job is None:
+                    continue
+                if job["status"] == "queued":
+                    return self.update(job, status="running", started=now(), owner_pid=os.getpid())
+                self.release(job["job_id"])
+        return None
+
+    def requeue_interrupted(self):
+        """
+        Puts back in the queue any jobs which were running in a process which has since exited, and so no longer holds
+        their claim. Jobs still being run by another server process are left alone.
+        """
+        with self._lock:
+            for listed in self.jobs():
+                if listed["status"] != "running" or listed["job_id"] in self._claims:
+                    continue
+                job = self.claim(listed["job_id"])
+                if job is None:
+                    continue
+                if job["status"] == "running":
+                    self.update(job, status="queued", started=None, owner_pid=None, rows_processed=0)
+                    if job.get("kind") == "cohort":
+                        self.update(job, children_processed=0)
+                self.release(job["job_id"])
+
+    def delete(self, job_id):
+        shutil.rmtree(self.job_directory(job_id), ignore_errors=True)
+
+
+class JobRunner:
+    """
+    Runs queued jobs one at a time in a background thread, calculating the chunks of each job in a process pool.
+    The thread only reads and writes files, so the API's event loop is never blocked by the calculations.
+    """
+
+    def __init__(self, store, workers=None, chunk_size=1000):
+        self.store = store
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.store.directory.mkdir(parents=True, exist_ok=True)
+        self.store.requeue_interrupted()
+        self._executor = self._new_executor()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._executor.shutdown()
+        self._executor = None
+
+    def wake(self):
+        """
+        Tells the runner a job has been queued.
+        """
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            job = self.store.next_queued()
+            if job is None:
+                # pick up the jobs of any other server process which has exited part way through them
+                self.store.requeue_interrupted()
+                self._wake.wait(timeout=5)
+                self._wake.clear()
+                continue
+            try:
+                self.run_job(job)
+            finally:
+                self.store.release(job["job_id"])
+
+    def _new_executor(self):
+        # the server process already runs threads, which forked worker processes could deadlock on, so they are spawned
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_broken_executor(self, error):
+        # a worker process which dies breaks the whole pool, so start a new one for the jobs after this one
+        if isinstance(error, BrokenProcessPool):
+            self._executor.shutdown(wait=False)
+            self._executor = self._new_executor()
+
+    def run_job(self, job):
+        """
+        Calculates every row of a job, writing the result file and recording progress after each chunk.
+        Chunks are calculated in parallel, and written in their original order.
+        """
+        if job.get("kind") == "cohort":
+            self.run_cohort_job(job)
+            return
+        try:
+            source = job_file(self.store.input_path(job), job["input_format"])
+            columns = source.columns()
+            required = [
+                column for column in REQUIRED_COLUMNS + ([] if job["reference"] else ["reference"])
+                if column not in columns and not (column == "measurement_method" and job["measurement_method"])
+            ]
+            if required:
+                raise ValueError(f"The file is missing the columns: {', '.join(required)}")
+            self.store.update(job, rows_total=source.count_rows())
+
+            result_path = self.store.result_path(job)
+            partial_path = result_path.with_name(result_path.name + ".part")
+            writer = source.writer(partial_path)
+            try:
+                pending = deque()
+                for chunk in source.chunks(self.chunk_size):
+                    pending.append((chunk, self._executor.submit(
+                        calculate_rows, job["reference"], chunk, job["measurement_method"])))
+                    # keep every worker busy without reading the whole file into memory
+                    while len(pending) > self.workers * 2:
+                        self._write_chunk(job, writer, *pending.popleft())
+                    if self._stopping.is_set():
+                        return
+                while pending:
+                    self._write_chunk(job, writer, *pending.popleft())
+            finally:
+                writer.close()
+            os.replace(partial_path, result_path)
+            self.store.update(job, status="complete", finished=now())
+        except Exception as error:
+            self._replace_broken_executor(error)
+            self.store.update(job, status="failed", finished=now(), error=str(error))
+
+    def run_cohort_job(self, job):
+        """
+        Generates a synthetic cohort, recording progress after each chunk of children is written.
+        """
+        def progress(children, rows):
+            self.store.update(job, children_processed=children, rows_processed=rows)
+
+        try:
+            rows = write_cohort(
+                job["parameters"], job["entropy"], self.store.result_path(job), self._executor, self.workers,
+                progress, self._stopping)
+            if rows is None:
+                return
+            self.store.update(job, status="complete", finished=now(), rows_total=rows)
+        except Exception as error:
+            self._replace_broken_executor(error)
+            self.store.update(job, status="failed", finished=now(), error=str(error))
+
+    def _write_chunk(self, job, writer, rows, future):
+        calculated = future.result()
+        writer.write([dict(row, **columns) for row, columns in zip(rows, calculated)])
+        self.store.update(job, rows_processed=job["rows_processed"] + len(rows))
+
+
+job_store = JobStore(settings.jobs_directory)
+job_runner = JobRunner(job_store, settings.job_workers, settings.job_chunk_size)
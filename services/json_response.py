@@ -0,0 +1,132 @@
+"""
+Fast JSON responses
+* Values returned by endpoints are encoded straight to JSON, rather than first being copied into plain JSON types by
+FastAPI's `jsonable_encoder` and then encoded. With orjson installed they are encoded by orjson, dates and numpy floats
+included; without it by the `json` module, which calls `jsonable_encoder` only for the values it cannot encode itself
+* The output is byte for byte what FastAPI's `JSONResponse` writes: compact separators, UTF-8, dates in ISO format and
+floats as Python writes them. orjson writes floats under 0.0001 differently (`1e-05` as `0.00001`), so a body with any
+is encoded again by the `json` module, as is anything orjson cannot encode
+* The one deliberate difference: NaN and infinity are written as `null`, with or without orjson. `JSONResponse` raises
+a ValueError for them, so one value with no answer failed the whole response with a 500, or broke off an NDJSON stream
+part way. Checking every float for them would cost more than encoding with orjson does
+* Arrays are returned as columns of plain values by `column_values`
+* `TimedRoute` returns every plain value from an endpoint as a `FastJSONResponse`, see `json_endpoint`
+"""
+# standard imports
+import asyncio
+import functools
+import inspect
+import json
+import math
+import re
+
+# third party imports
+import numpy as np
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional: without it responses are encoded by the json module
+    orjson = None
+
+# floats which orjson writes differently from Python: 0.0000x, or an exponent with no leading zero, eg 1.5e-7
+ORJSON_FLOAT_MISMATCH = re.compile(rb"(?<![0-9.])0\.0000|[0-9]e-[0-9]")
+
+
+def null_non_finite(value):
+    """
+    Returns plain JSON types with NaN and infinity replaced by None.
+    """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: null_non_finite(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [null_non_finite(item) for item in value]
+    return value
+
+
+def column_values(values):
+    """
+    An array's values as Python values: dates as ISO strings, and NaN as None.
+    """
+    if values.dtype.kind == "M":
+        return np.datetime_as_string(values).tolist()
+    if values.dtype.kind == "f":
+        return [None if value != value else value for value in values.tolist()]
+    return values.tolist()
+
+
+def encode_json_stdlib(content):
+    try:
+        return json.dumps(
+            content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"), default=jsonable_encoder
+        ).encode("utf-8")
+    except ValueError:
+        # NaN or infinity, written as null as orjson writes them
+        return json.dumps(
+            null_non_finite(jsonable_encoder(content)), ensure_ascii=False, allow_nan=False, indent=None,
+            separators=(",", ":")).encode("utf-8")
+
+
+def encode_json(content):
+    """
+    Returns `content` as JSON bytes, exactly as `JSONResponse(jsonable_encoder(content))` would write them, except
+    that NaN and infinity are written as `null` rather than raising ValueError.
+    """
+    if orjson is not None:
+        try:
+            body = orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            pass
+        else:
+            # the substring checks are much quicker than the expression, and rule it out for most bodies
+            if (b"0.0000" not in body and b"e-" not in body) or not ORJSON_FLOAT_MISMATCH.search(body):
+                return body
+    return encode_json_stdlib(content)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return encode_json(content)
+
+
+def returns_plain_values(endpoint, response_model, response_class):
+    """
+    Whether FastAPI would encode the endpoint's return value with `jsonable_encoder` into a `JSONResponse`, and set
+    nothing else on the response, so `json_endpoint` can encode it instead.
+    """
+    if response_model is not None:
+        return False
+    if isinstance(response_class, DefaultPlaceholder):
+        response_class = response_class.value
+    if response_class is not JSONResponse:
+        return False
+    # a `Response` parameter sets headers and cookies on the response FastAPI builds
+    for parameter in inspect.signature(endpoint).parameters.values():
+        if inspect.isclass(parameter.annotation) and issubclass(parameter.annotation, Response):
+            return False
+    return True
+
+
+def json_endpoint(endpoint, status_code=None):
+    """
+    Wraps an endpoint to return its value as a `FastJSONResponse`. Responses it returns itself are left alone.
+    """
+    def respond(value):
+        if isinstance(value, Response):
+            return value
+        return FastJSONResponse(value, status_code=status_code or 200)
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            return respond(await endpoint(*args, **kwargs))
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            return respond(endpoint(*args, **kwargs))
+    return wrapper
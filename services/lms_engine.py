@@ -0,0 +1,403 @@
+"""
+Vectorised LMS engine for bulk SDS and centile calculations
+* Takes arrays of decimal ages, observation values, sexes, measurement methods and references and calculates every
+row at once with NumPy, rather than one `rcpchgrowth.Measurement` at a time
+* Reads the same reference tables as rcpchgrowth, and follows its rules for choosing and interpolating them:
+    - exact age matches use the tabulated L, M and S
+    - otherwise cubic (four point Lagrange) interpolation, or linear interpolation at the ends of a table
+    - UK-WHO is split into the uk90_preterm, uk_who_infant, uk_who_child and uk90_child segments, the older
+    segment being used at the boundary ages
+* Rows with no reference data (out of age range, or a measurement the reference does not have) return NaN
+* `LMS_INDEX` is built from the tables as the server starts, one `LMSIndex` per reference, measurement method and
+sex: a table of the ages at which the segment or the data present changes, and for each segment the ages, the
+neighbouring ages and age differences and the L, M and S values of every interval between tabulated ages, so finding
+the L, M and S at an age is two binary searches and the interpolation itself. `lms_for_age` looks up whole arrays of
+ages, and `lms_at` single ages with plain Python arithmetic, with results identical to
+`rcpchgrowth.global_functions.fetch_lms`
+"""
+# standard imports
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+# third party imports
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+# RCPCH imports
+from rcpchgrowth.constants import (
+    BMI, EIGHTEEN_YEARS, FEMALE, FORTY_TWO_WEEKS_GESTATION, HEAD_CIRCUMFERENCE, HEIGHT, MALE,
+    MEASUREMENT_METHODS, SEVENTEEN_YEARS, SEXES, TRISOMY_21, TURNERS, TWENTY_FIVE_WEEKS_GESTATION,
+    TWENTY_YEARS, UK90_CHILD, UK90_PRETERM, UK90_REFERENCE_LOWER_THRESHOLD, UK90_UPPER_THRESHOLD, UK_WHO,
+    UK_WHO_CHILD, UK_WHO_INFANT, UK_WHO_INFANT_LOWER_THRESHOLD, WHO_CHILD_LOWER_THRESHOLD,
+    WHO_CHILDREN_UPPER_THRESHOLD)
+from rcpchgrowth.trisomy_21 import TRISOMY_21_DATA
+from rcpchgrowth.turner import TURNER_DATA
+from rcpchgrowth.uk_who import UK90_CHILD_DATA, UK90_PRETERM_DATA, WHO_CHILD_DATA, WHO_INFANTS_DATA
+
+LMSTable = namedtuple("LMSTable", ["decimal_age", "l", "m", "s"])
+
+# the UK-WHO segments, youngest first, with the reference data for each
+UK_WHO_SEGMENTS = [
+    (UK90_PRETERM, UK90_PRETERM_DATA),
+    (UK_WHO_INFANT, WHO_INFANTS_DATA),
+    (UK_WHO_CHILD, WHO_CHILD_DATA),
+    (UK90_CHILD, UK90_CHILD_DATA),
+]
+
+# Trisomy 21 BMI data stops before the end of the table
+TRISOMY_21_BMI_UPPER_THRESHOLD = 18.82
+
+
+def lms_table(reference_data, measurement_method, sex):
+    """
+    Returns the L, M and S values of one rcpchgrowth reference data table as NumPy arrays, in age order.
+    A table the reference does not have is empty, and blank values (UK90 preterm BMI) are NaN.
+    """
+    rows = reference_data["measurement"].get(measurement_method, {}).get(sex, [])
+
+    def column(key):
+        return np.array([np.nan if row[key] in ("", None) else row[key] for row in rows], dtype=float)
+
+    return LMSTable(decimal_age=column("decimal_age"), l=column("L"), m=column("M"), s=column("S"))
+
+
+def build_lms_tables():
+    """
+    Returns every reference table, keyed by (reference, segment, measurement_method, sex).
+    Turner's syndrome and Trisomy 21 have a single table, so their segment is the reference name.
+    """
+    tables = {}
+    for measurement_method in MEASUREMENT_METHODS:
+        for sex in SEXES:
+            for segment, reference_data in UK_WHO_SEGMENTS:
+                tables[(UK_WHO, segment, measurement_method, sex)] = lms_table(
+                    reference_data, measurement_method, sex)
+            tables[(TRISOMY_21, TRISOMY_21, measurement_method, sex)] = lms_table(
+                TRISOMY_21_DATA, measurement_method, sex)
+            tables[(TURNERS, TURNERS, measurement_method, sex)] = lms_table(
+                TURNER_DATA, measurement_method, sex)
+    return tables
+
+
+LMS_TABLES = build_lms_tables()
+
+
+def uk_who_segments(decimal_age, measurement_method, sex):
+    """
+    Returns the index into UK_WHO_SEGMENTS for each age, or -1 where UK-WHO has no data.
+    Follows `rcpchgrowth.uk_who.uk_who_reference` and `reference_data_absent`.
+    """
+    segment = np.select(
+        [
+            decimal_age < UK90_REFERENCE_LOWER_THRESHOLD,
+            decimal_age < UK_WHO_INFANT_LOWER_THRESHOLD,
+            decimal_age < WHO_CHILD_LOWER_THRESHOLD,
+            decimal_age < WHO_CHILDREN_UPPER_THRESHOLD,
+            decimal_age <= UK90_UPPER_THRESHOLD,
+        ],
+        [-1, 0, 1, 2, 3],
+        default=-1,
+    )
+    if measurement_method == HEIGHT:
+        segment[decimal_age < TWENTY_FIVE_WEEKS_GESTATION] = -1
+    elif measurement_method == BMI:
+        segment[decimal_age < FORTY_TWO_WEEKS_GESTATION] = -1
+    elif measurement_method == HEAD_CIRCUMFERENCE:
+        upper_threshold = EIGHTEEN_YEARS if sex == MALE else SEVENTEEN_YEARS
+        segment[decimal_age > upper_threshold] = -1
+    return segment
+
+
+def turner_data_present(decimal_age, measurement_method, sex):
+    """
+    Returns a mask of the ages for which Turner's syndrome data exists (girls' heights from 1 to 20 y).
+    """
+    if measurement_method != HEIGHT or sex != FEMALE:
+        return np.zeros(decimal_age.shape, dtype=bool)
+    return (decimal_age >= 1) & (decimal_age <= TWENTY_YEARS)
+
+
+def trisomy_21_data_present(decimal_age, measurement_method, sex):
+    """
+    Returns a mask of the ages for which Trisomy 21 data exists.
+    """
+    present = (decimal_age >= 0) & (decimal_age <= TWENTY_YEARS)
+    if measurement_method == BMI:
+        present &= decimal_age <= TRISOMY_21_BMI_UPPER_THRESHOLD
+    elif measurement_method == HEAD_CIRCUMFERENCE:
+        present &= decimal_age <= EIGHTEEN_YEARS
+    return present
+
+
+def table_numbers(reference, measurement_method, sex, decimal_age):
+    """
+    Returns, for each age, the number of the table in `reference_tables` it is found in, or -1 where there is no data.
+    """
+    if reference == UK_WHO:
+        return uk_who_segments(decimal_age, measurement_method, sex)
+    if reference == TURNERS:
+        return np.where(turner_data_present(decimal_age, measurement_method, sex), 0, -1)
+    return np.where(trisomy_21_data_present(decimal_age, measurement_method, sex), 0, -1)
+
+
+def reference_tables(reference, measurement_method, sex):
+    if reference == UK_WHO:
+        return [LMS_TABLES[(UK_WHO, name, measurement_method, sex)] for name, _ in UK_WHO_SEGMENTS]
+    return [LMS_TABLES[(reference, reference, measurement_method, sex)]]
+
+
+# every age at which a reference's segment or the data present can change
+TABLE_BOUNDARIES = sorted({
+    UK90_REFERENCE_LOWER_THRESHOLD, UK_WHO_INFANT_LOWER_THRESHOLD, WHO_CHILD_LOWER_THRESHOLD,
+    WHO_CHILDREN_UPPER_THRESHOLD, UK90_UPPER_THRESHOLD, TWENTY_FIVE_WEEKS_GESTATION, FORTY_TWO_WEEKS_GESTATION,
+    SEVENTEEN_YEARS, EIGHTEEN_YEARS, TWENTY_YEARS, TRISOMY_21_BMI_UPPER_THRESHOLD, 0.0, 1.0,
+})
+
+
+class InterpolationTable:
+    """
+    One reference table, with the neighbouring ages, age differences, L, M and S values and slopes of each interval
+    between tabulated ages worked out in advance. Interpolates as `rcpchgrowth.global_functions.fetch_lms` does, term for term.
+    """
+
+    def __init__(self, table):
+        self.ages = table.decimal_age
+        self.parameters = (table.l, table.m, table.s)
+        count = len(self.ages)
+        # interval i runs from ages[i] to ages[i + 1], and is interpolated from ages[i - 1] to ages[i + 2]
+        interval = np.arange(max(count - 1, 0))
+        self.cubic = (interval >= 1) & (interval < count - 2)
+        # two below, one below, one above and two above each interval
+        stencil = [np.clip(interval + offset, 0, max(count - 1, 0)) for offset in (-1, 0, 1, 2)]
+        a0, a1, a2, a3 = self.stencil_ages = [self.ages[index] for index in stencil]
+        self.differences = [a0 - a1, a0 - a2, a0 - a3, a1 - a2, a1 - a3, a2 - a3]
+        self.stencil_parameters = [[values[index] for index in stencil] for values in self.parameters]
+        with np.errstate(invalid="ignore"):
+            self.slopes = [(p2 - p1) / (a2 - a1) for _, p1, p2, _ in self.stencil_parameters]
+
+        # the same as Python floats, for `lms_at`
+        self._ages = self.ages.tolist()
+        self._rows = list(zip(*(values.tolist() for values in self.parameters)))
+        self._cubic = self.cubic.tolist()
+        self._stencils = list(zip(
+            zip(*(ages.tolist() for ages in self.stencil_ages)),
+            zip(*(differences.tolist() for differences in self.differences)),
+            zip(*(zip(*(values.tolist() for values in stencil_values)) for stencil_values in self.stencil_parameters)),
+        ))
+        self._slopes = list(zip(*(slopes.tolist() for slopes in self.slopes)))
+
+    def lms(self, decimal_age):
+        """
+        Returns L, M and S arrays for an array of ages. Ages outside the table return NaN.
+        """
+        count = len(self.ages)
+        if count == 0:
+            return tuple(np.full(decimal_age.shape, np.nan) for _ in range(3))
+        if count == 1:
+            return tuple(np.where(self.ages[0] == decimal_age, values[0], np.nan) for values in self.parameters)
+        below = np.searchsorted(self.ages, decimal_age, side="right") - 1
+        inside = (below >= 0) & (below < count - 1)
+        clipped = np.clip(below, 0, count - 1)
+        exact = (below >= 0) & (self.ages[clipped] == decimal_age)
+        # every age is interpolated in the nearest interval both ways, and the right one of each kept, which is
+        # quicker than selecting ages for each
+        interval = np.minimum(clipped, count - 2)
+        cubic = self.cubic[interval]
+        tt0, tt1, tt2, tt3 = (decimal_age - ages[interval] for ages in self.stencil_ages)
+        t01, t02, t03, t12, t13, t23 = (differences[interval] for differences in self.differences)
+        lms = []
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for values, (p0, p1, p2, p3), slopes in zip(self.parameters, self.stencil_parameters, self.slopes):
+                p0, p1, p2, p3 = p0[interval], p1[interval], p2[interval], p3[interval]
+                interpolated = np.where(
+                    cubic,
+                    p0 * tt1 * tt2 * tt3 / t01 / t02 / t03 - p1 * tt0 * tt2 * tt3 / t01 / t12 / t13 + p2 * tt0 * tt1 *
+                    tt3 / t02 / t12 / t23 - p3 * tt0 * tt1 * tt2 / t03 / t13 / t23,
+                    slopes[interval] * tt1 + p1)
+                lms.append(np.where(exact, values[clipped], np.where(inside, interpolated, np.nan)))
+        return tuple(lms)
+
+    def lms_at(self, age):
+        """
+        Returns the (L, M, S) at one age, or None if the age is outside the table. As in
+        `rcpchgrowth.global_functions.fetch_lms`, an age equal to a tabulated age to 16 decimal places counts as that
+        age.
+        """
+        count = len(self._ages)
+        below = bisect_right(self._ages, age) - 1
+        for index in (below, below + 1):
+            # rounding moves neither age by more than 5e-17, so only ages this close can round to the same
+            if 0 <= index < count and abs(self._ages[index] - age) < 1e-15 and \
+                    round(self._ages[index], 16) == round(age, 16):
+                return self._rows[index]
+        if below < 0 or below >= count - 1:
+            return None
+        if self._cubic[below]:
+            (a0, a1, a2, a3), (t01, t02, t03, t12, t13, t23), values = self._stencils[below]
+            tt0, tt1, tt2, tt3 = age - a0, age - a1, age - a2, age - a3
+            lms = []
+            for p0, p1, p2, p3 in values:
+                lms.append(
+                    p0 * tt1 * tt2 * tt3 / t01 / t02 / t03 - p1 * tt0 * tt2 * tt3 / t01 / t12 / t13 + p2 * tt0 *
+                    tt1 * tt3 / t02 / t12 / t23 - p3 * tt0 * tt1 * tt2 / t03 / t13 / t23)
+            return tuple(lms)
+        age_below = self._ages[below]
+        return tuple(
+            slope * (age - age_below) + parameter for slope, parameter in zip(self._slopes[below], self._rows[below]))
+
+
+class LMSIndex:
+    """
+    The L, M and S of one reference, measurement method and sex at any age. The ages in `TABLE_BOUNDARIES` split
+    the ages into intervals, each boundary age being an interval of its own, and each interval is found in one table
+    or none.
+    """
+
+    def __init__(self, reference, measurement_method, sex):
+        self.boundaries = np.array(TABLE_BOUNDARIES)
+        # an age in each interval: below the first boundary, each boundary, between each pair, above the last
+        between = (self.boundaries[:-1] + self.boundaries[1:]) / 2
+        representative = np.empty(2 * len(self.boundaries) + 1)
+        representative[0] = self.boundaries[0] - 1
+        representative[1::2] = self.boundaries
+        representative[2:-1:2] = between
+        representative[-1] = self.boundaries[-1] + 1
+        self.interval_tables = table_numbers(reference, measurement_method, sex, representative)
+        self.tables = [InterpolationTable(table) for table in reference_tables(reference, measurement_method, sex)]
+        self._boundaries = self.boundaries.tolist()
+        self._interval_tables = self.interval_tables.tolist()
+
+    def lms(self, decimal_age):
+        """
+        Returns L, M and S arrays for an array of ages, NaN where there is no data.
+        """
+        decimal_age = np.asarray(decimal_age, dtype=float)
+        boundary = np.searchsorted(self.boundaries, decimal_age, side="left")
+        at_boundary = self.boundaries[np.minimum(boundary, len(self.boundaries) - 1)] == decimal_age
+        table_number = self.interval_tables[2 * boundary + at_boundary]
+        if len(self.tables) == 1:
+            present = table_number == 0
+            return tuple(np.where(present, values, np.nan) for values in self.tables[0].lms(decimal_age))
+        l, m, s = (np.full(decimal_age.shape, np.nan) for _ in range(3))
+        for number, table in enumerate(self.tables):
+            mask = table_number == number
+            if mask.any():
+                l[mask], m[mask], s[mask] = table.lms(decimal_age[mask])
+        return l, m, s
+
+    def lms_at(self, age):
+        """
+        Returns the (L, M, S) at one age, or None where there is no data.
+        """
+        boundary = bisect_left(self._boundaries, age)
+        at_boundary = boundary < len(self._boundaries) and self._boundaries[boundary] == age
+        table_number = self._interval_tables[2 * boundary + at_boundary]
+        if table_number < 0:
+            return None
+        lms = self.tables[table_number].lms_at(age)
+        # NaN ages, and NaN in the tables
+        if lms is None or lms[0] != lms[0] or lms[1] != lms[1] or lms[2] != lms[2]:
+            return None
+        return lms
+
+
+def build_lms_index():
+    return {
+        (reference, measurement_method, sex): LMSIndex(reference, measurement_method, sex)
+        for reference in (UK_WHO, TURNERS, TRISOMY_21)
+        for measurement_method in MEASUREMENT_METHODS
+        for sex in SEXES
+    }
+
+
+LMS_INDEX = build_lms_index()
+
+
+def reference_has_data(reference, measurement_method, sex):
+    """
+    Whether a reference has any L, M and S for a measurement method and sex. Turner's syndrome only has girls' heights.
+    """
+    index = LMS_INDEX.get((reference, measurement_method, sex))
+    return index is not None and any(np.isfinite(table.parameters[1]).any() for table in index.tables)
+
+
+def lms_at(reference, measurement_method, sex, age):
+    """
+    Returns the (L, M, S) of a reference at one age, or None where there is no data, or no such reference,
+    measurement method or sex.
+    """
+    index = LMS_INDEX.get((reference, measurement_method, sex))
+    if index is None:
+        return None
+    return index.lms_at(age)
+
+
+def lms_for_age(reference, measurement_method, sex, decimal_age):
+    """
+    Returns L, M and S arrays for every row. Any argument may be a single value or an array; they are broadcast
+    together. Rows with no reference data, or an unrecognised reference, measurement method or sex, return NaN.
+    """
+    reference, measurement_method, sex, decimal_age = np.broadcast_arrays(
+        np.asarray(reference), np.asarray(measurement_method), np.asarray(sex),
+        np.asarray(decimal_age, dtype=float))
+    l = np.full(decimal_age.shape, np.nan)
+    m = np.full(decimal_age.shape, np.nan)
+    s = np.full(decimal_age.shape, np.nan)
+    for reference_name in np.unique(reference):
+        if reference_name not in (UK_WHO, TURNERS, TRISOMY_21):
+            continue
+        for method in MEASUREMENT_METHODS:
+            for sex_name in SEXES:
+                mask = (reference == reference_name) & (measurement_method == method) & (sex == sex_name)
+                if mask.any():
+                    l[mask], m[mask], s[mask] = LMS_INDEX[(str(reference_name), method, sex_name)].lms(
+                        decimal_age[mask])
+    return l, m, s
+
+
+def z_scores(l, m, s, observation_value):
+    """
+    Converts L, M and S arrays and observations to SDS: ((value/M)**L - 1)/(L*S), or log(value/M)/S where L is 0.
+    """
+    observation_value = np.asarray(observation_value, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = observation_value / m
+        return np.where(l != 0.0, (ratio ** l - 1) / (l * s), np.log(ratio) / s)
+
+
+def measurements_for_sds(l, m, s, sds):
+    """
+    Converts L, M and S arrays and SDS to measurements: M*(1+L*S*SDS)**(1/L), or M*exp(S*SDS) where L is 0.
+    Where 1+L*S*SDS is negative there is no such measurement and NaN is returned, where
+    `rcpchgrowth.global_functions.measurement_for_z` returns None.
+    """
+    sds = np.asarray(sds, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        first_step = 1 + l * s * sds
+        power = np.where(first_step < 0, np.nan, first_step) ** (1 / l)
+        return np.where(l != 0.0, power * m, np.exp(s * sds) * m)
+
+
+def centiles(sds):
+    """
+    Converts SDS to centiles, as percentages, using the normal cumulative distribution function.
+    """
+    return ndtr(sds) * 100
+
+
+def sds_for_centiles(centile):
+    """
+    Converts centiles, as percentages, to SDS using the inverse of the normal cumulative distribution function.
+    """
+    return ndtri(np.asarray(centile, dtype=float) / 100)
+
+
+def sds_and_centiles(reference, measurement_method, sex, decimal_age, observation_value):
+    """
+    Returns the SDS and centile for every row, as a dictionary of arrays.
+    These match the unrounded values `rcpchgrowth.Measurement` calculates for the same age; `Measurement` then
+    rounds the centile to one decimal place.
+    """
+    l, m, s = lms_for_age(reference, measurement_method, sex, decimal_age)
+    sds = z_scores(l, m, s, observation_value)
+    return {"sds": sds, "centile": centiles(sds)}
@@ -0,0 +1,58 @@
+"""
+Measurement values at given SDS or centiles
+* The inverse of a calculation: for lists of ages and SDS (or centiles), the measurement at each age which has that
+SDS, from the reference's LMS values as M*(1+L*S*SDS)**(1/L). Every age is looked up and converted at once (see
+`lms_engine`), so one request replaces probing the `/calculation` endpoints with guessed values, eg for target
+height bands or the expected measurement at the next visit
+* The ages and SDS are paired in order. A list of one value is paired with every value of the other list
+* Ages with no reference data, and SDS with no measurement (where 1+L*S*SDS is negative), have no value
+* Requests are answered on the calculation executor, up to `settings.max_measurement_values` values at a time
+"""
+# third party imports
+import numpy as np
+from fastapi import HTTPException
+
+# local imports
+from .executor import calculation_executor
+from .json_response import column_values
+from .lms_engine import centiles, lms_for_age, measurements_for_sds, sds_for_centiles
+from .settings import settings
+
+
+def measurement_values(reference, sex, measurement_method, decimal_ages, sds=None, centile=None):
+    """
+    Returns the measurement value at each age and SDS, or centile if no SDS are given, with the ages, SDS and
+    centiles they were found for, as lists.
+    """
+    decimal_ages = np.asarray(decimal_ages, dtype=float)
+    if sds is not None:
+        sds = np.asarray(sds, dtype=float)
+        centile = centiles(sds)
+    else:
+        centile = np.asarray(centile, dtype=float)
+        sds = sds_for_centiles(centile)
+    decimal_ages, sds, centile = np.broadcast_arrays(decimal_ages, sds, centile)
+    values = measurements_for_sds(*lms_for_age(reference, measurement_method, sex, decimal_ages), sds)
+    return {
+        "reference": reference,
+        "sex": sex,
+        "measurement_method": measurement_method,
+        "decimal_ages": column_values(decimal_ages),
+        "sds": column_values(sds),
+        "centiles": column_values(centile),
+        "measurement_values": column_values(values),
+    }
+
+
+async def measurement_values_response(reference, values_request):
+    """
+    Returns the measurement values for a `MeasurementValuesRequest`, calculated on the calculation executor. Raises
+    HTTPException 413 if more than `settings.max_measurement_values` values are asked for.
+    """
+    count = max(len(values_request.decimal_ages), len(values_request.sds or values_request.centiles))
+    if count > settings.max_measurement_values:
+        raise HTTPException(
+            status_code=413, detail=f"At most {settings.max_measurement_values} values can be returned by one request.")
+    return await calculation_executor.run(
+        measurement_values, reference, values_request.sex, values_request.measurement_method,
+        values_request.decimal_ages, values_request.sds, values_request.centiles)
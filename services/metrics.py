@@ -0,0 +1,360 @@
+"""
+Request metrics, exposed at `/metrics` in the Prometheus text format
+* `MetricsMiddleware` records every request's latency, request and response body sizes and status code, labelled with
+the route's path template rather than the URL, and counts the requests in flight
+* `TimedRoute` splits each request handled by a route into phases: `validation` (reading the body, validating it and
+resolving dependencies), `computation` (the endpoint function) and `serialization` (encoding the endpoint's return
+value). Streaming responses are computed as they are sent, so their time is only in the total
+* Cache hit rates, calculation executor queue depth and bulk job counts are read from the services when scraped
+* Metrics are kept per worker process: Prometheus should scrape each worker, or sum them
+"""
+# standard imports
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+
+# third party imports
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+# local imports
+from .executor import calculation_executor
+from .jobs import job_store
+from .json_response import json_endpoint, returns_plain_values
+from .profiling import in_profiled_thread
+from .result_cache import chart_cache, result_cache
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(64 * 4 ** power for power in range(10))  # 64 bytes to 16 MiB
+
+# Starlette adds the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def label_values(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        """
+        Yields (name, labels, value) for every sample of the metric.
+        """
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, list(zip(self.label_names, label_values)), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # a cumulative count per bucket, then the total count and the sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for label_values, counts in sorted(values.items()):
+            labels = list(zip(self.label_names, label_values))
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", labels + [("le", format_value(bound))], count
+            yield f"{self.name}_bucket", labels + [("le", "+Inf")], counts[-2]
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, counts[-2]
+
+
+class MetricsRegistry:
+    """
+    The metrics of this process. Collectors are functions called when the metrics are rendered, returning metrics
+    whose values are read from elsewhere.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, function):
+        self.collectors.append(function)
+        return function
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        metrics = list(self.metrics)
+        for collector in self.collectors:
+            metrics.extend(collector())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+REQUESTS_IN_FLIGHT = metrics_registry.register(Gauge(
+    "dgc_http_requests_in_flight", "Requests being handled.", ["method"]))
+REQUEST_DURATION = metrics_registry.register(Histogram(
+    "dgc_http_request_duration_seconds", "Time to handle a request, until the end of its response body.",
+    ["method", "route", "status"]))
+REQUEST_SIZE = metrics_registry.register(Histogram(
+    "dgc_http_request_size_bytes", "Size of request bodies.", ["method", "route"], SIZE_BUCKETS))
+RESPONSE_SIZE = metrics_registry.register(Histogram(
+    "dgc_http_response_size_bytes", "Size of response bodies, as sent.", ["method", "route", "status"], SIZE_BUCKETS))
+REQUEST_PHASE_DURATION = metrics_registry.register(Histogram(
+    "dgc_http_request_phase_seconds", "Time spent validating, computing and serializing each request.",
+    ["route", "phase"]))
+
+
+def route_path(scope):
+    """
+    Returns the path template of the route which handled a request, or `unmatched` if none did.
+    Routing leaves the route's endpoint in the request scope.
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        for route in scope["app"].routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency, sizes and status of every HTTP request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        start = time.perf_counter()
+        sizes = {"request": 0, "response": 0}
+        status = 500
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(method=method)
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(method=method)
+            route = route_path(scope)
+            REQUEST_DURATION.observe(time.perf_counter() - start, method=method, route=route, status=status)
+            REQUEST_SIZE.observe(sizes["request"], method=method, route=route)
+            RESPONSE_SIZE.observe(sizes["response"], method=method, route=route, status=status)
+
+
+# the phase timings of the request being handled, written by the timed endpoint
+phase_timings = contextvars.ContextVar("phase_timings")
+
+
+def timed_endpoint(endpoint):
+    """
+    Wraps an endpoint function to record when it starts and ends. FastAPI reads the wrapped function's signature.
+    """
+    if getattr(endpoint, "timed", False):
+        return endpoint
+
+    def record(key):
+        timings = phase_timings.get(None)
+        if timings is not None:
+            timings[key] = time.perf_counter()
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            record("endpoint_start")
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                record("endpoint_end")
+    else:
+        # runs in the threadpool, in a copy of the request's context which shares the same timings
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            record("endpoint_start")
+            try:
+                return in_profiled_thread(endpoint)(*args, **kwargs)
+            finally:
+                record("endpoint_end")
+    wrapper.timed = True
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    Route recording the time spent in each phase of handling a request. Use as the `route_class` of a router.
+    Plain values returned by the endpoint are encoded as a `FastJSONResponse`, after the endpoint has been timed, so
+    the encoding counts as serialization.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        timed = timed_endpoint(endpoint)
+        if returns_plain_values(endpoint, kwargs.get("response_model"), kwargs.get("response_class", JSONResponse)):
+            timed = json_endpoint(timed, kwargs.get("status_code"))
+        super().__init__(path, timed, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        path = self.path
+
+        async def timed_handler(request):
+            timings = {"start": time.perf_counter()}
+            token = phase_timings.set(timings)
+            try:
+                return await handler(request)
+            finally:
+                phase_timings.reset(token)
+                end = time.perf_counter()
+                if "endpoint_end" in timings:
+                    REQUEST_PHASE_DURATION.observe(
+                        timings["endpoint_start"] - timings["start"], route=path, phase="validation")
+                    REQUEST_PHASE_DURATION.observe(
+                        timings["endpoint_end"] - timings["endpoint_start"], route=path, phase="computation")
+                    REQUEST_PHASE_DURATION.observe(end - timings["endpoint_end"], route=path, phase="serialization")
+                else:
+                    # the request was rejected before the endpoint ran
+                    REQUEST_PHASE_DURATION.observe(end - timings["start"], route=path, phase="validation")
+
+        return timed_handler
+
+
+def gauge(name, documentation, label_names, values):
+    """
+    A gauge holding `values`, a dict of label value tuples to values.
+    """
+    metric = Gauge(name, documentation, label_names)
+    metric._values = dict(values)
+    return metric
+
+
+def counter(name, documentation, label_names, values):
+    metric = Counter(name, documentation, label_names)
+    metric._values = dict(values)
+    return metric
+
+
+@metrics_registry.collector
+def cache_metrics():
+    hits, misses, hit_ratios, entries = {}, {}, {}, {}
+    for cache in (result_cache, chart_cache):
+        for tier, stats in cache.stats()["tiers"].items():
+            key = (cache.namespace, tier)
+            hits[key], misses[key] = stats["hits"], stats["misses"]
+            if stats["hit_rate"] is not None:
+                hit_ratios[key] = stats["hit_rate"]
+            if "entries" in stats:
+                entries[key] = stats["entries"]
+    return [
+        counter("dgc_cache_hits_total", "Cache lookups found in the tier.", ["cache", "tier"], hits),
+        counter("dgc_cache_misses_total", "Cache lookups not found in the tier.", ["cache", "tier"], misses),
+        gauge("dgc_cache_hit_ratio", "Fraction of cache lookups found in the tier since the server started.",
+              ["cache", "tier"], hit_ratios),
+        gauge("dgc_cache_entries", "Entries held in the tier by this process.", ["cache", "tier"], entries),
+    ]
+
+
+@metrics_registry.collector
+def executor_metrics():
+    return [
+        gauge("dgc_executor_pending", "Calculations waiting or running on the calculation executor.", ["backend"],
+              {(calculation_executor.backend,): calculation_executor.pending}),
+        gauge("dgc_executor_max_pending", "Calculations accepted before further requests get a 503.", ["backend"],
+              {(calculation_executor.backend,): calculation_executor.max_pending}),
+    ]
+
+
+@metrics_registry.collector
+def job_metrics():
+    statuses = {}
+    for job in job_store.jobs():
+        statuses[(job["status"],)] = statuses.get((job["status"],), 0) + 1
+    return [gauge("dgc_jobs", "Bulk calculation jobs, by status.", ["status"], statuses)]
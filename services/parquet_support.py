@@ -0,0 +1,22 @@
+"""
+Optional Parquet support
+* pyarrow is optional: without it only CSV jobs and NDJSON cohorts are accepted
+* It is slow to import, so is only imported once a Parquet file is read or written, not as the server starts. Every
+Parquet reader and writer imports it through `import_pyarrow`, so a missing pyarrow fails with the same message
+"""
+# standard imports
+import importlib.util
+
+PYARROW_INSTALLED = importlib.util.find_spec("pyarrow") is not None
+
+
+def import_pyarrow():
+    """
+    Returns the pyarrow module, with `pyarrow.parquet` imported. Raises ImportError if pyarrow is not installed.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError("Parquet files need pyarrow, which is not installed: pip install pyarrow") from error
+    return pyarrow
@@ -0,0 +1,304 @@
+"""
+On-demand profiling of live requests
+* Off unless `DGC_PROFILING_ENABLED=true`. When off, `ProfilingMiddleware` is not installed, and the only cost left is
+one context variable lookup when a calculation is handed to a thread
+* A request with an `X-Profile: store` header (or `?profile=store`) and the admin key in `X-Admin-Key` is profiled, and
+the profile's ID returned in the response's `X-Profile-ID` header. With `X-Profile: return` the profile is sent
+instead of the response, with the response's status in `X-Profile-Status`
+* `DGC_PROFILING_SAMPLE_RATE` profiles that fraction of all requests as well. The newest `DGC_PROFILING_MAX_PROFILES`
+profiles are kept in `DGC_PROFILING_DIRECTORY`, and listed and fetched at `/admin/profiles`
+* Profiles are taken by sampling the stacks of the threads working on the request every `DGC_PROFILING_INTERVAL`
+seconds: the event loop thread, and any threadpool threads running its endpoint or calculations. Anything else running
+on the event loop at the same time is included too. Calculations run by the `process` executor backend are not seen
+* Profiles are written in the folded stack format, one `frame;frame;frame count` line per stack, read by
+`flamegraph.pl`, speedscope and most other flame graph viewers
+"""
+# standard imports
+import collections
+import contextvars
+import functools
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import parse_qs
+
+# third party imports
+from starlette.concurrency import run_in_threadpool
+
+# local imports
+from .settings import settings
+
+# the profile of the request being handled, if it is being profiled
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+VALID_PROFILE_ID = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+
+@functools.lru_cache(maxsize=4096)
+def frame_label(filename, name, line):
+    # paths are shown relative to the entry of sys.path they were imported from, eg rcpchgrowth/measurement.py
+    for directory in sorted({os.path.abspath(entry or os.curdir) for entry in sys.path}, key=len, reverse=True):
+        if filename.startswith(directory + os.sep):
+            filename = filename[len(directory) + 1:]
+            break
+    return f"{name} ({filename}:{line})"
+
+
+class Profile:
+    """
+    The stacks sampled from the threads working on one request, and how often each was seen.
+    """
+
+    def __init__(self, profile_id=None):
+        self.id = profile_id or f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        self.stacks = collections.Counter()
+        self.samples = 0
+        # thread id: (thread name, times entered)
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def enter_thread(self):
+        thread = threading.current_thread()
+        with self._lock:
+            name, count = self._threads.get(thread.ident, (thread.name, 0))
+            self._threads[thread.ident] = (name, count + 1)
+
+    def exit_thread(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            name, count = self._threads[thread_id]
+            if count == 1:
+                del self._threads[thread_id]
+            else:
+                self._threads[thread_id] = (name, count - 1)
+
+    def sample(self, frames):
+        with self._lock:
+            threads = {thread_id: name for thread_id, (name, _) in self._threads.items()}
+        self.samples += 1
+        for thread_id, thread_name in threads.items():
+            frame = frames.get(thread_id)
+            labels = []
+            while frame is not None:
+                code = frame.f_code
+                labels.append(frame_label(code.co_filename, code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            labels.append(thread_name)
+            self.stacks[";".join(reversed(labels))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Sampler:
+    """
+    Samples the threads of every profile being taken, from one background thread which runs only while there are any.
+    """
+
+    def __init__(self):
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def run(self):
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(settings.profiling_interval)
+
+
+sampler = Sampler()
+
+
+def in_profiled_thread(function):
+    """
+    Returns `function`, wrapped so the thread it runs in is sampled if the current request is being profiled.
+    For work handed to another thread, which copies the request's context.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile.enter_thread()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.exit_thread()
+    return wrapper
+
+
+class ProfileStore:
+    """
+    The newest `max_profiles` profiles, each kept as a folded stack file with a JSON file describing the request.
+    """
+
+    def __init__(self, directory, max_profiles=200):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, profile, metadata):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / f"{profile.id}.folded").write_text(profile.folded())
+        (self.directory / f"{profile.id}.json").write_text(json.dumps(dict(metadata, id=profile.id)))
+        with self._lock:
+            for old in self.ids()[self.max_profiles:]:
+                for suffix in (".folded", ".json"):
+                    try:
+                        (self.directory / f"{old}{suffix}").unlink()
+                    except FileNotFoundError:
+                        pass
+
+    def ids(self):
+        """
+        Profile IDs, newest first.
+        """
+        if not self.directory.exists():
+            return []
+        return sorted(
+            (path.stem for path in self.directory.glob("*.json") if VALID_PROFILE_ID.match(path.stem)),
+            key=lambda profile_id: int(profile_id.split("-")[0]),
+            reverse=True,
+        )
+
+    def list(self):
+        profiles = []
+        for profile_id in self.ids():
+            try:
+                profiles.append(json.loads((self.directory / f"{profile_id}.json").read_text()))
+            except (FileNotFoundError, ValueError):
+                continue
+        return profiles
+
+    def get(self, profile_id):
+        """
+        The folded stacks of a profile, or None if there is no such profile.
+        """
+        if not VALID_PROFILE_ID.match(profile_id):
+            return None
+        try:
+            return (self.directory / f"{profile_id}.folded").read_text()
+        except FileNotFoundError:
+            return None
+
+
+profile_store = ProfileStore(settings.profiling_directory, settings.profiling_max_profiles)
+
+
+def requested_mode(scope):
+    """
+    `store` or `return` if the request asks to be profiled and passes the admin key, otherwise None.
+    """
+    headers = dict(scope["headers"])
+    requested = headers.get(b"x-profile", b"").decode("latin-1").lower()
+    if not requested and b"profile=" in scope.get("query_string", b""):
+        requested = parse_qs(scope["query_string"].decode("latin-1")).get("profile", [""])[0].lower()
+    if not requested:
+        return None
+    key = headers.get(b"x-admin-key", b"").decode("latin-1")
+    if settings.admin_api_key is None or not secrets.compare_digest(key, settings.admin_api_key):
+        return None
+    return "return" if requested == "return" else "store"
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests which ask for it, and a sample of all requests.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        mode = requested_mode(scope)
+        if mode is None and settings.profiling_sample_rate > 0 and random.random() < settings.profiling_sample_rate:
+            mode = "sampled"
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile()
+        status = 500
+        response_messages = []
+
+        async def profiled_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if mode == "store":
+                    message = dict(message, headers=list(message.get("headers", [])) + [
+                        (b"x-profile-id", profile.id.encode("latin-1"))])
+            if mode == "return":
+                response_messages.append(message)
+            else:
+                await send(message)
+
+        start = time.perf_counter()
+        token = current_profile.set(profile)
+        profile.enter_thread()
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            sampler.remove(profile)
+            profile.exit_thread()
+            current_profile.reset(token)
+        # imported here, as metrics imports the executor, which imports this module
+        from .metrics import route_path
+        from .structured_logging import request_id
+        metadata = {
+            "created": time.time(),
+            "reason": "sampled" if mode == "sampled" else "requested",
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route_path(scope),
+            "status": status,
+            "duration_seconds": round(time.perf_counter() - start, 6),
+            "samples": profile.samples,
+            "request_id": request_id.get(),
+        }
+        await run_in_threadpool(profile_store.save, profile, metadata)
+
+        if mode == "return":
+            body = profile.folded().encode()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"x-profile-id", profile.id.encode("latin-1")),
+                    (b"x-profile-status", str(status).encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,167 @@
+"""
+Caches of calculation results and chart coordinate responses
+* Calculations are keyed by the reference and every field of the `MeasurementRequest`, so a repeated request gets
+exactly the result it would have had, without constructing a new `Measurement`
+* Results are held pickled, so each hit returns a fresh copy and the memory limit is exact
+* Each cache looks through its tiers in order, see `cache_backends`: this process's memory, then the SQLite file shared
+by the workers on the host (`DGC_RESULT_CACHE_PATH`), then a Redis protocol server (`DGC_RESULT_CACHE_REDIS_URL`).
+A hit in a later tier is copied into the earlier ones, and new results are written to every tier
+* From async code, `get_async` and `put_async` only use the memory tier on the event loop: the shared tiers are
+reached in the threadpool, so a slow SQLite file or Redis server never holds up other requests
+* Results can expire after a time to live
+* Hits and misses are counted per tier
+"""
+# standard imports
+import json
+import pickle
+import threading
+import time
+from datetime import date
+from importlib.metadata import version
+
+# third party imports
+from starlette.concurrency import run_in_threadpool
+
+# local imports
+from .cache_backends import MemoryCacheBackend, RedisCacheBackend, SQLiteCacheBackend
+from .settings import settings
+
+# results are only reused by the same version of rcpchgrowth
+RCPCHGROWTH_VERSION = version("rcpchgrowth")
+
+
+def canonical_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical_value(item) for item in value)
+    return value
+
+
+def cache_key(reference, measurement_request):
+    """
+    Returns the cache key for a validated `MeasurementRequest`: a canonical tuple of the rcpchgrowth version, the
+    reference and every field of the request in declaration order, serialized as compact JSON.
+    """
+    key = (RCPCHGROWTH_VERSION, reference) + tuple(
+        canonical_value(getattr(measurement_request, field)) for field in measurement_request.__fields__)
+    return json.dumps(key, separators=(",", ":"))
+
+
+class ResultCache:
+    """
+    A cache of picklable results in one or more tiers. `namespace` keeps its keys apart from other caches sharing the
+    same SQLite file or Redis server.
+    """
+
+    def __init__(self, namespace, tiers, ttl=None):
+        self.namespace = namespace
+        self.tiers = list(tiers)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.counters = {tier.name: {"hits": 0, "misses": 0} for tier in self.tiers}
+
+    @property
+    def enabled(self):
+        return bool(self.tiers)
+
+    @property
+    def local_tiers(self):
+        """
+        The number of tiers in this process's memory, which come before the shared tiers.
+        """
+        return sum(1 for tier in self.tiers if not tier.shared)
+
+    def get(self, key, first_tier=0, last_tier=None):
+        """
+        Returns a copy of the cached result for `key`, or None. Only the tiers from `first_tier` up to, but not
+        including, `last_tier` are looked in.
+        """
+        full_key = f"{self.namespace}:{key}"
+        for index, tier in enumerate(self.tiers[first_tier:last_tier], start=first_tier):
+            value = tier.get(full_key)
+            with self._lock:
+                self.counters[tier.name]["misses" if value is None else "hits"] += 1
+            if value is not None:
+                # earlier tiers keep it for the cache's time to live from now
+                for earlier_tier in self.tiers[:index]:
+                    earlier_tier.put(full_key, value, self.expires())
+                return pickle.loads(value)
+        return None
+
+    def put(self, key, result, tiers=None):
+        value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        for tier in self.tiers if tiers is None else tiers:
+            tier.put(f"{self.namespace}:{key}", value, self.expires())
+
+    async def get_async(self, key):
+        """
+        As `get`, looking in the memory tier on the event loop, and only then in the shared tiers, in the threadpool.
+        """
+        local_tiers = self.local_tiers
+        result = self.get(key, 0, local_tiers)
+        if result is None and local_tiers < len(self.tiers):
+            result = await run_in_threadpool(self.get, key, local_tiers)
+        return result
+
+    async def put_async(self, key, result):
+        """
+        As `put`, writing to the memory tier on the event loop, and to the shared tiers in the threadpool.
+        """
+        local_tiers = self.local_tiers
+        self.put(key, result, self.tiers[:local_tiers])
+        if local_tiers < len(self.tiers):
+            await run_in_threadpool(self.put, key, result, self.tiers[local_tiers:])
+
+    def expires(self):
+        return None if self.ttl is None else time.time() + self.ttl
+
+    def clear(self):
+        """
+        Empties the cache in every tier.
+        """
+        for tier in self.tiers:
+            tier.clear(f"{self.namespace}:")
+
+    def stats(self):
+        tiers = {}
+        with self._lock:
+            for tier in self.tiers:
+                counters = dict(self.counters[tier.name])
+                lookups = counters["hits"] + counters["misses"]
+                counters["hit_rate"] = counters["hits"] / lookups if lookups else None
+                tiers[tier.name] = dict(tier.stats(), **counters)
+        hits = sum(tier["hits"] for tier in tiers.values())
+        # every lookup reaches the first tier
+        lookups = tiers[self.tiers[0].name]["hits"] + tiers[self.tiers[0].name]["misses"] if self.tiers else 0
+        return {
+            "namespace": self.namespace,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": hits / lookups if lookups else None,
+            "tiers": tiers,
+        }
+
+
+def shared_tiers():
+    """
+    Tiers shared between worker processes, as configured in the settings.
+    """
+    tiers = []
+    if settings.result_cache_path is not None:
+        tiers.append(SQLiteCacheBackend(settings.result_cache_path))
+    if settings.result_cache_redis_url is not None:
+        tiers.append(RedisCacheBackend(settings.result_cache_redis_url))
+    return tiers
+
+
+SHARED_TIERS = shared_tiers()
+
+result_cache = ResultCache(
+    "calculation",
+    ([MemoryCacheBackend(settings.result_cache_max_bytes)] if settings.result_cache_max_bytes else []) + SHARED_TIERS,
+    settings.result_cache_ttl,
+)
+# sliced chart coordinate responses are already held in memory by the chart data store, so only the shared tiers
+chart_cache = ResultCache("chart", SHARED_TIERS, settings.result_cache_ttl)
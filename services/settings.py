@@ -0,0 +1,106 @@
+"""
+Server configuration
+* Every setting can be overridden with an environment variable prefixed `DGC_`, eg `DGC_PRELOAD_CHART_DATA=true`
+"""
+# standard imports
+from pathlib import Path
+from typing import Dict, Literal, Optional
+
+# third party imports
+from pydantic import BaseSettings, Field
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+class Settings(BaseSettings):
+    chart_data_directory: Path = Field(
+        PROJECT_ROOT / "chart-data", description="Directory holding the precomputed chart coordinate files.")
+    chart_data_format: Literal["json", "binary"] = Field(
+        "json", description="Serve chart coordinates from the JSON files, or from the memory-mapped binary files written by `python cli.py convert-chart-data`.")
+    preload_chart_data: bool = Field(
+        False, description="Load every chart coordinate file into memory, and build its compressed response bodies and ETags, when the server starts, rather than on first request.")
+    chart_data_generation: Literal["background", "on-demand", "off"] = Field(
+        "background", description="How missing chart coordinate files are generated: in the background once the server has started, only when first requested, or not at all (generate them at build time with `python cli.py generate-chart-data`).")
+    chart_data_generation_workers: Optional[int] = Field(
+        None, ge=1, description="Number of processes generating missing chart coordinate files in the background. Defaults to the number of CPU cores.")
+    chart_slice_cache_size: int = Field(
+        256, ge=1, description="Number of sliced or downsampled chart coordinate responses kept in memory.")
+    chart_curve_cache_size: int = Field(
+        256, ge=1, description="Number of chart coordinate responses generated for custom centiles, SDS or numbers of points a year kept in memory.")
+    gzip_level: int = Field(
+        9, ge=1, le=9, description="gzip compression level for pre-compressed responses.")
+    brotli_quality: int = Field(
+        9, ge=0, le=11, description="Brotli compression quality for pre-compressed responses.")
+    chart_data_cache_control: str = Field(
+        "public, no-cache", description="`Cache-Control` header sent with chart coordinate responses. By default caches may store them but must revalidate using the ETag.")
+    max_batch_size: int = Field(
+        500, ge=1, description="Maximum number of measurements accepted in one request to the batch `/calculations` endpoints.")
+    stream_chunk_size: int = Field(
+        100, ge=1, description="Maximum number of lines calculated together by the streaming `/calculations/stream` endpoints.")
+    max_ndjson_line_bytes: int = Field(
+        64 * 1024, ge=1, description="Maximum length, in bytes, of one line of the body of the streaming `/calculations/stream` endpoints. A longer line gets an error result and is not kept in memory.")
+    max_fictional_children: int = Field(
+        1000, ge=1, description="Maximum number of children generated by one request to the streaming `/fictional-child-data/stream` endpoints.")
+    max_fictional_child_rows: int = Field(
+        100000, ge=1, description="Maximum number of measurements, the number of children times the measurements of each, generated by one request to the streaming `/fictional-child-data/stream` endpoints.")
+    max_measurement_values: int = Field(
+        10000, ge=1, description="Maximum number of measurement values returned by one request to the `/measurement-values` endpoints.")
+    max_cohort_children: int = Field(
+        1000000, ge=1, description="Maximum number of children in one synthetic cohort generated by the `/jobs/cohorts` endpoint.")
+    max_cohort_rows: int = Field(
+        1000000, ge=1, description="Maximum number of rows, the number of children times the measurements of each, in one synthetic cohort generated by the `/jobs/cohorts` endpoint.")
+    executor_backend: Literal["threadpool", "process", "inline"] = Field(
+        "threadpool", description="Where calculations run: FastAPI's threadpool, a pool of warm worker processes which use every CPU core, or inline on the event loop.")
+    executor_workers: Optional[int] = Field(
+        None, ge=1, description="Number of worker processes for the `process` executor backend. Defaults to the number of CPU cores.")
+    executor_max_pending: int = Field(
+        256, ge=1, description="Maximum number of calculations waiting or running at once. Further requests get a 503 response until the backlog clears.")
+    result_cache_max_bytes: int = Field(
+        64 * 1024 * 1024, ge=0, description="Memory, in bytes, for caching the results of `/calculation` requests. 0 turns the in-memory cache off.")
+    result_cache_ttl: Optional[float] = Field(
+        None, gt=0, description="Seconds a cached calculation result is kept for. By default results are kept until evicted.")
+    result_cache_path: Optional[Path] = Field(
+        None, description="SQLite file caching calculation results and chart coordinate responses, shared by every worker process on the host and kept across restarts. Not used unless set.")
+    result_cache_redis_url: Optional[str] = Field(
+        None, description="`redis://[:password@]host[:port][/db]` URL of a Redis protocol server caching calculation results and chart coordinate responses, shared by every host. Not used unless set.")
+    jobs_directory: Path = Field(
+        PROJECT_ROOT / "jobs", description="Directory where bulk calculation jobs, their uploaded files and their results are kept.")
+    job_workers: Optional[int] = Field(
+        None, ge=1, description="Number of worker processes calculating bulk calculation jobs. Defaults to the number of CPU cores.")
+    max_job_upload_bytes: int = Field(
+        100 * 1024 * 1024, ge=1, description="Maximum size, in bytes, of a file uploaded to the `/jobs` endpoint.")
+    job_chunk_size: int = Field(
+        1000, ge=1, description="Number of rows of a bulk calculation job sent to a worker process at a time.")
+    log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = Field(
+        "INFO", description="Lowest level of log records written.")
+    log_format: Literal["json", "text"] = Field(
+        "json", description="Write log records as one JSON object per line, or as plain text.")
+    log_queue_size: int = Field(
+        10000, ge=1, description="Log records waiting to be written. Records logged while the queue is full are dropped, rather than holding up requests.")
+    log_sample_rate: float = Field(
+        1.0, ge=0, le=1, description="Fraction of requests written to the access log.")
+    log_route_sample_rates: Dict[str, float] = Field(
+        {}, description='Fraction of requests written to the access log for particular routes, as JSON, eg `{"/uk-who/chart-coordinates": 0.01}`.')
+    log_slow_request_seconds: float = Field(
+        1.0, gt=0, description="Requests taking at least this long are always written to the access log, whatever the sample rate.")
+    lms_index_enabled: bool = Field(
+        False, description="Look up the L, M and S of single calculations in the index built from the reference tables at startup, rather than with rcpchgrowth's search of the tables on every call. This replaces functions inside rcpchgrowth, so is only done with the version of rcpchgrowth the index has been checked against: with any other a warning is logged and rcpchgrowth's own functions are used.")
+    profiling_enabled: bool = Field(
+        False, description="Allow requests to be profiled, see `services/profiling.py`. When false the profiler is not installed and costs nothing.")
+    profiling_sample_rate: float = Field(
+        0.0, ge=0, le=1, description="Fraction of all requests profiled, when profiling is enabled.")
+    profiling_interval: float = Field(
+        0.001, gt=0, description="Seconds between the stack samples of a profile.")
+    profiling_directory: Path = Field(
+        PROJECT_ROOT / "profiles", description="Directory where request profiles are kept, as folded stack files for flame graph tools.")
+    profiling_max_profiles: int = Field(
+        200, ge=1, description="Number of request profiles kept. The oldest are deleted as new ones are taken.")
+    admin_api_key: Optional[str] = Field(
+        None, description="Key which must be passed in the `X-Admin-Key` header to use the `/admin` endpoints. The admin endpoints are disabled if this is not set.")
+
+    class Config:
+        env_prefix = "DGC_"
+
+
+settings = Settings()
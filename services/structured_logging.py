@@ -0,0 +1,213 @@
+"""
+Structured logging
+* Every log record is written as one JSON object per line (or as plain text with `DGC_LOG_FORMAT=text`), with the ID of
+the request it was logged during
+* Records are put on a bounded queue and written to stdout by a background thread, so logging never blocks a request
+on a write. If the queue is full, records are dropped and counted rather than waited for
+* `RequestLogMiddleware` gives every request an ID, taken from its `X-Request-ID` header or generated, and returned in
+the response's `X-Request-ID` header. It logs one access record per request, sampled per route with
+`DGC_LOG_SAMPLE_RATE` and `DGC_LOG_ROUTE_SAMPLE_RATES`. Server errors and requests slower than
+`DGC_LOG_SLOW_REQUEST_SECONDS` are always logged
+* Modules log with `logging.getLogger(__name__)` as usual
+"""
+# standard imports
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# local imports
+from .metrics import Counter, metrics_registry, route_path
+from .settings import settings
+
+# the ID of the request being handled, if any
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# request IDs given by clients are only used if they are short and safe to log
+VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# attributes every LogRecord has, so anything else was passed in `extra`
+RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "request_id"}
+
+access_logger = logging.getLogger("access")
+
+
+class RequestIDFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object: the time, level, logger, message and request ID, then any `extra` fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue without waiting, dropping them if the queue is full.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the message is merged with its arguments here, as they may change before the record is written, but the
+        # record is otherwise left for the formatter
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingSubsystem:
+    """
+    The queue handler on the root logger and the thread writing its records out.
+    """
+
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+        self._lock = threading.Lock()
+
+    @property
+    def dropped(self):
+        return 0 if self.handler is None else self.handler.dropped
+
+    def configure(self, level="INFO", log_format="json", queue_size=10000, stream=None):
+        """
+        Sends every record logged at `level` or above through a queue to `stream` (default: stdout).
+        Calling it again replaces the previous configuration.
+        """
+        with self._lock:
+            self._stop()
+            output = logging.StreamHandler(stream or sys.stdout)
+            if log_format == "json":
+                output.setFormatter(JSONFormatter())
+            else:
+                output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+            self.handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+            self.handler.addFilter(RequestIDFilter())
+            self.listener = logging.handlers.QueueListener(self.handler.queue, output)
+            root = logging.getLogger()
+            root.addHandler(self.handler)
+            root.setLevel(level)
+            self.listener.start()
+
+    def _stop(self):
+        if self.handler is not None:
+            logging.getLogger().removeHandler(self.handler)
+            # writes out every record already queued
+            self.listener.stop()
+            self.handler, self.listener = None, None
+
+    def stop(self):
+        with self._lock:
+            self._stop()
+
+
+logging_subsystem = LoggingSubsystem()
+atexit.register(logging_subsystem.stop)
+
+
+@metrics_registry.collector
+def logging_metrics():
+    dropped = Counter("dgc_log_records_dropped_total", "Log records dropped because the logging queue was full.")
+    dropped._values = {(): logging_subsystem.dropped}
+    return [dropped]
+
+
+def configure_logging():
+    logging_subsystem.configure(settings.log_level, settings.log_format, settings.log_queue_size)
+
+
+def sample_rate(route):
+    return settings.log_route_sample_rates.get(route, settings.log_sample_rate)
+
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware setting the request ID and logging a sampled access record for each request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        given_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        current_id = given_id if VALID_REQUEST_ID.match(given_id) else uuid.uuid4().hex
+        token = request_id.set(current_id)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = dict(message, headers=list(message.get("headers", [])) + [
+                    (b"x-request-id", current_id.encode("latin-1"))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            duration = time.perf_counter() - start
+            if access_logger.isEnabledFor(logging.INFO):
+                route = route_path(scope)
+                rate = sample_rate(route)
+                slow = duration >= settings.log_slow_request_seconds
+                if status >= 500 or slow or (rate > 0 and random.random() < rate):
+                    access_logger.log(
+                        logging.WARNING if status >= 500 or slow else logging.INFO,
+                        "%s %s %s", scope["method"], scope["path"], status,
+                        extra={
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "route": route,
+                            "status": status,
+                            "duration_seconds": round(duration, 6),
+                            "slow": slow,
+                            "sample_rate": rate,
+                        },
+                    )
+            request_id.reset(token)
@@ -0,0 +1,49 @@
+"""
+Tests for the endpoint benchmark suite
+"""
+# local / rcpch imports
+from benchmarks.endpoints import compare, run_inprocess
+from benchmarks.scenarios import all_scenarios, percentile, select_scenarios, summarise
+
+
+def test_scenarios_cover_every_endpoint_and_reference():
+    names = {scenario.name for scenario in all_scenarios()}
+
+    assert len(names) == 9
+    assert select_scenarios(["turner-*"])[0].path == "/turner/calculation"
+    assert [scenario.name for scenario in select_scenarios(["*-fictional-child-data"])] == [
+        "uk-who-fictional-child-data", "turner-fictional-child-data", "trisomy-21-fictional-child-data"]
+
+
+def test_summary():
+    assert percentile([1, 2, 3, 4], 0.5) == 2
+    summary = summarise([0.001 * value for value in range(1, 101)], 2, 2.0, 200 * 1024 ** 2)
+
+    assert summary["requests"] == 100
+    assert summary["errors"] == 2
+    assert summary["p95_ms"] == 95
+    assert summary["requests_per_second"] == 50
+    assert summary["peak_rss_mb"] == 200
+
+
+def test_inprocess_run():
+    results = run_inprocess(select_scenarios(["uk-who-calculation", "turner-chart-coordinates"]), 3, 1)
+
+    assert set(results) == {"uk-who-calculation", "turner-chart-coordinates"}
+    assert results["uk-who-calculation"]["errors"] == 0
+    assert results["uk-who-calculation"]["p50_ms"] > 0
+
+
+def test_regressions_are_reported():
+    thresholds = {"max_increase": {"p95_ms": 0.25}, "max_decrease": {"requests_per_second": 0.2}}
+    baseline = {"scenarios": {"uk-who-calculation": {"errors": 0, "p95_ms": 10, "requests_per_second": 100}}}
+    within = {"scenarios": {"uk-who-calculation": {"errors": 0, "p95_ms": 12, "requests_per_second": 85}}}
+    beyond = {"scenarios": {
+        "uk-who-calculation": {"errors": 1, "p95_ms": 13, "requests_per_second": 70},
+        "turner-calculation": {"errors": 0, "p95_ms": 100, "requests_per_second": 1},
+    }}
+
+    assert compare(baseline, within, thresholds) == []
+    regressions = compare(baseline, beyond, thresholds)
+    assert len(regressions) == 3
+    assert all(regression.startswith("uk-who-calculation") for regression in regressions)
@@ -0,0 +1,194 @@
+"""
+Tests for the cache storage tiers, using a small in-process stand-in for a Redis server
+"""
+# standard imports
+import asyncio
+import fnmatch
+import socketserver
+import threading
+import time
+
+# third party imports
+import pytest
+
+# local / rcpch imports
+from services.cache_backends import MemoryCacheBackend, RedisCacheBackend, SQLiteCacheBackend
+from services.chart_data_store import ChartDataStore
+from services.result_cache import ResultCache
+from services.settings import settings
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    """
+    Answers the few commands the Redis cache backend sends, from a dict of (value, expires) shared by all connections.
+    """
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        arguments = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            arguments.append(self.rfile.read(length + 2)[:-2])
+        return arguments
+
+    def write(self, reply):
+        if reply is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(reply, int):
+            self.wfile.write(b":%d\r\n" % reply)
+        elif isinstance(reply, list):
+            self.wfile.write(b"*%d\r\n" % len(reply))
+            for item in reply:
+                self.write(item)
+        elif reply == b"OK":
+            self.wfile.write(b"+OK\r\n")
+        else:
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(reply), reply))
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            name, arguments = command[0].upper(), command[1:]
+            if name in (b"AUTH", b"SELECT"):
+                self.write(b"OK")
+            elif name == b"GET":
+                value, expires = data.get(arguments[0], (None, None))
+                self.write(None if expires is not None and expires <= time.time() else value)
+            elif name == b"SET":
+                expires = time.time() + int(arguments[3]) / 1000 if len(arguments) > 2 else None
+                data[arguments[0]] = (arguments[1], expires)
+                self.write(b"OK")
+            elif name == b"DEL":
+                self.write(sum(data.pop(key, None) is not None for key in arguments))
+            elif name == b"SCAN":
+                pattern = arguments[arguments.index(b"MATCH") + 1].decode()
+                self.write([b"0", [key for key in list(data) if fnmatch.fnmatchcase(key.decode(), pattern)]])
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def redis_url():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RESPHandler)
+    server.daemon_threads = True
+    server.data = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"redis://127.0.0.1:{server.server_address[1]}/1"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCacheBackend(1024 * 1024)
+    if request.param == "sqlite":
+        return SQLiteCacheBackend(tmp_path / "cache.sqlite3")
+    return RedisCacheBackend(request.getfixturevalue("redis_url"))
+
+
+def test_backend_stores_and_expires(backend):
+    backend.put("calculation:a", b"first")
+    backend.put("calculation:b", b"second", time.time() + 0.05)
+    backend.put("chart:a", b"third")
+
+    assert backend.get("calculation:a") == b"first"
+    assert backend.get("calculation:b") == b"second"
+    assert backend.get("calculation:c") is None
+    time.sleep(0.1)
+    assert backend.get("calculation:b") is None
+
+    backend.clear("calculation:")
+
+    assert backend.get("calculation:a") is None
+    assert backend.get("chart:a") == b"third"
+    assert backend.stats()["writes"] == 3
+
+
+@pytest.mark.parametrize("shared", ["sqlite", "redis"])
+def test_workers_share_results(shared, tmp_path, request):
+    # each worker process has its own memory tier in front of the same shared tier
+    def worker_cache():
+        if shared == "sqlite":
+            shared_tier = SQLiteCacheBackend(tmp_path / "cache.sqlite3")
+        else:
+            shared_tier = RedisCacheBackend(request.getfixturevalue("redis_url"))
+        return ResultCache("calculation", [MemoryCacheBackend(1024 * 1024), shared_tier])
+
+    first_worker, second_worker = worker_cache(), worker_cache()
+    first_worker.put("key", {"value": 1})
+
+    assert second_worker.get("key") == {"value": 1}
+    assert second_worker.get("key") == {"value": 1}
+    stats = second_worker.stats()
+    assert stats["hits"] == 2
+    assert stats["hit_rate"] == 1.0
+    # the first lookup missed in memory and hit the shared tier, the second hit the copy held in memory
+    assert stats["tiers"]["memory"]["hit_rate"] == 0.5
+    assert stats["tiers"][shared]["hits"] == 1
+
+
+def test_unavailable_redis_is_a_miss():
+    backend = RedisCacheBackend("redis://127.0.0.1:1", timeout=0.1)
+    cache = ResultCache("calculation", [MemoryCacheBackend(1024 * 1024), backend])
+
+    cache.put("key", {"value": 1})
+    assert cache.get("missing") is None
+    assert cache.get("key") == {"value": 1}
+    # after the first failure the server is not tried again for a while
+    assert backend.stats()["errors"] == 1
+
+
+def test_shared_tiers_are_used_off_the_event_loop(tmp_path):
+    threads = []
+
+    class RecordingSQLiteCacheBackend(SQLiteCacheBackend):
+        def _get(self, key):
+            threads.append(threading.get_ident())
+            return super()._get(key)
+
+        def _put(self, key, value, expires):
+            threads.append(threading.get_ident())
+            super()._put(key, value, expires)
+
+    memory = MemoryCacheBackend(1024 * 1024)
+    cache = ResultCache("calculation", [memory, RecordingSQLiteCacheBackend(tmp_path / "cache.sqlite3")])
+
+    async def use_cache():
+        loop_thread = threading.get_ident()
+        missed = await cache.get_async("key")
+        await cache.put_async("key", {"value": 1})
+        memory.clear()
+        return loop_thread, missed, await cache.get_async("key"), await cache.get_async("key")
+
+    loop_thread, missed, shared_hit, memory_hit = asyncio.run(use_cache())
+
+    assert missed is None
+    assert shared_hit == memory_hit == {"value": 1}
+    # a miss, a write and a hit in the shared tier, none of them on the event loop; the last lookup hit memory
+    assert len(threads) == 3
+    assert loop_thread not in threads
+    assert cache.stats()["tiers"]["memory"]["hits"] == 1
+
+
+def test_chart_responses_are_shared(tmp_path):
+    def worker_store():
+        shared_cache = ResultCache("chart", [SQLiteCacheBackend(tmp_path / "cache.sqlite3")])
+        return ChartDataStore(settings.chart_data_directory, shared_cache=shared_cache)
+
+    first_worker, second_worker = worker_store(), worker_store()
+    arguments = ("cole-nine-centiles", "uk-who", "male", "height", "columnar", 1, 4, 20)
+
+    first_payload = first_worker.sliced_payload(*arguments)
+    second_payload = second_worker.sliced_payload(*arguments)
+
+    assert second_payload.body == first_payload.body
+    assert second_worker.shared_cache.stats()["hits"] == 1
+    # the second worker did not need to read the chart data file
+    assert second_worker.memory_footprint()["loaded_files"] == 0
@@ -0,0 +1,125 @@
+"""
+Tests for chart coordinates generated from the LMS index
+"""
+# standard imports
+import json
+
+# third party imports
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from rcpchgrowth import constants
+from rcpchgrowth.global_functions import measurement_from_sds
+from schemas import ChartCoordinateRequest
+from services import settings
+from services.chart_curves import chart_lines, ChartCurves, line_ages
+from services.chart_data_store import columnar_chart_data
+
+client = TestClient(app)
+
+
+def lines_by_table(content, sex, measurement_method):
+    return {name: tables[sex][measurement_method] for table in (
+        content if isinstance(content, list) else [content]) for name, tables in table.items()}
+
+
+@pytest.mark.parametrize(
+    "centile_format", [constants.COLE_TWO_THIRDS_SDS_NINE_CENTILES, constants.THREE_PERCENT_CENTILES])
+@pytest.mark.parametrize("reference, sex, measurement_method", [
+    (constants.UK_WHO, "male", "height"),
+    (constants.UK_WHO, "female", "bmi"),
+    (constants.TRISOMY_21, "female", "weight"),
+    (constants.TURNERS, "female", "height"),
+])
+def test_standard_formats_match_the_chart_data_files(centile_format, reference, sex, measurement_method):
+    path = settings.chart_data_directory / f"{centile_format}-{reference}-{sex}-{measurement_method}.json"
+    stored = lines_by_table(columnar_chart_data(json.loads(path.read_text())), sex, measurement_method)
+    generated = lines_by_table(chart_lines(reference, sex, measurement_method, centile_format), sex, measurement_method)
+
+    assert list(generated) == list(stored)
+    for name, lines in generated.items():
+        assert len(lines) == len(stored[name])
+        for line, stored_line in zip(lines, stored[name]):
+            assert (line["centile"], line["sds"]) == (stored_line["centile"], stored_line["sds"])
+            # rcpchgrowth now adds a point at the last age of each table, which the files predate
+            assert line["x"][:len(stored_line["x"])] == stored_line["x"]
+            for y, stored_y in zip(line["y"], stored_line["y"]):
+                if y is not None:
+                    assert y == pytest.approx(stored_y, abs=1e-4)
+
+
+def test_custom_sds_and_points_per_year():
+    content = chart_lines(constants.UK_WHO, "female", "height", sds=[-1.5, 0, 3.25], points_per_year=4)
+    lines = lines_by_table(content, "female", "height")["uk90_child"]
+
+    assert [line["sds"] for line in lines] == [-1.5, 0, 3.25]
+    assert [line["centile"] for line in lines] == [6.6807, 50, 99.9423]
+    assert np.allclose(np.diff(lines[0]["x"][:-1]), 0.25, atol=1e-4)
+    assert lines[0]["x"][0] == 4 and lines[0]["x"][-1] == 20
+    assert lines[2]["y"][8] == pytest.approx(measurement_from_sds(constants.UK_WHO, 3.25, "height", "female", 6.0))
+
+
+def test_line_ages():
+    assert line_ages(1, 2, 4).tolist() == [1, 1.25, 1.5, 1.75, 2]
+    assert line_ages(1, 2.1, 4).tolist() == [1, 1.25, 1.5, 1.75, 2, 2.1]
+    ages = line_ages(0, 4)
+    assert ages[1] == pytest.approx(7 / 365.25)
+    assert ages[-2] - ages[-3] == pytest.approx(1 / 12)
+    assert ages[-1] == 4
+
+
+def test_responses_are_cached_up_to_the_cache_size():
+    curves = ChartCurves(cache_size=2)
+    requests = [
+        ChartCoordinateRequest(sex="male", measurement_method="ofc", centiles=[centile]) for centile in (5, 50, 95)]
+
+    first = curves.payload(constants.TRISOMY_21, requests[0])
+    assert curves.payload(constants.TRISOMY_21, requests[0]) is first
+    curves.payload(constants.TRISOMY_21, requests[1])
+    curves.payload(constants.TRISOMY_21, requests[2])
+
+    assert curves.memory_footprint()["responses"] == 2
+    assert curves.payload(constants.TRISOMY_21, requests[0]) is not first
+
+
+def test_custom_lines_are_cached_once_for_every_centile_format():
+    curves = ChartCurves()
+    payloads = [curves.payload(constants.TRISOMY_21, ChartCoordinateRequest(
+        sex="male", measurement_method="ofc", sds=[0], centile_format=centile_format))
+        for centile_format in (constants.COLE_TWO_THIRDS_SDS_NINE_CENTILES, constants.THREE_PERCENT_CENTILES)]
+
+    assert payloads[0] is payloads[1]
+    assert curves.memory_footprint()["responses"] == 1
+
+
+def test_chart_coordinates_for_custom_centiles():
+    response = client.post("/uk-who/chart-coordinates", json={
+        "sex": "male", "measurement_method": "weight", "centiles": [10, 90], "format": "columnar", "min_age": 2,
+        "max_age": 3})
+
+    assert response.status_code == 200
+    lines = lines_by_table(response.json()["centile_data"], "male", "weight")
+    assert [line["centile"] for line in lines["uk_who_child"]] == [10, 90]
+    assert lines["uk_who_child"][0]["x"][0] <= 2 and lines["uk_who_child"][0]["x"][-1] >= 3
+
+    etag = response.headers["etag"]
+    response = client.post("/uk-who/chart-coordinates", headers={"If-None-Match": etag}, json={
+        "sex": "male", "measurement_method": "weight", "centiles": [10, 90], "format": "columnar", "min_age": 2,
+        "max_age": 3})
+    assert response.status_code == 304
+
+
+def test_invalid_custom_chart_requests():
+    request = {"sex": "female", "measurement_method": "height"}
+
+    assert client.post("/turner/chart-coordinates", json=dict(request, centiles=[1], sds=[1])).status_code == 422
+    assert client.post("/turner/chart-coordinates", json=dict(request, centiles=[100])).status_code == 422
+    assert client.post("/turner/chart-coordinates", json=dict(request, sds=list(range(21)))).status_code == 422
+    assert client.post("/turner/chart-coordinates", json=dict(request, sds=[40, -40])).status_code == 422
+    assert client.post("/turner/chart-coordinates", json=dict(request, points_per_year=0)).status_code == 422
+    assert client.post("/turner/chart-coordinates", json=dict(request, points_per_year=12)).status_code == 200
+    assert client.post("/trisomy-21/chart-coordinates", json=dict(request, measurement_method="weight", sds=[0])
+                       ).status_code == 200
@@ -0,0 +1,95 @@
+"""
+Tests for the binary chart data format
+"""
+# standard imports
+import json
+
+# third party imports
+import pytest
+
+# local / rcpch imports
+from services.chart_data_binary import BinaryChartData, convert_json_file
+from services.chart_data_store import ChartDataStore, columnar_chart_data
+
+CHART_DATA_FIXTURES = [
+    'tests/test_data/test_uk_who_male_height_valid.json',
+    'tests/test_data/test_trisomy_21_male_height_valid.json',
+    'tests/test_data/test_turner_female_height_valid.json',
+]
+
+
+@pytest.mark.parametrize("fixture", CHART_DATA_FIXTURES)
+@pytest.mark.parametrize("dtype, precision", [("d", None), ("f", 4)])
+def test_binary_chart_data_round_trip(tmp_path, fixture, dtype, precision):
+    binary_path = tmp_path / 'chart.cbin'
+    binary_size = convert_json_file(fixture, binary_path, dtype=dtype, precision=precision)
+
+    with open(fixture, 'r') as file:
+        chart_data_file = file.read()
+
+    # the fixtures are compact JSON, so the rebuilt data must serialize to exactly the same text
+    chart_data = BinaryChartData(binary_path)
+    rebuilt = json.dumps(chart_data.to_json_content(), separators=(',', ':'))
+    chart_data.close()
+
+    assert rebuilt == chart_data_file
+    assert binary_size < len(chart_data_file)
+
+
+def test_converting_over_a_mapped_file_leaves_the_mapping_intact(tmp_path):
+    binary_path = tmp_path / 'chart.cbin'
+    convert_json_file(CHART_DATA_FIXTURES[1], binary_path)
+    mapped = BinaryChartData(binary_path)
+    content = mapped.to_json_content()
+
+    # the new file replaces the old one, rather than being written into the pages already mapped
+    convert_json_file(CHART_DATA_FIXTURES[0], binary_path)
+
+    assert mapped.to_json_content() == content
+    with open(CHART_DATA_FIXTURES[0], 'r') as file:
+        assert BinaryChartData(binary_path).to_json_content() == json.load(file)
+    assert [path.name for path in tmp_path.iterdir()] == ['chart.cbin']
+    mapped.close()
+
+
+def test_binary_chart_data_columns(tmp_path):
+    binary_path = tmp_path / 'chart.cbin'
+    convert_json_file(CHART_DATA_FIXTURES[0], binary_path)
+
+    with open(CHART_DATA_FIXTURES[0], 'r') as file:
+        first_line = json.load(file)[0]["uk90_preterm"]["male"]["height"][0]
+
+    chart_data = BinaryChartData(binary_path)
+    x, y = chart_data.columns(0)
+
+    assert list(x) == [point["x"] for point in first_line["data"]]
+    assert list(y) == [point["y"] for point in first_line["data"]]
+    del x, y
+    chart_data.close()
+
+
+def test_binary_chart_data_columnar_content(tmp_path):
+    binary_path = tmp_path / 'chart.cbin'
+    convert_json_file(CHART_DATA_FIXTURES[0], binary_path)
+
+    with open(CHART_DATA_FIXTURES[0], 'r') as file:
+        chart_data = json.load(file)
+
+    binary_chart_data = BinaryChartData(binary_path)
+
+    assert binary_chart_data.to_columnar_content() == columnar_chart_data(chart_data)
+    binary_chart_data.close()
+
+
+def test_chart_data_store_serves_binary_files(tmp_path):
+    convert_json_file(
+        CHART_DATA_FIXTURES[0], tmp_path / 'cole-nine-centiles-uk-who-male-height.cbin')
+    store = ChartDataStore(tmp_path, storage_format="binary")
+
+    with open(CHART_DATA_FIXTURES[0], 'r') as file:
+        chart_data_file = file.read()
+
+    payload = store.payload("cole-nine-centiles", "uk-who", "male", "height")
+
+    assert payload.body == ('{"centile_data":' + chart_data_file + '}').encode('utf-8')
+    assert store.memory_footprint()["mapped_bytes"] > 0
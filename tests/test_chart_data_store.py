@@ -0,0 +1,105 @@
+"""
+Tests for the in-memory chart data store and its admin endpoints
+"""
+# standard imports
+import json
+import shutil
+
+# third party imports
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from services import settings
+from services.chart_data_binary import convert_json_file
+from services.chart_data_store import ChartDataStore
+from services.encoded_payload import available_encodings
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def store(tmp_path):
+    # a store reading from a temporary directory holding a single chart data file
+    shutil.copy(
+        'chart-data/cole-nine-centiles-uk-who-male-height.json',
+        tmp_path / 'cole-nine-centiles-uk-who-male-height.json'
+    )
+    return ChartDataStore(tmp_path)
+
+
+def test_chart_data_is_read_from_disk_once(store):
+    first = store.get("cole-nine-centiles", "uk-who", "male", "height")
+    second = store.get("cole-nine-centiles", "uk-who", "male", "height")
+
+    # the second request is served from memory, so it is the same object
+    assert first is second
+    with open(r'tests/test_data/test_uk_who_male_height_valid.json', 'r') as file:
+        assert first == json.load(file)
+
+
+def test_chart_data_missing_file(store):
+    with pytest.raises(FileNotFoundError):
+        store.get("cole-nine-centiles", "uk-who", "female", "height")
+
+
+def test_chart_data_memory_footprint_and_reload(store):
+    assert store.memory_footprint()["loaded_files"] == 0
+
+    first = store.get("cole-nine-centiles", "uk-who", "male", "height")
+    footprint = store.memory_footprint()
+    assert footprint["loaded_files"] == 1
+    assert footprint["total_bytes"] > 0
+
+    # reloading reads the file again, so the data is a new object with the same content
+    assert store.reload()["loaded_files"] == 1
+    reloaded = store.get("cole-nine-centiles", "uk-who", "male", "height")
+    assert reloaded is not first
+    assert reloaded == first
+
+
+def test_reload_unmaps_binary_files(store):
+    key = ("cole-nine-centiles", "uk-who", "male", "height")
+    convert_json_file(store.json_path_for(*key), store.directory / f'{"-".join(key)}.cbin')
+    store = ChartDataStore(store.directory, "binary")
+    first = store.source(*key)
+    content = store.get(*key)
+
+    store.reload()
+
+    assert first._mmap.closed
+    assert store.source(*key) is not first
+    assert store.get(*key) == content
+
+
+@pytest.mark.parametrize("storage_format", ["json", "binary"])
+def test_preload_builds_every_compressed_body(store, storage_format):
+    key = ("cole-nine-centiles", "uk-who", "male", "height")
+    if storage_format == "binary":
+        convert_json_file(store.json_path_for(*key), store.directory / f'{"-".join(key)}.cbin')
+        store = ChartDataStore(store.directory, storage_format)
+
+    assert store.preload() == 1
+    # nothing is left to compress on the first request
+    assert set(store.payload(*key)._variants) == set(available_encodings())
+
+
+def test_admin_endpoints_disabled_without_key(monkeypatch):
+    monkeypatch.setattr(settings, "admin_api_key", None)
+
+    response = client.post("/admin/chart-data/reload", headers={"X-Admin-Key": "anything"})
+
+    assert response.status_code == 404
+
+
+def test_admin_chart_data_reload(monkeypatch):
+    monkeypatch.setattr(settings, "admin_api_key", "test-admin-key")
+
+    assert client.post("/admin/chart-data/reload", headers={"X-Admin-Key": "wrong-key"}).status_code == 403
+
+    client.post("/uk-who/chart-coordinates", json={"measurement_method": "height", "sex": "male"})
+    response = client.post("/admin/chart-data/reload", headers={"X-Admin-Key": "test-admin-key"})
+
+    assert response.status_code == 200
+    assert "cole-nine-centiles-uk-who-male-height" in response.json()["files"]
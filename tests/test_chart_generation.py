@@ -0,0 +1,160 @@
+"""
+Tests for generating missing chart data files
+"""
+# standard imports
+import json
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+# third party imports
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from rcpchgrowth import chart_functions
+from services import chart_data_generator
+from services import chart_generation
+from services.chart_data_store import ChartDataStore
+from services.chart_generation import ChartDataGenerator, generate_chart_data
+from services.file_locks import try_lock
+
+KEYS = [
+    ("cole-nine-centiles", "uk-who", "male", "height"),
+    ("three-percent-centiles", "trisomy-21", "female", "bmi"),
+]
+
+
+@pytest.fixture
+def create_chart(monkeypatch):
+    calls = []
+
+    def create_chart(reference, measurement_method, sex, centile_format):
+        calls.append((centile_format, reference, sex, measurement_method))
+        time.sleep(0.05)
+        return {"centile_format": centile_format, "reference": reference, "sex": sex,
+                "measurement_method": measurement_method}
+
+    monkeypatch.setattr("services.chart_generation.chart_functions.create_chart", create_chart)
+    return calls
+
+
+def test_generate_chart_data(create_chart, tmp_path):
+    store = ChartDataStore(tmp_path)
+
+    results = dict(generate_chart_data(store, KEYS, 1))
+
+    assert results == {key: None for key in KEYS}
+    for key in KEYS:
+        with open(store.json_path_for(*key)) as file:
+            assert json.load(file)["reference"] == key[1]
+    # nothing is left behind under a temporary name
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(store.json_path_for(*key).name for key in KEYS)
+
+
+def test_generate_chart_data_in_worker_processes(tmp_path):
+    # the worker processes are spawned, so do not see a patched create_chart: rcpchgrowth generates the files
+    store = ChartDataStore(tmp_path)
+    keys = [(centile_format, "turners-syndrome", "female", "height")
+            for centile_format in ("cole-nine-centiles", "three-percent-centiles")]
+
+    assert dict(generate_chart_data(store, keys, 2)) == {key: None for key in keys}
+    for centile_format, reference, sex, measurement_method in keys:
+        expected = chart_functions.create_chart(
+            reference, centile_format=centile_format, measurement_method=measurement_method, sex=sex)
+        path = store.json_path_for(centile_format, reference, sex, measurement_method)
+        assert json.loads(path.read_text()) == json.loads(json.dumps(expected))
+
+
+def test_missing_file_is_generated_once_on_first_request(create_chart, tmp_path):
+    store = ChartDataStore(tmp_path, generate_missing=True)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(store.get(*KEYS[0])["sex"])) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["male"] * 4
+    assert create_chart == [KEYS[0]]
+
+
+def test_missing_file_is_not_generated_when_turned_off(create_chart, tmp_path):
+    store = ChartDataStore(tmp_path)
+
+    with pytest.raises(FileNotFoundError):
+        store.get(*KEYS[0])
+    assert create_chart == []
+
+
+def test_generator_reports_progress(create_chart, tmp_path):
+    store = ChartDataStore(tmp_path)
+    store.generate(KEYS[0])
+    generator = ChartDataGenerator(store, lambda: KEYS, workers=1)
+
+    assert generator.ready
+    generator.start()
+    assert not generator.ready
+    generator.join()
+
+    assert generator.status() == {
+        "state": "ready", "missing_files": 1, "generated_files": 1, "failed_files": {}}
+    assert create_chart == [KEYS[0], KEYS[1]]
+
+
+def test_generator_is_ready_when_generation_stops(create_chart, tmp_path, monkeypatch):
+    def broken_pool(store, keys, workers=None):
+        yield keys[0], None
+        raise BrokenProcessPool("A process in the process pool was terminated abruptly.")
+
+    monkeypatch.setattr(chart_generation, "generate_chart_data", broken_pool)
+    generator = ChartDataGenerator(ChartDataStore(tmp_path), lambda: KEYS, workers=2)
+    generator.run()
+
+    assert generator.ready
+    assert generator.status()["state"] == "ready"
+    assert list(generator.status()["failed_files"]) == ["-".join(key) for key in KEYS]
+
+
+def test_generator_waits_for_another_process_generating(create_chart, tmp_path):
+    store = ChartDataStore(tmp_path)
+    generator = ChartDataGenerator(store, lambda: KEYS, workers=1)
+    generator.lock_poll_interval = 0.01
+    other_process = try_lock(generator.lock_path)
+
+    generator.start()
+    for _ in range(200):
+        if generator.state == "waiting":
+            break
+        time.sleep(0.01)
+    assert generator.state == "waiting" and not generator.ready
+    for key in KEYS:
+        store.generate(key)
+    created = list(create_chart)
+    other_process.close()
+    generator.join()
+
+    assert generator.status() == {
+        "state": "ready", "missing_files": 0, "generated_files": 0, "failed_files": {}}
+    assert create_chart == created
+
+
+def test_readiness(monkeypatch):
+    client = TestClient(app)
+
+    assert client.get("/health/live").json() == {"status": "live"}
+
+    monkeypatch.setattr(chart_data_generator, "state", "generating")
+    response = client.get("/health/ready")
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
+
+    monkeypatch.setattr(chart_data_generator, "state", "ready")
+    response = client.get("/health/ready")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
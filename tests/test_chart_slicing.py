@@ -0,0 +1,45 @@
+"""
+Tests for slicing and downsampling chart coordinate lines
+"""
+# standard imports
+import math
+
+# local / rcpch imports
+from services.chart_slicing import age_window, largest_triangle_three_buckets, select_points
+
+
+def test_age_window_includes_neighbouring_points():
+    x = [0, 0.5, 1, 1.5, 2, 2.5, 3]
+
+    assert age_window(x) == (0, 7)
+    assert age_window(x, min_age=1, max_age=2) == (1, 6)
+    assert age_window(x, min_age=1.2, max_age=1.8) == (2, 5)
+    assert age_window(x, min_age=3) == (5, 7)
+    # a line entirely outside the window has no points in it
+    assert age_window(x, min_age=10) == (0, 0)
+    assert age_window(x, max_age=-1) == (0, 0)
+    assert age_window([], min_age=1) == (0, 0)
+
+
+def test_largest_triangle_three_buckets_keeps_ends_and_peak():
+    x = [index / 100 for index in range(1000)]
+    y = [math.sin(value) for value in x]
+    y[503] = 50  # a spike must survive downsampling
+
+    indices = largest_triangle_three_buckets(x, y, 50)
+
+    assert len(indices) == 50
+    assert indices[0] == 0
+    assert indices[-1] == 999
+    assert 503 in indices
+    assert indices == sorted(indices)
+
+
+def test_select_points_drops_missing_values_when_downsampling():
+    x = list(range(100))
+    y = [float(value) for value in range(99)] + [None]
+
+    indices = select_points(x, y, max_points=10)
+
+    assert len(indices) == 10
+    assert 99 not in indices
@@ -0,0 +1,197 @@
+"""
+Tests for synthetic cohort generation
+"""
+# standard imports
+import io
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# third party imports
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from benchmarks.load import replay_traffic
+from main import app
+from schemas import CohortRequest
+from services import job_runner, job_store, settings
+from services.cohorts import cohort_columns, write_cohort
+from services.jobs import calculate_rows
+
+
+ADMIN_KEY = {"X-Admin-Key": "test-admin-key"}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_store, "directory", tmp_path)
+    monkeypatch.setattr(job_runner, "workers", 2)
+    monkeypatch.setattr(settings, "admin_api_key", "test-admin-key")
+    with TestClient(app) as client:
+        client.headers.update(ADMIN_KEY)
+        yield client
+
+
+def wait_for_job(client, job_id):
+    for _ in range(400):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ["complete", "failed"]:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def cohort_parameters(**parameters):
+    return CohortRequest(**dict({"number_of_children": 60, "seed": 7}, **parameters)).dict()
+
+
+def test_cohort_is_the_same_however_it_is_chunked():
+    parameters = cohort_parameters(noise=True)
+    whole = cohort_columns(parameters, 7, 0, 60)
+    chunks = [cohort_columns(parameters, 7, first, first + 20) for first in range(0, 60, 20)]
+
+    for column, values in whole.items():
+        np.testing.assert_array_equal(values, np.concatenate([chunk[column] for chunk in chunks]))
+    assert "chronological_sds" not in whole
+
+
+def test_cohort_mixes_references_sexes_methods_and_gestations():
+    columns = cohort_columns(cohort_parameters(reference_weights={"uk-who": 1, "turners-syndrome": 1}), 7, 0, 60)
+    children = {
+        child: (reference, sex, method, weeks, days) for child, reference, sex, method, weeks, days in zip(
+            columns["child"], columns["reference"], columns["sex"], columns["measurement_method"],
+            columns["gestation_weeks"], columns["gestation_days"])
+    }
+
+    assert {reference for reference, *_ in children.values()} == {"uk-who", "turners-syndrome"}
+    assert {sex for _, sex, *_ in children.values()} == {"male", "female"}
+    assert {method for _, _, method, *_ in children.values()} == {"height", "weight", "ofc", "bmi"}
+    assert all(24 <= weeks <= 41 and 0 <= days <= 6 for *_, weeks, days in children.values())
+    # Turner's syndrome data is only for girls' heights
+    assert all(
+        (sex, method) == ("female", "height")
+        for reference, sex, method, *_ in children.values() if reference == "turners-syndrome")
+
+
+def test_fixed_parameters_are_kept():
+    columns = cohort_columns(cohort_parameters(
+        reference="trisomy-21", sex="male", measurement_method="weight", gestation_weeks=30, gestation_days=2), 7, 0, 5)
+
+    assert set(columns["reference"]) == {"trisomy-21"}
+    assert set(columns["sex"]) == {"male"}
+    assert set(columns["measurement_method"]) == {"weight"}
+    assert set(columns["gestation_weeks"]) == {30} and set(columns["gestation_days"]) == {2}
+
+
+def test_mixed_cohorts_of_boys_have_no_turner_children():
+    columns = cohort_columns(
+        cohort_parameters(sex="male", reference_weights={"uk-who": 1, "turners-syndrome": 1}), 7, 0, 60)
+
+    assert set(columns["reference"]) == {"uk-who"}
+    assert set(columns["sex"]) == {"male"}
+
+
+def test_write_cohort_in_worker_processes(tmp_path):
+    parameters = cohort_parameters(include_calculated=True)
+    progress = []
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        rows = write_cohort(
+            parameters, 7, tmp_path / "cohort.ndjson", executor, 2,
+            lambda children, rows: progress.append(children), chunk_rows=200)
+
+    lines = [json.loads(line) for line in (tmp_path / "cohort.ndjson").read_text().splitlines()]
+    expected = cohort_columns(parameters, 7, 0, 60)
+
+    assert rows == len(lines) == len(expected["child"])
+    assert progress[-1] == 60 and len(progress) > 1
+    assert [line["child"] for line in lines] == expected["child"].tolist()
+    assert lines[0]["chronological_sds"] == pytest.approx(expected["chronological_sds"][0])
+    assert not (tmp_path / "cohort.ndjson.part").exists()
+
+
+def test_cohort_job_result_is_a_bulk_calculation_job(client):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    response = client.post("/jobs/cohorts", json={"number_of_children": 20, "seed": 3, "output_format": "parquet"})
+
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["job_id"])
+
+    assert job["status"] == "complete"
+    assert job["children_processed"] == job["children_total"] == 20
+    assert job["rows_processed"] == job["rows_total"] > 0
+
+    response = client.get(f"/jobs/{job['job_id']}/result")
+    cohort = response.content
+
+    assert response.headers["content-type"] == "application/vnd.apache.parquet"
+    assert pyarrow.parquet.read_table(io.BytesIO(cohort)).num_rows == job["rows_total"]
+
+    # without a reference parameter, each row is calculated against its own reference
+    response = client.post("/jobs", data=cohort, headers={"Content-Type": "application/vnd.apache.parquet"})
+    calculated = wait_for_job(client, response.json()["job_id"])
+    result = pyarrow.parquet.read_table(io.BytesIO(client.get(f"/jobs/{calculated['job_id']}/result").content))
+    expected = cohort_columns(CohortRequest(number_of_children=20, seed=3, include_calculated=True).dict(), 3, 0, 20)
+
+    assert calculated["status"] == "complete"
+    np.testing.assert_allclose(result.column("chronological_sds").to_numpy(zero_copy_only=False),
+                               expected["chronological_sds"], rtol=1e-9)
+
+
+def test_ndjson_cohort_job_and_replay(client, tmp_path):
+    response = client.post("/jobs/cohorts", json={"number_of_children": 4, "seed": 1, "reference": "uk-who"})
+    job = wait_for_job(client, response.json()["job_id"])
+    response = client.get(f"/jobs/{job['job_id']}/result")
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    path = tmp_path / "cohort.ndjson"
+    path.write_bytes(response.content)
+    request_path, body = next(replay_traffic(path))
+
+    assert request_path == "/uk-who/calculation"
+    assert client.post(request_path, json=body).status_code == 200
+
+
+def test_invalid_cohort_requests(client, monkeypatch):
+    monkeypatch.setattr(settings, "max_cohort_children", 10)
+
+    assert client.post("/jobs/cohorts", json={"number_of_children": 11}).status_code == 413
+    monkeypatch.setattr(settings, "max_cohort_rows", 1)
+    assert client.post("/jobs/cohorts", json={"number_of_children": 2}).status_code == 413
+    assert client.post("/jobs/cohorts", json={"measurement_interval_number": 0}).status_code == 422
+    assert client.post("/jobs/cohorts", json={"reference_weights": {"uk-who": 0}}).status_code == 422
+    assert client.post("/jobs/cohorts", json={"reference_weights": {"invalid": 1}}).status_code == 422
+    # Turner's syndrome data is only for girls' heights
+    assert client.post("/jobs/cohorts", json={"reference": "turners-syndrome", "sex": "male"}).status_code == 422
+    assert client.post(
+        "/jobs/cohorts", json={"reference": "turners-syndrome", "measurement_method": "weight"}).status_code == 422
+    assert client.post("/jobs/cohorts", json={
+        "measurement_method": "bmi", "reference_weights": {"turners-syndrome": 1}}).status_code == 422
+
+
+def test_cohorts_need_the_admin_key(client, monkeypatch):
+    assert client.post("/jobs/cohorts", json={}, headers={"X-Admin-Key": "wrong-key"}).status_code == 403
+    monkeypatch.setattr(settings, "admin_api_key", None)
+    assert client.post("/jobs/cohorts", json={}).status_code == 404
+
+
+def test_missing_pyarrow_is_reported_for_parquet_cohorts(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    with pytest.raises(ImportError, match="Parquet files need pyarrow"):
+        write_cohort(cohort_parameters(output_format="parquet"), 7, tmp_path / "cohort.parquet", None, 1)
+
+
+def test_rows_with_an_unknown_reference():
+    row = {"birth_date": "2020-04-12", "observation_date": "2028-06-12", "sex": "female",
+           "measurement_method": "height", "observation_value": 115}
+
+    calculated = calculate_rows(None, [dict(row, reference="uk-who"), dict(row, reference="invalid"), row])
+
+    assert calculated[0]["errors"] is None and calculated[0]["chronological_sds"] is not None
+    assert calculated[1]["errors"].startswith("reference: unexpected value")
+    assert calculated[2]["errors"].startswith("reference: unexpected value")
@@ -0,0 +1,82 @@
+"""
+Tests for the calculation executor backends
+"""
+# standard imports
+import asyncio
+import threading
+
+# third party imports
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from services import calculation_executor
+from services.executor import CalculationExecutor, ExecutorSaturated
+from services.result_cache import ResultCache
+
+BODY = {
+    "birth_date": "2020-04-12",
+    "observation_date": "2028-06-12",
+    "observation_value": 115,
+    "sex": "female",
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_method": "height"
+}
+
+
+def test_process_backend_matches_threadpool(monkeypatch):
+    expected = TestClient(app).post("/uk-who/calculation", json=BODY).json()
+
+    executor = CalculationExecutor("process", workers=2)
+    monkeypatch.setattr("routers.ukwho.calculation_executor", executor)
+    executor.start()
+    try:
+        client = TestClient(app)
+        response = client.post("/uk-who/calculation", json=BODY)
+        batch_response = client.post("/uk-who/calculations", json=[BODY, dict(BODY, sex="invalid_sex")])
+    finally:
+        executor.stop()
+
+    assert response.status_code == 200
+    assert response.json() == expected
+    assert batch_response.json()[0]["calculation"] == expected
+    assert batch_response.json()[1]["errors"][0]["loc"] == ["sex"]
+
+
+@pytest.mark.parametrize("url", ["/uk-who/calculation", "/turner/calculation", "/trisomy-21/calculation"])
+def test_saturated_executor_returns_503(monkeypatch, url):
+    monkeypatch.setattr(calculation_executor, "max_pending", 0)
+    # a cached result would be returned without using the executor
+    monkeypatch.setattr("services.calculation.result_cache", ResultCache("calculation", []))
+
+    response = TestClient(app).post(url, json=BODY)
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+def test_executor_bounds_pending_calculations():
+    executor = CalculationExecutor("threadpool", max_pending=1)
+    release = threading.Event()
+
+    async def run():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(ExecutorSaturated):
+            await executor.run(release.wait)
+        release.set()
+        await first
+        # once the backlog clears calculations are accepted again
+        return await executor.run(lambda: "accepted")
+
+    assert asyncio.run(run()) == "accepted"
+    assert executor.pending == 0
+
+
+def test_inline_backend_is_not_bounded():
+    executor = CalculationExecutor("inline", max_pending=1)
+    executor.pending = 5
+
+    assert asyncio.run(executor.run(sum, [1, 2])) == 3
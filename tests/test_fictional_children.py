@@ -0,0 +1,141 @@
+"""
+Tests for vectorised fictional child generation
+"""
+# standard imports
+import asyncio
+import json
+
+# third party imports
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from rcpchgrowth import constants, generate_fictional_child_data
+from services import fictional_child_rows, settings
+
+client = TestClient(app)
+
+PARAMETERS = {
+    "measurement_method": "height",
+    "sex": "female",
+    "start_chronological_age": 1,
+    "end_age": 20,
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_interval_type": "months",
+    "measurement_interval_number": 6,
+    "start_sds": -1.2,
+    "drift": False,
+    "drift_range": -0.05,
+    "noise": False,
+    "noise_range": 0.005,
+    "start_sds_spread": 0.0,
+}
+
+
+@pytest.mark.parametrize("reference, measurement_method, sex, gestation_weeks", [
+    (constants.UK_WHO, "weight", "male", 31),
+    (constants.UK_WHO, "height", "female", 40),
+    (constants.TURNERS, "height", "female", 40),
+    (constants.TRISOMY_21, "ofc", "male", 38),
+])
+def test_matches_rcpchgrowth_without_noise(reference, measurement_method, sex, gestation_weeks):
+    parameters = dict(
+        PARAMETERS, measurement_method=measurement_method, sex=sex, gestation_weeks=gestation_weeks,
+        start_chronological_age=0.1 if reference != constants.TURNERS else 1)
+    expected = generate_fictional_child_data(
+        **{name: value for name, value in parameters.items() if name != "start_sds_spread"}, reference=reference)
+    rows = fictional_child_rows(reference, parameters, 0, 1)
+
+    assert len(rows) == len(expected)
+    for row, measurement in zip(rows, expected):
+        dates = measurement["measurement_dates"]
+        values = measurement["measurement_calculated_values"]
+        assert row["observation_date"] == str(dates["observation_date"])
+        assert row["observation_value"] == measurement["child_observation_value"]["observation_value"]
+        assert row["corrected_decimal_age"] == pytest.approx(dates["corrected_decimal_age"], abs=1e-12)
+        assert row["corrected_sds"] == pytest.approx(values["corrected_sds"], abs=1e-9)
+        assert row["corrected_centile"] == values["corrected_centile"]
+        assert row["chronological_sds"] == pytest.approx(values["chronological_sds"], abs=1e-9)
+
+
+def test_drift_and_noise():
+    parameters = dict(PARAMETERS, drift=True, drift_range=-1.0, noise=True, noise_range=0.01)
+    rows = fictional_child_rows(constants.UK_WHO, parameters, 0, 1)
+    steady = fictional_child_rows(constants.UK_WHO, PARAMETERS, 0, 1)
+
+    assert rows[-1]["chronological_sds"] == pytest.approx(-2.2, abs=0.2)
+    assert any(row["observation_value"] != other["observation_value"] for row, other in zip(rows, steady))
+
+
+def test_seeded_children_are_repeatable_and_differ():
+    parameters = dict(PARAMETERS, noise=True, start_sds_spread=0.5)
+    first, second = (fictional_child_rows(constants.UK_WHO, parameters, child, 42) for child in (0, 1))
+
+    assert fictional_child_rows(constants.UK_WHO, parameters, 0, 42) == first
+    assert [row["observation_value"] for row in first] != [row["observation_value"] for row in second]
+    assert fictional_child_rows(constants.UK_WHO, parameters, 0, 43) != first
+
+
+def test_stream_endpoint():
+    body = dict(PARAMETERS, measurement_interval_type="days", measurement_interval_number=7, number_of_children=3,
+                noise=True, seed=5)
+    del body["start_sds_spread"]
+    response = client.post("/trisomy-21/fictional-child-data/stream", json=body)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["child"] for row in rows] == sorted(row["child"] for row in rows)
+    assert {row["child"] for row in rows} == {0, 1, 2}
+    assert all(row["reference"] == "trisomy-21" for row in rows)
+    assert client.post("/trisomy-21/fictional-child-data/stream", json=body).text == response.text
+
+
+def test_stream_endpoint_limits(monkeypatch):
+    monkeypatch.setattr(settings, "max_fictional_children", 2)
+    body = dict(PARAMETERS, number_of_children=3)
+
+    assert client.post("/uk-who/fictional-child-data/stream", json=body).status_code == 413
+    # 2 children of 38 measurements each
+    monkeypatch.setattr(settings, "max_fictional_child_rows", 75)
+    body = dict(PARAMETERS, number_of_children=2)
+    assert client.post("/trisomy-21/fictional-child-data/stream", json=body).status_code == 413
+    monkeypatch.setattr(settings, "max_fictional_child_rows", 76)
+    assert client.post("/trisomy-21/fictional-child-data/stream", json=body).status_code == 200
+    body = dict(PARAMETERS, measurement_interval_number=0)
+    assert client.post("/turner/fictional-child-data/stream", json=body).status_code == 422
+    body = dict(PARAMETERS, start_chronological_age=10, end_age=5)
+    assert client.post("/uk-who/fictional-child-data/stream", json=body).status_code == 422
+    body = dict(PARAMETERS, sex="male")
+    assert client.post("/turner/fictional-child-data/stream", json=body).status_code == 422
+    assert client.post("/turner/fictional-child-data/stream", json=dict(body, sex="female")).status_code == 200
+
+
+def test_stream_stops_when_the_client_disconnects(monkeypatch):
+    monkeypatch.setattr(settings, "max_fictional_child_rows", 10 ** 7)
+    body = json.dumps(dict(PARAMETERS, number_of_children=1000, measurement_interval_type="days")).encode()
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/uk-who/fictional-child-data/stream",
+        "raw_path": b"/uk-who/fictional-child-data/stream", "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("testclient", 50000), "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # the client has gone as soon as the response starts
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+
+    assert sent[0]["status"] == 200
+    assert len([message for message in sent if message.get("body")]) < 1000
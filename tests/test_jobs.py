@@ -0,0 +1,204 @@
+"""
+Tests for the bulk calculation jobs endpoints
+"""
+# standard imports
+import csv
+import io
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+# third party imports
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from services import job_runner, job_store, settings
+from services.jobs import JobRunner, JobStore
+
+CSV_HEADER = "id,birth_date,observation_date,sex,gestation_weeks,gestation_days,observation_value\n"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_store, "directory", tmp_path)
+    monkeypatch.setattr(job_runner, "workers", 2)
+    monkeypatch.setattr(job_runner, "chunk_size", 3)
+    monkeypatch.setattr(settings, "admin_api_key", "test-admin-key")
+    # entering the client runs the startup events, which start the job runner
+    with TestClient(app) as client:
+        client.headers.update({"X-Admin-Key": "test-admin-key"})
+        yield client
+
+
+def wait_for_job(client, job_id):
+    for _ in range(200):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ["complete", "failed"]:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_csv_job(client):
+    body = CSV_HEADER + "".join(
+        f"{index},2020-04-12,2028-06-12,female,40,0,{110 + index}\n" for index in range(8)
+    ) + "8,2020-04-12,2028-06-12,invalid_sex,,,115\n"
+
+    response = client.post(
+        "/jobs?reference=uk-who&measurement_method=height", data=body, headers={"Content-Type": "text/csv"})
+
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["job_id"])
+
+    assert job["status"] == "complete"
+    assert job["rows_processed"] == job["rows_total"] == 9
+
+    response = client.get(f"/jobs/{job['job_id']}/result")
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    single_response = client.post("/uk-who/calculation", json={
+        "birth_date": "2020-04-12",
+        "observation_date": "2028-06-12",
+        "observation_value": 115,
+        "sex": "female",
+        "gestation_weeks": 40,
+        "gestation_days": 0,
+        "measurement_method": "height"
+    }).json()
+
+    # rows keep their order and original columns, with the same results as the calculation endpoint
+    assert [row["id"] for row in rows] == [str(index) for index in range(9)]
+    assert float(rows[5]["chronological_sds"]) == single_response["measurement_calculated_values"]["chronological_sds"]
+    assert float(rows[5]["corrected_centile"]) == single_response["measurement_calculated_values"]["corrected_centile"]
+    assert rows[5]["errors"] == ""
+    assert rows[8]["chronological_sds"] == ""
+    assert rows[8]["errors"].startswith("sex: ")
+
+    assert client.delete(f"/jobs/{job['job_id']}").status_code == 204
+    assert client.get(f"/jobs/{job['job_id']}").status_code == 404
+
+
+def test_parquet_job(client):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    table = pyarrow.Table.from_pylist([
+        {"birth_date": "2020-04-12", "observation_date": "2028-06-12", "sex": "female",
+         "measurement_method": "height", "observation_value": 110.0 + index}
+        for index in range(5)
+    ])
+    body = io.BytesIO()
+    pyarrow.parquet.write_table(table, body)
+
+    response = client.post(
+        "/jobs?reference=uk-who", data=body.getvalue(), headers={"Content-Type": "application/vnd.apache.parquet"})
+
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["job_id"])
+
+    assert job["status"] == "complete"
+
+    response = client.get(f"/jobs/{job['job_id']}/result")
+    result = pyarrow.parquet.read_table(io.BytesIO(response.content)).to_pylist()
+
+    assert len(result) == 5
+    assert result[0]["observation_value"] == 110.0
+    assert result[0]["chronological_sds"] < result[4]["chronological_sds"]
+
+
+def test_job_with_missing_columns(client):
+    response = client.post(
+        "/jobs?reference=uk-who", data=CSV_HEADER + "0,2020-04-12,2028-06-12,female,40,0,115\n",
+        headers={"Content-Type": "text/csv"})
+
+    job = wait_for_job(client, response.json()["job_id"])
+
+    # measurement_method is neither a column nor given as a parameter
+    assert job["status"] == "failed"
+    assert "measurement_method" in job["error"]
+    assert client.get(f"/jobs/{job['job_id']}/result").status_code == 409
+
+
+def test_job_with_invalid_request(client):
+    response = client.post("/jobs?reference=uk-who", json=[{}])
+
+    assert response.status_code == 415
+
+    response = client.post("/jobs?reference=invalid_reference", data=CSV_HEADER, headers={"Content-Type": "text/csv"})
+
+    assert response.status_code == 422
+    assert client.get("/jobs/not-a-job").status_code == 404
+
+
+def queue_csv_job(store, rows=3):
+    job = store.create("uk-who", "csv", "height")
+    store.input_path(job).write_text(CSV_HEADER + "".join(
+        f"{index},2020-04-12,2028-06-12,female,40,0,{110 + index}\n" for index in range(rows)))
+    return store.update(job, status="queued")
+
+
+def test_jobs_are_claimed_by_one_process(tmp_path):
+    # each store stands for a server worker process: the claim locks are held per open file, as across processes
+    first, second = JobStore(tmp_path), JobStore(tmp_path)
+    job = queue_csv_job(first)
+
+    assert first.next_queued()["job_id"] == job["job_id"]
+    assert second.next_queued() is None
+
+    # a job still being run by another process is not queued again
+    second.requeue_interrupted()
+    assert second.get(job["job_id"])["status"] == "running"
+    assert second.get(job["job_id"])["owner_pid"] == os.getpid()
+
+    # once that process has gone, its claim is released and the job is queued for the next runner
+    first.release(job["job_id"])
+    second.requeue_interrupted()
+    assert second.get(job["job_id"])["status"] == "queued"
+    assert second.next_queued()["job_id"] == job["job_id"]
+
+
+def test_runner_replaces_a_broken_process_pool(tmp_path):
+    store = JobStore(tmp_path)
+    runner = JobRunner(store, workers=1, chunk_size=2)
+    runner._executor = runner._new_executor()
+    # a worker process which dies breaks the pool
+    with pytest.raises(BrokenProcessPool):
+        runner._executor.submit(os._exit, 1).result()
+    failed, complete = queue_csv_job(store), queue_csv_job(store)
+    try:
+        for _ in range(2):
+            runner.run_job(store.next_queued())
+    finally:
+        runner._executor.shutdown()
+
+    assert store.get(failed["job_id"])["status"] == "failed"
+    assert store.get(complete["job_id"])["status"] == "complete"
+    # the worker processes are spawned, not forked from the server's threads
+    assert runner._executor._mp_context.get_start_method() == "spawn"
+
+
+def test_uploads_need_the_admin_key(client, monkeypatch):
+    headers = {"Content-Type": "text/csv", "X-Admin-Key": "wrong-key"}
+    assert client.post("/jobs?reference=uk-who", data=CSV_HEADER, headers=headers).status_code == 403
+    monkeypatch.setattr(settings, "admin_api_key", None)
+    headers["X-Admin-Key"] = "test-admin-key"
+    assert client.post("/jobs?reference=uk-who", data=CSV_HEADER, headers=headers).status_code == 404
+
+
+def test_upload_size_is_limited(client, monkeypatch):
+    monkeypatch.setattr(settings, "max_job_upload_bytes", len(CSV_HEADER) - 1)
+
+    response = client.post("/jobs?reference=uk-who", data=CSV_HEADER, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 413
+
+    def chunks():
+        yield CSV_HEADER[:10].encode()
+        yield CSV_HEADER[10:].encode()
+
+    # without a Content-Length, the upload is stopped once it is too long and nothing is kept
+    response = client.post("/jobs?reference=uk-who", data=chunks(), headers={"Content-Type": "text/csv"})
+    assert response.status_code == 413
+    assert job_store.jobs() == []
@@ -0,0 +1,106 @@
+"""
+Tests that fast JSON responses are byte for byte the same as FastAPI's
+"""
+# standard imports
+from datetime import date, datetime, timezone
+from enum import Enum
+
+# third party imports
+import numpy
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+# local / rcpch imports
+from main import app
+from rcpchgrowth import constants, generate_fictional_child_data, Measurement
+from services import json_response
+from services.json_response import encode_json, FastJSONResponse
+
+client = TestClient(app)
+
+
+class Colour(Enum):
+    RED = "red"
+
+
+class Point(BaseModel):
+    x: float
+    when: date
+
+
+def fastapi_body(content):
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def calculations():
+    for reference, sex in ((constants.UK_WHO, "male"), (constants.TURNERS, "female"), (constants.TRISOMY_21, "female")):
+        for measurement_method, value in (("height", 115), ("weight", 21.3), ("bmi", 16.2), ("ofc", 52.5)):
+            if reference == constants.TURNERS and measurement_method != "height":
+                continue
+            for observation_date in (date(2020, 4, 13), date(2020, 9, 1), date(2028, 6, 12)):
+                yield Measurement(
+                    reference=reference, birth_date=date(2020, 4, 12), observation_date=observation_date,
+                    measurement_method=measurement_method, observation_value=value, sex=sex,
+                    gestation_weeks=31, gestation_days=3).measurement
+
+
+EDGE_CASES = [
+    {"small": 1e-05, "negative_small": -2.5e-07, "tiny": 1.5e-10, "edge": 0.0001, "large": 1e16, "huge": 1.2e+300},
+    [numpy.float64(0.1), numpy.float64(1e-06), 10.00001, -0.0, 2.0, 1, True, None],
+    {"date": date(2020, 4, 12), "datetime": datetime(2020, 4, 12, 10, 30, 1, 5, tzinfo=timezone.utc)},
+    {"tuple": (1, "a"), "enum": Colour.RED, "model": Point(x=1.5, when=date(2021, 1, 1))},
+    {1: "integer key", "text": "Sun 12 April, 2020 – ünïcode   \"quoted\""},
+    (["value is not a valid float"], 422),
+    422,
+]
+
+
+@pytest.mark.parametrize("content", list(calculations()) + EDGE_CASES)
+def test_same_bytes_as_fastapi(content):
+    assert FastJSONResponse(content).body == fastapi_body(content)
+
+
+@pytest.mark.parametrize("content", EDGE_CASES + [next(calculations())])
+def test_same_bytes_without_orjson(content, monkeypatch):
+    monkeypatch.setattr(json_response, "orjson", None)
+
+    assert encode_json(content) == fastapi_body(content)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_non_finite_floats_are_null(use_orjson, monkeypatch):
+    if not use_orjson:
+        monkeypatch.setattr(json_response, "orjson", None)
+    content = {"nan": float("nan"), "values": [float("inf"), -float("inf"), numpy.float64("nan"), 1.5], "none": None}
+
+    # FastAPI's JSONResponse refuses them, failing the whole response
+    with pytest.raises(ValueError):
+        fastapi_body(content)
+    assert encode_json(content) == b'{"nan":null,"values":[null,null,null,1.5],"none":null}'
+    assert encode_json(float("nan")) == b"null"
+
+
+def test_fictional_child_data():
+    content = generate_fictional_child_data(
+        measurement_method="weight", sex="male", start_chronological_age=0, end_age=4, gestation_weeks=28,
+        gestation_days=0, measurement_interval_type="months", measurement_interval_number=2, start_sds=-1.3,
+        drift=True, drift_range=-0.05, noise=True, noise_range=0.005, reference=constants.UK_WHO)
+
+    assert encode_json(content) == fastapi_body(content)
+
+
+def test_endpoint_responses():
+    body = {
+        "birth_date": "2020-04-12", "observation_date": "2021-06-12", "observation_value": 9.6, "sex": "female",
+        "gestation_weeks": 36, "gestation_days": 2, "measurement_method": "weight"}
+    response = client.post("/uk-who/calculation", json=body)
+
+    assert response.headers["content-type"] == "application/json"
+    assert int(response.headers["content-length"]) == len(response.content)
+    assert response.content == fastapi_body(Measurement(
+        reference=constants.UK_WHO, birth_date=date(2020, 4, 12), observation_date=date(2021, 6, 12),
+        measurement_method="weight", observation_value=9.6, sex="female", gestation_weeks=36,
+        gestation_days=2).measurement)
@@ -0,0 +1,126 @@
+"""
+Tests for the vectorised LMS engine, checked against rcpchgrowth.Measurement
+"""
+# standard imports
+import random
+from datetime import date, timedelta
+
+# third party imports
+import numpy as np
+import pytest
+
+# local / rcpch imports
+from rcpchgrowth import Measurement
+from rcpchgrowth.global_functions import sds_for_measurement
+from services.lms_engine import lms_for_age, sds_and_centiles
+
+REFERENCE_MEASUREMENTS = [
+    ("uk-who", "height"), ("uk-who", "weight"), ("uk-who", "bmi"), ("uk-who", "ofc"),
+    ("trisomy-21", "height"), ("trisomy-21", "weight"), ("trisomy-21", "bmi"), ("trisomy-21", "ofc"),
+    ("turners-syndrome", "height"),
+]
+
+
+def random_measurements(seed, count):
+    """
+    Returns random measurements covering preterm infants to 20 y, with plausible values for the age.
+    """
+    generator = random.Random(seed)
+    measurements = []
+    for _ in range(count):
+        reference, measurement_method = generator.choice(REFERENCE_MEASUREMENTS)
+        sex = "female" if reference == "turners-syndrome" else generator.choice(["male", "female"])
+        birth_date = date(2000, 1, 1) + timedelta(days=generator.randrange(3650))
+        observation_date = birth_date + timedelta(days=generator.randrange(7305))
+        gestation_weeks = generator.randint(23, 42)
+        measurements.append({
+            "reference": reference,
+            "measurement_method": measurement_method,
+            "sex": sex,
+            "birth_date": birth_date,
+            "observation_date": observation_date,
+            "gestation_weeks": gestation_weeks,
+            "gestation_days": generator.randrange(7),
+            "sds": generator.uniform(-3.5, 3.5),
+        })
+    return measurements
+
+
+def assert_matches_measurement(sds, centile, calculated_sds, calculated_centile):
+    if calculated_sds is None:
+        assert np.isnan(sds)
+        return
+    assert sds == pytest.approx(calculated_sds, rel=1e-9, abs=1e-9)
+    # Measurement rounds centiles to one decimal place
+    assert abs(centile - calculated_centile) <= 0.05 + 1e-9
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_lms_engine_matches_measurement(seed):
+    measurements = random_measurements(seed, 300)
+    results = []
+    for measurement in measurements:
+        # give each child a value near the median for their age, so values pass Measurement's validation
+        chronological_age = (measurement["observation_date"] - measurement["birth_date"]).days / 365.25
+        _, median, _ = lms_for_age(
+            measurement["reference"], measurement["measurement_method"], measurement["sex"], chronological_age)
+        measurement["observation_value"] = 10.0 if np.isnan(median) else round(
+            float(median) * (1 + measurement["sds"] / 20), 2)
+        results.append(Measurement(
+            reference=measurement["reference"],
+            birth_date=measurement["birth_date"],
+            observation_date=measurement["observation_date"],
+            measurement_method=measurement["measurement_method"],
+            observation_value=measurement["observation_value"],
+            sex=measurement["sex"],
+            gestation_weeks=measurement["gestation_weeks"],
+            gestation_days=measurement["gestation_days"],
+        ).measurement)
+
+    for age_type in ["chronological", "corrected"]:
+        calculated = sds_and_centiles(
+            reference=[measurement["reference"] for measurement in measurements],
+            measurement_method=[measurement["measurement_method"] for measurement in measurements],
+            sex=[measurement["sex"] for measurement in measurements],
+            decimal_age=[result["measurement_dates"][f"{age_type}_decimal_age"] for result in results],
+            observation_value=[measurement["observation_value"] for measurement in measurements],
+        )
+        for index, result in enumerate(results):
+            values = result["measurement_calculated_values"]
+            assert_matches_measurement(
+                calculated["sds"][index], calculated["centile"][index],
+                values[f"{age_type}_sds"], values[f"{age_type}_centile"])
+
+
+@pytest.mark.parametrize("measurement_method", ["height", "weight", "bmi", "ofc"])
+@pytest.mark.parametrize("decimal_age", [
+    -0.3258042436687201, -0.2874743326488706, 0.038329911019849415, 2.0, 4.0, 17.0, 18.0, 20.0,
+])
+def test_lms_engine_uk_who_segment_boundaries(measurement_method, decimal_age):
+    # Measurement calculates through sds_for_measurement, which uses the older segment at a boundary
+    try:
+        expected = sds_for_measurement(
+            reference="uk-who", age=decimal_age, measurement_method=measurement_method,
+            observation_value=20.0, sex="female")
+    except LookupError:
+        expected = None
+    calculated = sds_and_centiles("uk-who", measurement_method, "female", [decimal_age], [20.0])
+
+    if expected is None:
+        assert np.isnan(calculated["sds"][0])
+    else:
+        assert calculated["sds"][0] == pytest.approx(expected, rel=1e-9)
+
+
+def test_lms_engine_returns_nan_without_reference_data():
+    calculated = sds_and_centiles(
+        reference=["uk-who", "uk-who", "turners-syndrome", "trisomy-21", "uk-who"],
+        measurement_method=["height", "bmi", "height", "ofc", "height"],
+        sex=["male", "male", "male", "female", "male"],
+        decimal_age=[20.5, 0.0, 10.0, 18.5, 10.0],
+        observation_value=[170.0, 15.0, 130.0, 50.0, 138.0],
+    )
+
+    assert np.isnan(calculated["sds"][:4]).all()
+    assert np.isnan(calculated["centile"][:4]).all()
+    assert not np.isnan(calculated["sds"][4])
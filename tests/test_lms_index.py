@@ -0,0 +1,149 @@
+"""
+Tests for the precomputed LMS index, checked against the per-call lookups it replaces
+"""
+# standard imports
+import json
+import random
+from datetime import date, timedelta
+
+# third party imports
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from benchmarks.lms_index import lms_for_group
+import rcpchgrowth.fictional_child
+import rcpchgrowth.measurement
+from rcpchgrowth import Measurement
+from rcpchgrowth.global_functions import measurement_from_sds as rcpchgrowth_measurement_from_sds
+from main import app
+from services import calculation, settings
+from services.json_response import encode_json
+from services.lms_engine import LMS_INDEX, lms_at, reference_tables, TABLE_BOUNDARIES
+from tests.test_lms_engine import random_measurements
+
+
+@pytest.fixture(autouse=True)
+def restore_rcpchgrowth():
+    # a test which turns the index on must not leave it on for the tests after it
+    yield
+    calculation.restore_rcpchgrowth()
+
+
+def test_index_matches_tables_exactly():
+    generator = np.random.default_rng(0)
+    boundaries = np.array(TABLE_BOUNDARIES)
+    for (reference, measurement_method, sex), index in LMS_INDEX.items():
+        decimal_age = np.concatenate(
+            [generator.uniform(-0.5, 21, 2000), boundaries, boundaries - 1e-12, boundaries + 1e-12, [np.nan]] +
+            [table.decimal_age for table in reference_tables(reference, measurement_method, sex)])
+
+        expected = np.array(lms_for_group(reference, measurement_method, sex, decimal_age))
+        indexed = np.array(index.lms(decimal_age))
+        np.testing.assert_array_equal(indexed, expected)
+
+        single = np.array([
+            [np.nan] * 3 if lms is None else [float(value) for value in lms]
+            for lms in (lms_at(reference, measurement_method, sex, float(age)) for age in decimal_age)
+        ]).T
+        np.testing.assert_array_equal(single, expected)
+
+
+def test_lookups_without_data():
+    assert lms_at("turners-syndrome", "weight", "female", 8) is None
+    assert lms_at("turners-syndrome", "height", "female", 0.5) is None
+    assert lms_at("uk-who", "height", "male", float("nan")) is None
+    assert lms_at("invalid", "height", "male", 8) is None
+    assert lms_at("uk-who", "height", "male", 8) is not None
+
+
+def calculate(measurement, lms_index):
+    assert calculation.use_lms_index(lms_index) == lms_index
+    try:
+        return json.loads(encode_json(Measurement(**measurement).measurement))
+    except Exception as error:
+        return repr(error)
+    finally:
+        calculation.restore_rcpchgrowth()
+
+
+def assert_same(indexed, expected):
+    # interpolated L, M and S can differ from rcpchgrowth's in the last digit
+    if isinstance(expected, dict):
+        assert indexed.keys() == expected.keys()
+        for key in expected:
+            assert_same(indexed[key], expected[key])
+    elif isinstance(expected, float):
+        assert indexed == pytest.approx(expected, rel=1e-12, abs=1e-12)
+    else:
+        assert indexed == expected
+
+
+def test_measurements_are_the_same_with_the_index():
+    generator = random.Random(11)
+    birth_date = date(2010, 1, 1)
+    measurements = []
+    for measurement in random_measurements(11, 400):
+        del measurement["sds"]
+        measurement["observation_value"] = generator.uniform(10, 30) if measurement["measurement_method"] == "bmi" \
+            else generator.uniform(1, 150)
+        measurements.append(measurement)
+    # preterm, at the boundary of the UK-WHO segments, and with no data
+    for days, gestation_weeks, measurement_method in [
+            (14, 40, "weight"), (14, 28, "weight"), (730, 40, "height"), (4, 40, "bmi"), (6575, 40, "ofc")]:
+        measurements.append({
+            "reference": "uk-who", "measurement_method": measurement_method, "sex": "female",
+            "birth_date": birth_date, "observation_date": birth_date + timedelta(days=days),
+            "gestation_weeks": gestation_weeks, "gestation_days": 0, "observation_value": 5,
+        })
+
+    for measurement in measurements:
+        assert_same(calculate(measurement, True), calculate(measurement, False))
+
+
+def test_measurement_from_sds_is_the_same_with_the_index():
+    generator = random.Random(5)
+    for _ in range(500):
+        reference = generator.choice(["uk-who", "trisomy-21", "turners-syndrome"])
+        arguments = (
+            reference, generator.uniform(-4, 4), "height" if reference == "turners-syndrome" else generator.choice(
+                ["height", "weight", "bmi", "ofc"]), generator.choice(["male", "female"]),
+            generator.choice([generator.uniform(-0.3, 20.5), generator.choice(TABLE_BOUNDARIES)]),
+            generator.random() < 0.2)
+        try:
+            expected = rcpchgrowth_measurement_from_sds(*arguments)
+        except LookupError:
+            with pytest.raises(LookupError):
+                calculation.measurement_from_sds(*arguments)
+            continue
+        if expected is None:
+            assert calculation.measurement_from_sds(*arguments) is None
+        else:
+            assert calculation.measurement_from_sds(*arguments) == pytest.approx(expected, rel=1e-12)
+
+
+def test_index_is_only_used_with_the_rcpchgrowth_it_is_checked_against(monkeypatch):
+    originals = [getattr(module, name) for module, name, *_ in calculation.LMS_INDEX_FUNCTIONS]
+    assert calculation.use_lms_index(True)
+    assert rcpchgrowth.measurement.sds_for_measurement is calculation.sds_for_measurement
+    calculation.restore_rcpchgrowth()
+    assert [getattr(module, name) for module, name, *_ in calculation.LMS_INDEX_FUNCTIONS] == originals
+    assert rcpchgrowth.measurement.sds_for_measurement is rcpchgrowth.global_functions.sds_for_measurement
+
+    monkeypatch.setattr(calculation.metadata, "version", lambda name: "99.0.0")
+    assert not calculation.use_lms_index(True)
+    assert rcpchgrowth.measurement.sds_for_measurement is rcpchgrowth.global_functions.sds_for_measurement
+    monkeypatch.undo()
+
+    # a version which looks the functions up somewhere else
+    monkeypatch.setattr(rcpchgrowth.fictional_child, "measurement_from_sds", lambda *arguments: None)
+    assert not calculation.use_lms_index(True)
+
+
+def test_server_restores_rcpchgrowth_when_it_stops(monkeypatch):
+    monkeypatch.setattr(settings, "lms_index_enabled", True)
+
+    with TestClient(app):
+        assert rcpchgrowth.measurement.sds_for_measurement is calculation.sds_for_measurement
+    assert rcpchgrowth.measurement.sds_for_measurement is rcpchgrowth.global_functions.sds_for_measurement
@@ -0,0 +1,55 @@
+"""
+Tests for the load test harness
+"""
+# standard imports
+import itertools
+
+# third party imports
+import pytest
+
+# local / rcpch imports
+from benchmarks.load import parse_mix, record_traffic, replay_traffic, saturated, summarise_step, synthetic_traffic
+
+
+def test_mix_weights_are_split_between_matching_scenarios():
+    weights = {scenario.name: weight for scenario, weight in parse_mix(["*-calculation=90", "uk-who-chart-*=10"])}
+
+    assert weights == {
+        "uk-who-calculation": 30, "uk-who-chart-coordinates": 10, "turner-calculation": 30, "trisomy-21-calculation": 30}
+    with pytest.raises(ValueError):
+        parse_mix(["nothing-*=1"])
+
+
+def test_synthetic_traffic_is_repeatable_with_a_seed():
+    first = list(itertools.islice(synthetic_traffic(["*-calculation=9", "*-chart-coordinates=1"], seed=3), 200))
+    second = list(itertools.islice(synthetic_traffic(["*-calculation=9", "*-chart-coordinates=1"], seed=3), 200))
+
+    assert first == second
+    paths = [path for path, _ in first]
+    assert {path.rsplit("/", 1)[1] for path in paths} == {"calculation", "chart-coordinates"}
+    assert paths.count("/uk-who/calculation") > paths.count("/uk-who/chart-coordinates")
+
+
+def test_recorded_traffic_replays_in_order(tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    record_traffic(synthetic_traffic(["*-calculation=1"], seed=1), path, 3)
+    recorded = list(itertools.islice(synthetic_traffic(["*-calculation=1"], seed=1), 3))
+
+    assert list(itertools.islice(replay_traffic(path), 6)) == recorded * 2
+
+
+def test_step_summary_and_saturation():
+    outcomes = [("/uk-who/calculation", 200, 0.01)] * 97 + [("/turner/calculation", 503, 0.001)] * 2 + [
+        ("/turner/calculation", None, 5.0)]
+    step = summarise_step(outcomes, 10.0, offered_rate=10)
+
+    assert step["requests"] == 100
+    assert step["errors"] == 3
+    assert step["statuses"] == {"200": 97, "503": 2, "connection-error": 1}
+    assert step["requests_per_second"] == 9.7
+    assert step["p99_ms"] == 10
+    assert step["routes"]["/turner/calculation"]["errors"] == 3
+    # 3% errors
+    assert saturated(step, slo_ms=1000)
+    assert not saturated(summarise_step(outcomes[:97], 10.0, offered_rate=10), slo_ms=1000)
+    assert saturated(summarise_step(outcomes[:97], 10.0, offered_rate=10), slo_ms=5)
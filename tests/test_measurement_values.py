@@ -0,0 +1,90 @@
+"""
+Tests for the measurement values (inverse calculation) endpoints
+"""
+# third party imports
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from rcpchgrowth import constants
+from rcpchgrowth.global_functions import measurement_from_sds
+from services import measurement_values, settings
+
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("reference, measurement_method, sex", [
+    (constants.UK_WHO, "height", "male"),
+    (constants.UK_WHO, "bmi", "female"),
+    (constants.TRISOMY_21, "ofc", "female"),
+    (constants.TURNERS, "height", "female"),
+])
+def test_measurement_values_match_rcpchgrowth(reference, measurement_method, sex):
+    ages = np.round(np.random.default_rng(1).uniform(-0.2, 19.9, 100), 4)
+    sds = np.random.default_rng(2).normal(0, 1.5, 100)
+
+    values = measurement_values(reference, sex, measurement_method, ages, sds)["measurement_values"]
+
+    for age, z, value in zip(ages, sds, values):
+        try:
+            expected = measurement_from_sds(
+                reference=reference, requested_sds=float(z), measurement_method=measurement_method, sex=sex,
+                age=float(age))
+        except LookupError:
+            expected = None
+        if expected is None:
+            assert value is None
+        else:
+            assert value == pytest.approx(expected, rel=1e-12)
+
+
+def test_centiles_at_one_age():
+    response = client.post("/uk-who/measurement-values", json={
+        "sex": "female", "measurement_method": "height", "decimal_ages": [8.0], "centiles": [2, 50, 98]})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["decimal_ages"] == [8.0, 8.0, 8.0]
+    assert body["sds"][1] == 0.0
+    assert body["sds"][0] == pytest.approx(-2.0537, abs=1e-4)
+    assert body["measurement_values"][0] < body["measurement_values"][1] < body["measurement_values"][2]
+    assert body["measurement_values"][1] == pytest.approx(
+        measurement_from_sds(constants.UK_WHO, 0.0, "height", "female", 8.0))
+
+    # a value found from a centile calculates back to that centile
+    calculation = client.post("/uk-who/calculation", json={
+        "birth_date": "2012-01-01", "observation_date": "2020-01-01", "observation_value": 125,
+        "sex": "female", "gestation_weeks": 40, "gestation_days": 0, "measurement_method": "height",
+    }).json()["measurement_calculated_values"]
+    body = client.post("/uk-who/measurement-values", json={
+        "sex": "female", "measurement_method": "height", "decimal_ages": [8.0],
+        "sds": [calculation["chronological_sds"]]}).json()
+    assert body["measurement_values"][0] == pytest.approx(125, abs=0.5)
+
+
+def test_ages_without_reference_data():
+    body = client.post("/turner/measurement-values", json={
+        "sex": "female", "measurement_method": "height", "decimal_ages": [0.5, 8, 25], "sds": [0]}).json()
+
+    assert body["measurement_values"][0] is None
+    assert body["measurement_values"][1] > 100
+    assert body["measurement_values"][2] is None
+
+    body = client.post("/turner/measurement-values", json={
+        "sex": "male", "measurement_method": "height", "decimal_ages": [8], "sds": [0]}).json()
+    assert body["measurement_values"] == [None]
+
+
+def test_invalid_measurement_values_requests(monkeypatch):
+    request = {"sex": "male", "measurement_method": "weight", "decimal_ages": [2, 3]}
+
+    assert client.post("/trisomy-21/measurement-values", json=request).status_code == 422
+    assert client.post("/trisomy-21/measurement-values", json=dict(request, sds=[0], centiles=[50])).status_code == 422
+    assert client.post("/trisomy-21/measurement-values", json=dict(request, sds=[0, 1, 2])).status_code == 422
+    assert client.post("/trisomy-21/measurement-values", json=dict(request, centiles=[100])).status_code == 422
+    assert client.post("/trisomy-21/measurement-values", json=dict(request, sds=[0, 1])).status_code == 200
+
+    monkeypatch.setattr(settings, "max_measurement_values", 1)
+    assert client.post("/trisomy-21/measurement-values", json=dict(request, sds=[0])).status_code == 413
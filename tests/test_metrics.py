@@ -0,0 +1,94 @@
+"""
+Tests for request metrics and the /metrics endpoint
+"""
+# third party imports
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from services.metrics import format_labels, Histogram, metrics_registry
+
+client = TestClient(app)
+
+BODY = {
+    "birth_date": "2020-04-12",
+    "observation_date": "2028-06-12",
+    "observation_value": 115,
+    "sex": "female",
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_method": "height"
+}
+
+
+def samples():
+    """
+    The value of every sample from /metrics, by name and labels.
+    """
+    response = client.get("/metrics")
+    assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    values = {}
+    for line in response.text.splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+def test_request_metrics():
+    before = samples()
+    response = client.post("/turner/calculation", json=dict(BODY, observation_value=116))
+    client.post("/turner/calculation", json={})
+    client.get("/not-a-route")
+    after = samples()
+
+    def increase(name):
+        return after.get(name, 0) - before.get(name, 0)
+
+    route = 'method="POST",route="/turner/calculation"'
+    assert increase(f'dgc_http_request_duration_seconds_count{{{route},status="200"}}') == 1
+    assert increase(f'dgc_http_request_duration_seconds_count{{{route},status="422"}}') == 1
+    assert increase('dgc_http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}') == 1
+    assert increase(f'dgc_http_response_size_bytes_sum{{{route},status="200"}}') == len(response.content)
+    assert increase(f'dgc_http_request_size_bytes_count{{{route}}}') == 2
+    # the request rejected by validation never reached the endpoint
+    phases = 'dgc_http_request_phase_seconds_count{{route="/turner/calculation",phase="{}"}}'
+    assert increase(phases.format("validation")) == 2
+    assert increase(phases.format("computation")) == 1
+    assert increase(phases.format("serialization")) == 1
+    assert after['dgc_http_requests_in_flight{method="POST"}'] == 0
+    assert after['dgc_executor_max_pending{backend="threadpool"}'] > 0
+
+
+def test_sync_endpoint_phases():
+    before = samples()
+    client.post("/uk-who/chart-coordinates", json={"sex": "male", "measurement_method": "height"})
+    after = samples()
+
+    name = 'dgc_http_request_phase_seconds_count{route="/uk-who/chart-coordinates",phase="computation"}'
+    assert after[name] - before.get(name, 0) == 1
+
+
+def test_cache_metrics():
+    client.post("/trisomy-21/calculation", json=BODY)
+    client.post("/trisomy-21/calculation", json=BODY)
+    values = samples()
+
+    assert values['dgc_cache_hits_total{cache="calculation",tier="memory"}'] >= 1
+    assert 0 < values['dgc_cache_hit_ratio{cache="calculation",tier="memory"}'] <= 1
+
+
+def test_histogram():
+    histogram = Histogram("test_seconds", "Test.", ["route"], buckets=[0.1, 1])
+    for value in [0.05, 0.5, 5]:
+        histogram.observe(value, route="/")
+
+    assert list(histogram.samples()) == [
+        ("test_seconds_bucket", [("route", "/"), ("le", "0.1")], 1),
+        ("test_seconds_bucket", [("route", "/"), ("le", "1")], 2),
+        ("test_seconds_bucket", [("route", "/"), ("le", "+Inf")], 3),
+        ("test_seconds_sum", [("route", "/")], 5.55),
+        ("test_seconds_count", [("route", "/")], 3),
+    ]
+    assert format_labels([("route", 'a"b\\c\n')]) == '{route="a\\"b\\\\c\\n"}'
+    assert "# TYPE dgc_http_request_duration_seconds histogram" in metrics_registry.render()
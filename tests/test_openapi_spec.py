@@ -3,6 +3,9 @@ Tests for the openAPI spec endpoint
 """
 # standard imports
 import json
+import subprocess
+import sys
+from pathlib import Path
 
 # third party imports
 from fastapi.testclient import TestClient
@@ -25,3 +28,31 @@ def test_read_root():
 
     # load the two JSON responses as Python Dicts so enable comparison (slow but more reliable)
     assert response.json() == json.loads(apispec)
+
+
+def test_root_is_served_from_cached_bytes():
+    first = client.get("/", headers={"Accept-Encoding": "gzip"})
+    second = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"]})
+
+    assert first.headers["content-encoding"] == "gzip"
+    assert second.status_code == 304
+
+
+def test_docs():
+    response = client.get("/docs")
+
+    assert response.status_code == 200
+    assert "swagger-ui" in response.text
+    assert client.get("/docs/oauth2-redirect").status_code == 200
+
+
+def test_import_does_not_build_spec():
+    openapi_file = Path(__file__).resolve().parent.parent / "openapi.json"
+    modified = openapi_file.stat().st_mtime_ns
+
+    # a fresh process, as this one has already built the spec
+    subprocess.run(
+        [sys.executable, "-c", "import main; assert main.app.openapi_schema is None"],
+        cwd=openapi_file.parent, check=True, capture_output=True)
+
+    assert openapi_file.stat().st_mtime_ns == modified
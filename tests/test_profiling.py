@@ -0,0 +1,99 @@
+"""
+Tests for on-demand request profiling
+"""
+# standard imports
+import sys
+import threading
+
+# third party imports
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from services import profile_store, ProfilingMiddleware, settings
+from services.profiling import Profile, ProfileStore
+
+BODY = {
+    "measurement_method": "height",
+    "sex": "female",
+    "start_chronological_age": 2,
+    "end_age": 20,
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_interval_type": "months",
+    "measurement_interval_number": 3,
+    "start_sds": 0.3,
+    "drift": False,
+    "drift_range": -0.05,
+    "noise": False,
+    "noise_range": 0.005,
+    "reference": "uk-who",
+}
+ADMIN_KEY = {"X-Admin-Key": "test-key"}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "admin_api_key", "test-key")
+    monkeypatch.setattr(profile_store, "directory", tmp_path)
+    return TestClient(ProfilingMiddleware(app))
+
+
+def test_profile_returned(client):
+    response = client.post("/uk-who/fictional-child-data", json=BODY, headers=dict(ADMIN_KEY, **{"X-Profile": "return"}))
+
+    assert response.status_code == 200
+    assert response.headers["x-profile-status"] == "200"
+    assert response.headers["content-type"].startswith("text/plain")
+    stacks = response.text.splitlines()
+    assert stacks
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
+    # the calculation runs in a threadpool thread, which is sampled too
+    assert any("rcpchgrowth" in line for line in stacks)
+    assert profile_store.get(response.headers["x-profile-id"]) == response.text
+
+
+def test_profile_stored_and_listed(client):
+    response = client.post("/uk-who/fictional-child-data?profile=store", json=BODY, headers=ADMIN_KEY)
+
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+    profile_id = response.headers["x-profile-id"]
+    [listed] = client.get("/admin/profiles", headers=ADMIN_KEY).json()
+    assert listed["id"] == profile_id
+    assert listed["reason"] == "requested"
+    assert listed["route"] == "/uk-who/fictional-child-data"
+    assert listed["status"] == 200
+    assert client.get(f"/admin/profiles/{profile_id}", headers=ADMIN_KEY).text == profile_store.get(profile_id)
+    assert client.get("/admin/profiles/0-00000000", headers=ADMIN_KEY).status_code == 404
+
+
+def test_profiling_needs_the_admin_key(client):
+    response = client.get("/health/live", headers={"X-Profile": "store", "X-Admin-Key": "wrong"})
+
+    assert "x-profile-id" not in response.headers
+    assert profile_store.ids() == []
+
+
+def test_requests_sampled(client, monkeypatch):
+    monkeypatch.setattr(settings, "profiling_sample_rate", 1.0)
+    client.get("/health/live")
+
+    [profile] = profile_store.list()
+    assert profile["reason"] == "sampled"
+    assert profile["route"] == "/health/live"
+
+
+def test_store_keeps_the_newest_profiles(tmp_path):
+    store = ProfileStore(tmp_path, max_profiles=2)
+    profiles = [Profile(f"{index}-0000000{index}") for index in range(1, 4)]
+    for profile in profiles:
+        profile.enter_thread()
+        profile.sample({threading.get_ident(): sys._getframe()})
+        store.save(profile, {})
+
+    assert store.ids() == ["3-00000003", "2-00000002"]
+    assert store.get("1-00000001") is None
+    assert "test_store_keeps_the_newest_profiles (" in store.get("3-00000003")
+    assert store.get("../secrets") is None
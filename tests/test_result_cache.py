@@ -0,0 +1,125 @@
+"""
+Tests for the calculation result cache
+"""
+# standard imports
+import time
+
+# third party imports
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from schemas import MeasurementRequest
+from services import result_cache, settings
+from services.cache_backends import MemoryCacheBackend, SQLiteCacheBackend
+from services.result_cache import cache_key, ResultCache
+
+client = TestClient(app)
+
+BODY = {
+    "birth_date": "2020-04-12",
+    "observation_date": "2028-06-12",
+    "observation_value": 115,
+    "sex": "female",
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_method": "height",
+    "bone_age": 10,
+    "bone_age_centile": 98,
+    "bone_age_sds": 2.0,
+    "bone_age_text": "This bone age is advanced",
+    "bone_age_type": "greulich-pyle",
+    "events_text": ["Growth hormone start"]
+}
+
+
+def test_cached_calculation_matches_uncached(monkeypatch):
+    monkeypatch.setattr("services.calculation.result_cache", ResultCache("calculation", []))
+    uncached = client.post("/uk-who/calculation", json=BODY)
+
+    cache = ResultCache("calculation", [MemoryCacheBackend(1024 * 1024)])
+    monkeypatch.setattr("services.calculation.result_cache", cache)
+    first = client.post("/uk-who/calculation", json=BODY)
+    second = client.post("/uk-who/calculation", json=BODY)
+
+    assert first.content == uncached.content
+    assert second.content == uncached.content
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_cache_key_covers_every_field():
+    request = MeasurementRequest(**BODY)
+    keys = {cache_key("uk-who", request), cache_key("trisomy-21", request)}
+    for field, value in [
+        ("observation_value", 116), ("bone_age_text", "Delayed"), ("events_text", ["Growth hormone stop"]),
+        ("gestation_days", 1), ("bone_age_type", "fels"),
+    ]:
+        keys.add(cache_key("uk-who", MeasurementRequest(**dict(BODY, **{field: value}))))
+
+    assert len(keys) == 7
+    # equivalent requests share a key
+    assert cache_key("uk-who", request) == cache_key("uk-who", MeasurementRequest(**dict(BODY, observation_value=115.0)))
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResultCache("calculation", [MemoryCacheBackend(300)])
+    for index in range(3):
+        cache.put(f"key-{index}", {"value": "x" * 50})
+    cache.get("key-0")
+    cache.put("key-3", {"value": "x" * 50})
+
+    assert cache.get("key-0") is not None
+    assert cache.get("key-1") is None
+    stats = cache.stats()["tiers"]["memory"]
+    assert stats["evictions"] >= 1
+    assert stats["bytes"] <= 300
+
+
+def test_cache_returns_copies():
+    cache = ResultCache("calculation", [MemoryCacheBackend(1024)])
+    cache.put("key", {"values": [1, 2]})
+    cache.get("key")["values"].append(3)
+
+    assert cache.get("key") == {"values": [1, 2]}
+
+
+def test_cache_expires_results():
+    cache = ResultCache("calculation", [MemoryCacheBackend(1024)], ttl=0.05)
+    cache.put("key", {"value": 1})
+    assert cache.get("key") == {"value": 1}
+    time.sleep(0.1)
+
+    assert cache.get("key") is None
+    assert cache.stats()["tiers"]["memory"]["expirations"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = ResultCache(
+        "calculation", [MemoryCacheBackend(1024), SQLiteCacheBackend(tmp_path / "results.sqlite3")])
+    cache.put("key", {"value": 1})
+
+    restarted = ResultCache(
+        "calculation", [MemoryCacheBackend(1024), SQLiteCacheBackend(tmp_path / "results.sqlite3")])
+
+    assert restarted.get("key") == {"value": 1}
+    assert restarted.stats()["tiers"]["sqlite"]["hits"] == 1
+    # the result is now held in memory too
+    assert restarted.get("key") == {"value": 1}
+    assert restarted.stats()["tiers"]["memory"]["hits"] == 1
+    assert restarted.stats()["tiers"]["sqlite"]["hits"] == 1
+
+
+def test_admin_result_cache(monkeypatch):
+    monkeypatch.setattr(settings, "admin_api_key", "test-admin-key")
+    client.post("/uk-who/calculation", json=BODY)
+
+    response = client.get("/admin/result-cache", headers={"X-Admin-Key": "test-admin-key"})
+
+    assert response.status_code == 200
+    assert response.json()["calculation"]["tiers"]["memory"]["entries"] >= 1
+    assert "chart" in response.json()
+
+    response = client.delete("/admin/result-cache", headers={"X-Admin-Key": "test-admin-key"})
+
+    assert response.json()["calculation"]["tiers"]["memory"]["entries"] == 0
@@ -0,0 +1,107 @@
+"""
+Tests for structured logging and request IDs
+"""
+# standard imports
+import io
+import json
+import logging
+import queue
+
+# third party imports
+import pytest
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from services import configure_logging, logging_subsystem, request_id, settings
+from services.structured_logging import DroppingQueueHandler
+
+client = TestClient(app)
+
+BODY = {
+    "birth_date": "2020-04-12",
+    "observation_date": "2028-06-12",
+    "observation_value": 115,
+    "sex": "female",
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_method": "height"
+}
+
+
+@pytest.fixture
+def log_records():
+    """
+    Sends log records to a buffer, and returns a function which writes out those queued and parses them.
+    """
+    stream = io.StringIO()
+    logging_subsystem.configure("INFO", "json", stream=stream)
+
+    def records():
+        logging_subsystem.stop()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield records
+    configure_logging()
+
+
+def test_records_are_json(log_records):
+    token = request_id.set("test-request")
+    try:
+        logging.getLogger("tests").info("Measured %s", "height", extra={"reference": "uk-who"})
+    finally:
+        request_id.reset(token)
+    try:
+        raise ValueError("invalid")
+    except ValueError:
+        logging.getLogger("tests").error("Failed", exc_info=True)
+
+    measured, failed = [record for record in log_records() if record["logger"] == "tests"]
+
+    assert measured["message"] == "Measured height"
+    assert measured["level"] == "INFO"
+    assert measured["request_id"] == "test-request"
+    assert measured["reference"] == "uk-who"
+    assert failed["request_id"] is None
+    assert "ValueError: invalid" in failed["exception"]
+
+
+def test_request_ids_and_access_log(log_records):
+    given = client.post("/uk-who/calculation", json=BODY, headers={"X-Request-ID": "client-id-1"})
+    generated = client.post("/uk-who/calculation", json=BODY, headers={"X-Request-ID": "not a valid id"})
+
+    assert given.headers["x-request-id"] == "client-id-1"
+    assert len(generated.headers["x-request-id"]) == 32
+
+    access = [record for record in log_records() if record["logger"] == "access"]
+
+    assert [record["request_id"] for record in access] == ["client-id-1", generated.headers["x-request-id"]]
+    assert access[0]["route"] == "/uk-who/calculation"
+    assert access[0]["status"] == 200
+    assert access[0]["duration_seconds"] > 0
+
+
+def test_access_log_sampling(log_records, monkeypatch):
+    monkeypatch.setattr(settings, "log_route_sample_rates", {"/uk-who/calculation": 0.0, "/turner/calculation": 0.0})
+    client.post("/uk-who/calculation", json=BODY)
+    client.get("/metrics")
+    # slow requests are logged whatever the sample rate
+    monkeypatch.setattr(settings, "log_slow_request_seconds", 1e-9)
+    client.post("/turner/calculation", json=BODY)
+
+    access = [record for record in log_records() if record["logger"] == "access"]
+
+    assert [record["route"] for record in access] == ["/metrics", "/turner/calculation"]
+    assert access[1]["slow"] is True
+    assert access[1]["level"] == "WARNING"
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    logger = logging.Logger("dropping")
+    logger.addHandler(handler)
+    for index in range(3):
+        logger.warning("record %s", index)
+
+    assert handler.queue.get_nowait().msg == "record 0"
+    assert handler.dropped == 2
@@ -69,6 +69,32 @@ def test_turner_calculation_with_invalid_request():
     assert validation_errors['sex']['msg'] == "unexpected value; permitted: 'male', 'female'"
 
 
+def test_turner_calculations_batch_with_missing_value():
+
+    body = {
+        "birth_date": "2020-04-12",
+        "observation_date": "2024-06-12",
+        "observation_value": 105,
+        "sex": "female",
+        "gestation_weeks": 40,
+        "gestation_days": 0,
+        "measurement_method": "height"
+    }
+
+    invalid_body = dict(body)
+    del invalid_body["observation_value"]
+
+    response = client.post("/turner/calculations", json=[body, invalid_body])
+
+    assert response.status_code == 200
+
+    results = response.json()
+
+    assert results[0]["calculation"]["measurement_calculated_values"] is not None
+    assert results[1]["calculation"] is None
+    assert results[1]["errors"][0]["loc"] == ["observation_value"]
+
+
 def test_turner_chart_data_with_valid_request():
     body = {
         "measurement_method": "height",
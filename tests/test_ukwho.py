@@ -3,6 +3,7 @@ Tests for the UK-WHO endpoints
 """
 
 # standard imports
+import asyncio
 import json
 import hashlib
 
@@ -11,6 +12,7 @@ from fastapi.testclient import TestClient
 
 # local / rcpch imports
 from main import app
+from services import calculate_measurement_stream, settings
 
 client = TestClient(app)
 
@@ -74,6 +76,104 @@ def test_ukwho_calculation_with_invalid_request():
     assert validation_errors['sex']['msg'] == "unexpected value; permitted: 'male', 'female'"
 
 
+def test_ukwho_calculations_batch():
+
+    valid_body = {
+        "birth_date": "2020-04-12",
+        "observation_date": "2028-06-12",
+        "observation_value": 115,
+        "sex": "female",
+        "gestation_weeks": 40,
+        "gestation_days": 0,
+        "measurement_method": "height"
+    }
+    invalid_body = dict(valid_body, sex="invalid_sex")
+
+    response = client.post("/uk-who/calculations", json=[valid_body, invalid_body, valid_body])
+
+    assert response.status_code == 200
+
+    results = response.json()
+    single_response = client.post("/uk-who/calculation", json=valid_body)
+
+    # results come back in order, and the invalid measurement does not fail the batch
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert results[0]["calculation"] == single_response.json()
+    assert results[0]["errors"] is None
+    assert results[1]["calculation"] is None
+    assert results[1]["errors"][0]["loc"] == ["sex"]
+    assert results[2]["calculation"] == single_response.json()
+
+
+def test_ukwho_calculations_batch_size_limit(monkeypatch):
+    monkeypatch.setattr(settings, "max_batch_size", 2)
+
+    response = client.post("/uk-who/calculations", json=[{}, {}, {}])
+
+    assert response.status_code == 413
+
+
+def test_ukwho_calculations_stream():
+
+    valid_body = {
+        "birth_date": "2020-04-12",
+        "observation_date": "2028-06-12",
+        "observation_value": 115,
+        "sex": "female",
+        "gestation_weeks": 40,
+        "gestation_days": 0,
+        "measurement_method": "height"
+    }
+    lines = [json.dumps(valid_body), "not json", "", json.dumps(dict(valid_body, sex="invalid_sex")), json.dumps(valid_body)]
+
+    response = client.post(
+        "/uk-who/calculations/stream", data="\n".join(lines), headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    single_response = client.post("/uk-who/calculation", json=valid_body)
+
+    # blank lines are skipped, and invalid lines do not stop the stream
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert results[0]["calculation"] == single_response.json()
+    assert results[1]["errors"][0]["type"] == "value_error.jsondecode"
+    assert results[2]["errors"][0]["loc"] == ["sex"]
+    assert results[3]["calculation"] == single_response.json()
+
+    response = client.post("/uk-who/calculations/stream", json=[valid_body])
+
+    assert response.status_code == 415
+
+
+def test_ukwho_calculations_stream_chunks():
+    line = json.dumps({
+        "birth_date": "2020-04-12",
+        "observation_date": "2028-06-12",
+        "observation_value": 115,
+        "sex": "female",
+        "gestation_weeks": 40,
+        "gestation_days": 0,
+        "measurement_method": "height"
+    }).encode() + b"\n"
+
+    async def body():
+        # lines split across the chunks of the request body
+        data = line * 7
+        for start in range(0, len(data), 50):
+            yield data[start:start + 50]
+
+    async def results():
+        return [chunk async for chunk in calculate_measurement_stream("uk-who", body(), chunk_size=3)]
+
+    chunks = asyncio.run(results())
+    indices = [json.loads(result)["index"] for chunk in chunks for result in chunk.splitlines()]
+
+    assert indices == list(range(7))
+    assert all(len(chunk.splitlines()) <= 3 for chunk in chunks)
+
+
 def test_ukwho_chart_data_with_valid_request():
     body = {
         "measurement_method": "height",
@@ -103,6 +203,108 @@ def test_ukwho_chart_data_with_valid_request():
     # other chart data responses (female/male and weight/bmi/ofc)
 
 
+def test_ukwho_chart_data_etag_revalidation():
+    body = {
+        "measurement_method": "height",
+        "sex": "male",
+        "centile_format": "cole-nine-centiles"
+    }
+
+    response = client.post("/uk-who/chart-coordinates", json=body, headers={"Accept-Encoding": "identity"})
+
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag.startswith('"')
+
+    # sending the ETag back means the unchanged data is not sent again
+    response = client.post("/uk-who/chart-coordinates", json=body, headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_ukwho_chart_data_compressed_variants():
+    body = {
+        "measurement_method": "height",
+        "sex": "male",
+        "centile_format": "cole-nine-centiles"
+    }
+
+    with open(r'tests/test_data/test_uk_who_male_height_valid.json', 'r') as file:
+        chart_data = json.load(file)
+
+    etags = set()
+    for encoding in ["gzip", "br", "identity"]:
+        response = client.post("/uk-who/chart-coordinates", json=body, headers={"Accept-Encoding": encoding})
+
+        assert response.status_code == 200
+        assert response.headers.get("content-encoding", "identity") == encoding
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert response.json()['centile_data'] == chart_data
+        etags.add(response.headers["etag"])
+
+    # each encoding has its own strong ETag
+    assert len(etags) == 3
+
+
+def test_ukwho_chart_data_columnar_format():
+    body = {
+        "measurement_method": "height",
+        "sex": "male",
+        "centile_format": "cole-nine-centiles",
+        "format": "columnar"
+    }
+
+    response = client.post("/uk-who/chart-coordinates", json=body, headers={"Accept-Encoding": "identity"})
+
+    assert response.status_code == 200
+
+    with open(r'tests/test_data/test_uk_who_male_height_valid.json', 'r') as file:
+        chart_data_file = file.read()
+        chart_data = json.loads(chart_data_file)
+
+    # same reference segments and centile lines, with the points of each line as x and y arrays
+    for columnar_segment, segment in zip(response.json()['centile_data'], chart_data):
+        for reference, sexes in segment.items():
+            columnar_lines = columnar_segment[reference]["male"]["height"]
+            lines = sexes["male"]["height"]
+            assert len(columnar_lines) == len(lines)
+            for columnar_line, line in zip(columnar_lines, lines):
+                assert columnar_line["centile"] == line["centile"]
+                assert columnar_line["sds"] == line["sds"]
+                assert columnar_line["x"] == [point["x"] for point in line["data"]]
+                assert columnar_line["y"] == [point["y"] for point in line["data"]]
+
+    assert len(response.content) < len(chart_data_file) * 0.6
+
+
+def test_ukwho_chart_data_age_window_and_resolution():
+    body = {
+        "measurement_method": "height",
+        "sex": "male",
+        "format": "columnar",
+        "min_age": 2,
+        "max_age": 4,
+        "max_points_per_line": 10
+    }
+
+    response = client.post("/uk-who/chart-coordinates", json=body)
+
+    assert response.status_code == 200
+
+    for segment in response.json()['centile_data']:
+        for reference, sexes in segment.items():
+            for line in sexes["male"]["height"]:
+                assert len(line["x"]) <= 10
+                # only the points either side of the window may fall outside it
+                assert all(2 <= x <= 4 for x in line["x"][1:-1])
+
+    body["min_age"] = 5
+    response = client.post("/uk-who/chart-coordinates", json=body)
+
+    assert response.status_code == 422
+
+
 def test_ukwho_chart_data_with_invalid_request():
     body={
             "measurement_method": "invalid_measurement_method",
@@ -194,3 +396,28 @@ def test_ukwho_fictional_child_data_with_invalid_request():
     assert validation_errors['noise']['msg'] == "value could not be parsed to a boolean"
     assert validation_errors['noise_range']['msg'] == "value is not a valid float"
     assert validation_errors['reference']['msg'] == "unexpected value; permitted: 'uk-who', 'trisomy-21', 'turners-syndrome'"
+
+
+def test_ukwho_calculations_stream_line_too_long():
+    line = json.dumps({
+        "birth_date": "2020-04-12", "observation_date": "2028-06-12", "observation_value": 115, "sex": "female",
+        "gestation_weeks": 40, "gestation_days": 0, "measurement_method": "height"
+    }).encode()
+
+    async def body():
+        yield line + b"\n" + b"x" * 100
+        # a line with no end in sight is dropped as it arrives, not held in memory
+        for _ in range(50):
+            yield b"x" * 100
+        yield b"\n" + line + b"\n  \n" + line
+
+    async def results():
+        return [chunk async for chunk in calculate_measurement_stream(
+            "uk-who", body(), chunk_size=3, max_line_bytes=len(line))]
+
+    results = [json.loads(result) for chunk in asyncio.run(results()) for result in chunk.splitlines()]
+
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert results[1]["errors"][0]["type"] == "value_error.line_too_long"
+    assert results[0]["calculation"] == results[2]["calculation"] == results[3]["calculation"]
+    assert results[3]["calculation"] is not None